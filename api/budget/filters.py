@@ -1,7 +1,7 @@
-from django_filters import NumberFilter
+from django_filters import CharFilter, NumberFilter
 from django_filters.rest_framework import FilterSet
 
-from plugins.snt_malaria.models.budget import Budget
+from plugins.snt_malaria.models.budget import Budget, BudgetLine
 
 
 class BudgetListFilter(FilterSet):
@@ -10,3 +10,14 @@ class BudgetListFilter(FilterSet):
     class Meta:
         model = Budget
         fields = ["scenario_id"]
+
+
+class BudgetLineFilter(FilterSet):
+    year = NumberFilter(field_name="year", lookup_expr="exact")
+    org_unit_id = NumberFilter(field_name="org_unit_id", lookup_expr="exact")
+    intervention_id = NumberFilter(field_name="intervention_id", lookup_expr="exact")
+    category = CharFilter(field_name="category", lookup_expr="exact")
+
+    class Meta:
+        model = BudgetLine
+        fields = ["year", "org_unit_id", "intervention_id", "category"]
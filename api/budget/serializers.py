@@ -1,7 +1,15 @@
 from rest_framework import exceptions, serializers
 
+from plugins.snt_malaria.models import Intervention, InterventionCostBreakdownLine
 from plugins.snt_malaria.models.budget import Budget
+from plugins.snt_malaria.models.scenario import Scenario
 from plugins.snt_malaria.permissions import SNT_SCENARIO_FULL_WRITE_PERMISSION
+from plugins.snt_malaria.services.budget.sensitivity import (
+    DEFAULT_DRAWS,
+    DEFAULT_PERCENTILES,
+    DISTRIBUTION_FIXED,
+    DISTRIBUTION_PARAMETERS,
+)
 
 
 class BudgetSerializer(serializers.ModelSerializer):
@@ -37,3 +45,195 @@ class BudgetCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Scenario must have at least one intervention assignment.")
 
         return value
+
+
+class BudgetScenarioQuerySerializer(serializers.Serializer):
+    """Query parameters selecting a scenario of the user's account."""
+
+    scenario_id = serializers.PrimaryKeyRelatedField(queryset=Scenario.objects.none(), source="scenario")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        account = self.context["request"].user.iaso_profile.account
+        self.fields["scenario_id"].queryset = Scenario.objects.filter(account=account)
+
+
+class BudgetLinesQuerySerializer(BudgetScenarioQuerySerializer):
+    """Query parameters of the budget lines aggregation, on top of BudgetLineFilter's filters."""
+
+    GROUP_BY_FIELDS = ["year", "org_unit_id", "intervention_id", "cost_line_id", "category", "grant_id"]
+
+    group_by = serializers.CharField(required=False, default="")
+
+    def validate_group_by(self, value):
+        fields = [field.strip() for field in value.split(",") if field.strip()]
+        invalid = [field for field in fields if field not in self.GROUP_BY_FIELDS]
+        if invalid:
+            raise serializers.ValidationError(
+                f"Invalid group_by field(s): {', '.join(invalid)}. Allowed: {', '.join(self.GROUP_BY_FIELDS)}."
+            )
+        return list(dict.fromkeys(fields))
+
+
+class BudgetRollupsQuerySerializer(BudgetScenarioQuerySerializer):
+    """Query parameters of the budget rollups: optionally a single year."""
+
+    year = serializers.IntegerField(required=False)
+
+
+class BudgetExportQuerySerializer(BudgetScenarioQuerySerializer):
+    """Query parameters of the budget rows export, on top of BudgetLineFilter's filters.
+
+    Named file_format because DRF reserves the format query parameter for renderer selection.
+    """
+
+    FILE_FORMAT_CSV = "csv"
+    FILE_FORMAT_PARQUET = "parquet"
+
+    file_format = serializers.ChoiceField(
+        choices=[FILE_FORMAT_CSV, FILE_FORMAT_PARQUET], required=False, default=FILE_FORMAT_CSV
+    )
+
+
+class BudgetCompareQuerySerializer(serializers.Serializer):
+    """Query parameters of the budget comparison: comma-separated scenario_ids, the first one being the baseline."""
+
+    MAX_SCENARIOS = 10
+
+    scenario_ids = serializers.CharField()
+
+    def validate_scenario_ids(self, value):
+        try:
+            scenario_ids = list(dict.fromkeys(int(scenario_id) for scenario_id in value.split(",") if scenario_id))
+        except ValueError:
+            raise serializers.ValidationError("scenario_ids must be a comma-separated list of integers.")
+        if not 2 <= len(scenario_ids) <= self.MAX_SCENARIOS:
+            raise serializers.ValidationError(f"Between 2 and {self.MAX_SCENARIOS} scenarios can be compared.")
+
+        account = self.context["request"].user.iaso_profile.account
+        scenarios_by_id = Scenario.objects.filter(account=account, id__in=scenario_ids).in_bulk()
+        missing_ids = [scenario_id for scenario_id in scenario_ids if scenario_id not in scenarios_by_id]
+        if missing_ids:
+            raise serializers.ValidationError(f"Scenario(s) not found: {', '.join(map(str, missing_ids))}.")
+
+        scenarios = [scenarios_by_id[scenario_id] for scenario_id in scenario_ids]
+        if any(scenario.start_year is None or scenario.end_year is None for scenario in scenarios):
+            raise serializers.ValidationError("Scenarios must have start_year and end_year defined.")
+        return scenarios
+
+
+class BudgetDistributionSerializer(serializers.Serializer):
+    """A probability distribution of the budget sensitivity analysis, e.g. {"distribution": "uniform", "low": 0.03, "high": 0.08}."""
+
+    distribution = serializers.ChoiceField(choices=list(DISTRIBUTION_PARAMETERS))
+    value = serializers.FloatField(required=False)
+    low = serializers.FloatField(required=False)
+    mode = serializers.FloatField(required=False)
+    high = serializers.FloatField(required=False)
+    mean = serializers.FloatField(required=False)
+    std = serializers.FloatField(required=False, min_value=0)
+
+    def validate(self, attrs):
+        missing = [name for name in DISTRIBUTION_PARAMETERS[attrs["distribution"]] if name not in attrs]
+        if missing:
+            raise serializers.ValidationError(f"A {attrs['distribution']} distribution requires: {', '.join(missing)}.")
+        bounds = [attrs[name] for name in ("low", "mode", "high") if name in attrs]
+        if attrs["distribution"] != DISTRIBUTION_FIXED and bounds != sorted(bounds):
+            raise serializers.ValidationError("Expected low <= mode <= high.")
+        return attrs
+
+
+class BudgetCostLineDistributionsSerializer(serializers.Serializer):
+    """Distributions of multipliers of a cost line value: a default and per cost line id overrides."""
+
+    default = BudgetDistributionSerializer(required=False)
+    cost_lines = serializers.DictField(child=BudgetDistributionSerializer(), required=False)
+
+    def validate_cost_lines(self, value):
+        try:
+            return {int(cost_line_id): distribution for cost_line_id, distribution in value.items()}
+        except ValueError:
+            raise serializers.ValidationError("cost_lines must be keyed by cost line id.")
+
+
+class BudgetComputationSerializer(BudgetScenarioQuerySerializer):
+    """Body of a computation over a scenario budget, which needs the scenario years."""
+
+    def validate_scenario_id(self, value):
+        if value.start_year is None or value.end_year is None:
+            raise serializers.ValidationError("Scenario must have start_year and end_year defined.")
+        return value
+
+
+class BudgetSensitivitySerializer(BudgetComputationSerializer):
+    """Body of the budget sensitivity analysis."""
+
+    MAX_DRAWS = 20000
+
+    draws = serializers.IntegerField(min_value=1, max_value=MAX_DRAWS, default=DEFAULT_DRAWS)
+    seed = serializers.IntegerField(required=False, allow_null=True, min_value=0, default=None)
+    percentiles = serializers.ListField(
+        child=serializers.FloatField(min_value=0, max_value=100),
+        allow_empty=False,
+        default=list(DEFAULT_PERCENTILES),
+    )
+    inflation_rate = BudgetDistributionSerializer(required=False)
+    buffer = BudgetDistributionSerializer(required=False)
+    unit_cost = BudgetCostLineDistributionsSerializer(required=False)
+    conversion_factor = BudgetCostLineDistributionsSerializer(required=False)
+
+
+class BudgetPreviewCostLineSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    unit_cost = serializers.DecimalField(max_digits=19, decimal_places=2, min_value=0, required=False)
+    conversion_factor = serializers.DecimalField(max_digits=19, decimal_places=6, min_value=0, required=False)
+    invert_conversion_factor = serializers.BooleanField(required=False)
+
+
+class BudgetPreviewYearlyValueSerializer(serializers.Serializer):
+    cost_line_id = serializers.IntegerField()
+    year = serializers.IntegerField()
+    value = serializers.DecimalField(max_digits=19, decimal_places=2)
+
+
+class BudgetPreviewAssignmentsSerializer(serializers.Serializer):
+    intervention_id = serializers.IntegerField()
+    org_unit_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+
+class BudgetPreviewSerializer(BudgetComputationSerializer):
+    """Body of a budget preview: unsaved edits of the scenario's budget inputs."""
+
+    cost_lines = BudgetPreviewCostLineSerializer(many=True, required=False, default=list)
+    yearly_values = BudgetPreviewYearlyValueSerializer(many=True, required=False, default=list)
+    add_assignments = BudgetPreviewAssignmentsSerializer(many=True, required=False, default=list)
+    remove_assignments = BudgetPreviewAssignmentsSerializer(many=True, required=False, default=list)
+    inflation_rate = serializers.DecimalField(max_digits=20, decimal_places=10, min_value=-1, required=False)
+    buffer = serializers.DecimalField(max_digits=5, decimal_places=4, min_value=0, required=False)
+
+    def validate(self, attrs):
+        account = self.context["request"].user.iaso_profile.account
+        changes = attrs["add_assignments"] + attrs["remove_assignments"]
+
+        intervention_by_id = Intervention.objects.filter(
+            intervention_category__account=account, id__in={change["intervention_id"] for change in changes}
+        ).in_bulk()
+        unknown_ids = sorted({change["intervention_id"] for change in changes} - set(intervention_by_id))
+        if unknown_ids:
+            raise serializers.ValidationError({"interventions": f"Unknown interventions: {unknown_ids}"})
+        for change in changes:
+            change["intervention"] = intervention_by_id[change.pop("intervention_id")]
+
+        cost_line_ids = {line["id"] for line in attrs["cost_lines"]} | {
+            value["cost_line_id"] for value in attrs["yearly_values"]
+        }
+        known_ids = set(
+            InterventionCostBreakdownLine.objects.filter(
+                intervention__intervention_category__account=account, id__in=cost_line_ids
+            ).values_list("id", flat=True)
+        )
+        if cost_line_ids - known_ids:
+            raise serializers.ValidationError(
+                {"cost_lines": f"Unknown cost lines: {sorted(cost_line_ids - known_ids)}"}
+            )
+        return attrs
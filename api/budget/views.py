@@ -1,16 +1,45 @@
+import tempfile
+
+from datetime import datetime
+
+from django.db.models import Sum
+from django.http import FileResponse, StreamingHttpResponse
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
-from plugins.snt_malaria.api.budget.filters import BudgetListFilter
+from iaso.api.common import CONTENT_TYPE_CSV
+from plugins.snt_malaria.api.budget.filters import BudgetLineFilter, BudgetListFilter
 from plugins.snt_malaria.api.budget.permissions import BudgetPermission
 from plugins.snt_malaria.api.budget.serializers import (
+    BudgetCompareQuerySerializer,
     BudgetCreateSerializer,
+    BudgetExportQuerySerializer,
+    BudgetLinesQuerySerializer,
+    BudgetPreviewSerializer,
+    BudgetRollupsQuerySerializer,
+    BudgetSensitivitySerializer,
     BudgetSerializer,
 )
 from plugins.snt_malaria.models.budget import Budget
 from plugins.snt_malaria.models.scenario import Scenario
 from plugins.snt_malaria.services import BudgetCalculationService
+from plugins.snt_malaria.services.budget.comparison import compare_scenario_budgets
+from plugins.snt_malaria.services.budget.export import (
+    aggregate_computed_line_rows,
+    iter_computed_line_rows,
+    iter_csv,
+    iter_stored_line_rows,
+    write_parquet,
+)
+from plugins.snt_malaria.services.budget.preview import preview_budget
+from plugins.snt_malaria.services.budget.sensitivity import BudgetSensitivityAnalysis
+from plugins.snt_malaria.tasks.recompute_budget import is_budget_recompute_pending
+
+
+BUDGET_STATUS_PENDING = "pending"
+BUDGET_STATUS_READY = "ready"
 
 
 class BudgetViewSet(viewsets.ModelViewSet):
@@ -51,14 +80,229 @@ class BudgetViewSet(viewsets.ModelViewSet):
             status=status.HTTP_200_OK,
         )
 
+    @action(detail=False, methods=["get"])
+    def compare(self, request):
+        """Compare the budgets of 2 to 10 scenarios, computed from their current data.
+
+        Returns per-scenario totals with per-year, per-intervention and per-org-unit totals, each with
+        its delta to the first scenario of scenario_ids. Inputs shared by the scenarios are loaded once.
+        """
+        query_serializer = BudgetCompareQuerySerializer(data=request.query_params, context={"request": request})
+        query_serializer.is_valid(raise_exception=True)
+        scenarios = query_serializer.validated_data["scenario_ids"]
+
+        comparisons = compare_scenario_budgets(scenarios)
+        return Response(
+            {
+                "baseline_scenario_id": scenarios[0].id,
+                "scenarios": [comparison.model_dump(mode="json") for comparison in comparisons],
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @action(detail=False, methods=["post"])
+    def sensitivity(self, request):
+        """Monte Carlo sensitivity of a scenario budget to inflation_rate, buffer, unit_cost and conversion_factor.
+
+        Each parameter takes a distribution (unit_cost and conversion_factor: of multipliers of the cost
+        line values, with per cost line overrides); the others keep their current value. Returns the
+        base total, mean and percentiles over the draws, per year and per intervention.
+        """
+        serializer = BudgetSensitivitySerializer(data=request.data, context={"request": request})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        service = BudgetCalculationService(data["scenario"], engine=BudgetCalculationService.ENGINE_VECTORIZED)
+        result = BudgetSensitivityAnalysis(service).run(
+            draws=data["draws"],
+            seed=data["seed"],
+            percentiles=data["percentiles"],
+            inflation_rate=data.get("inflation_rate"),
+            buffer=data.get("buffer"),
+            unit_cost=data.get("unit_cost"),
+            conversion_factor=data.get("conversion_factor"),
+        )
+        return Response(result.model_dump(mode="json"), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["post"])
+    def preview(self, request):
+        """Return the budget of a scenario with unsaved edits applied, without storing it.
+
+        Edits: cost line unit_cost / conversion_factor / invert_conversion_factor, yearly values,
+        interventions added to or removed from org units, inflation_rate and buffer. The results
+        have the shape of a stored budget's results.
+        """
+        serializer = BudgetPreviewSerializer(data=request.data, context={"request": request})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        scenario = data.pop("scenario")
+
+        results = preview_budget(scenario, **data)
+        return Response(
+            {
+                "scenario_id": scenario.id,
+                "total_cost": sum(year["total_cost"] for year in results),
+                "results": results,
+            },
+            status=status.HTTP_200_OK,
+        )
+
     @action(detail=False, methods=["get"])
     def get_latest(self, _request):
+        """Return the latest computed budget.
+
+        status is "pending" while a background recompute of the scenario is queued or running, in
+        which case the returned budget is the previous one.
+        """
         queryset = self.filter_queryset(self.get_queryset())
         budget = queryset.order_by("-created_at").first()
         if not budget:
             return Response({"detail": "No budget found"}, status=status.HTTP_404_NOT_FOUND)
         serializer = BudgetSerializer(budget)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        budget_status = BUDGET_STATUS_PENDING if is_budget_recompute_pending(budget.scenario) else BUDGET_STATUS_READY
+        return Response({**serializer.data, "status": budget_status}, status=status.HTTP_200_OK)
+
+    def _get_line_filter(self, request, budget):
+        line_filter = BudgetLineFilter(request.query_params, queryset=budget.lines.all())
+        if not line_filter.is_valid():
+            raise ValidationError(line_filter.errors)
+        return line_filter
+
+    @staticmethod
+    def _get_filter_values(line_filter):
+        """The filters of a valid BudgetLineFilter, to apply to computed rows."""
+        return {field: value for field, value in line_filter.form.cleaned_data.items() if value not in (None, "")}
+
+    @action(detail=False, methods=["get"])
+    def lines(self, request):
+        """Aggregate the latest budget of a scenario from its stored budget lines.
+
+        Filters (year, org_unit_id, intervention_id, category) and the optional comma-separated
+        group_by fields are applied in SQL, so only the requested slice is read. Budgets stored before
+        budget lines existed are aggregated from rows recomputed from the scenario, as in export.
+        """
+        query_serializer = BudgetLinesQuerySerializer(data=request.query_params, context={"request": request})
+        query_serializer.is_valid(raise_exception=True)
+        scenario = query_serializer.validated_data["scenario"]
+        group_by = query_serializer.validated_data["group_by"]
+
+        budget = Budget.objects.filter(scenario=scenario).order_by("-created_at").first()
+        if not budget:
+            return Response({"detail": "No budget found"}, status=status.HTTP_404_NOT_FOUND)
+
+        line_filter = self._get_line_filter(request, budget)
+        if budget.lines.exists():
+            lines = line_filter.qs
+            totals = lines.aggregate(total_quantity=Sum("quantity"), total_cost=Sum("cost"))
+            total_quantity, total_cost = totals["total_quantity"], totals["total_cost"]
+            groups = []
+            if group_by:
+                groups = [
+                    ([row[field] for field in group_by], row["total_quantity"], row["total_cost"])
+                    for row in lines.values(*group_by)
+                    .annotate(total_quantity=Sum("quantity"), total_cost=Sum("cost"))
+                    .order_by(*group_by)
+                ]
+        else:
+            # Budget stored before budget lines existed: aggregate its rows recomputed from the scenario.
+            total_quantity, total_cost, groups = aggregate_computed_line_rows(
+                scenario, self._get_filter_values(line_filter), group_by
+            )
+
+        results = [
+            {**dict(zip(group_by, values)), "quantity": float(quantity), "total_cost": float(cost)}
+            for values, quantity, cost in groups
+        ]
+
+        return Response(
+            {
+                "budget_id": budget.id,
+                "scenario_id": scenario.id,
+                "quantity": float(total_quantity or 0),
+                "total_cost": float(total_cost or 0),
+                "results": results,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @action(detail=False, methods=["get"])
+    def rollups(self, request):
+        """Return the org unit rollups of the latest budget of a scenario, without the per org unit costs.
+
+        Rollups sum the org unit costs per ancestor at the account's focus org unit type (e.g. regions).
+        Budgets computed before rollups existed, or for accounts without a focus org unit type, have none.
+        """
+        query_serializer = BudgetRollupsQuerySerializer(data=request.query_params, context={"request": request})
+        query_serializer.is_valid(raise_exception=True)
+        scenario = query_serializer.validated_data["scenario"]
+        year = query_serializer.validated_data.get("year")
+
+        budget = Budget.objects.filter(scenario=scenario).order_by("-created_at").first()
+        if not budget:
+            return Response({"detail": "No budget found"}, status=status.HTTP_404_NOT_FOUND)
+
+        year_results = budget.results if isinstance(budget.results, list) else []
+        return Response(
+            {
+                "budget_id": budget.id,
+                "scenario_id": scenario.id,
+                "years": [
+                    {
+                        "year": year_result["year"],
+                        "total_cost": year_result["total_cost"],
+                        "org_unit_rollups": year_result.get("org_unit_rollups", []),
+                    }
+                    for year_result in year_results
+                    if year is None or year_result["year"] == year
+                ],
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        """Stream the rows of the latest budget of a scenario as CSV (default) or Parquet (file_format=parquet).
+
+        Accepts the same filters as the lines action. Rows are read in batches, so the export runs in
+        constant memory. Parquet requires the optional pyarrow dependency.
+        """
+        query_serializer = BudgetExportQuerySerializer(data=request.query_params, context={"request": request})
+        query_serializer.is_valid(raise_exception=True)
+        scenario = query_serializer.validated_data["scenario"]
+        file_format = query_serializer.validated_data["file_format"]
+
+        budget = Budget.objects.filter(scenario=scenario).order_by("-created_at").first()
+        if not budget:
+            return Response({"detail": "No budget found"}, status=status.HTTP_404_NOT_FOUND)
+
+        line_filter = self._get_line_filter(request, budget)
+        if budget.lines.exists():
+            rows = iter_stored_line_rows(line_filter.qs)
+        else:
+            # Budget stored before budget lines existed: recompute its rows from the scenario.
+            rows = iter_computed_line_rows(scenario, self._get_filter_values(line_filter))
+
+        filename = "budget_%s_%s" % (scenario.id, datetime.now().strftime("%Y-%m-%d"))
+        if file_format == BudgetExportQuerySerializer.FILE_FORMAT_PARQUET:
+            parquet_file = tempfile.TemporaryFile()
+            try:
+                write_parquet(rows, parquet_file)
+            except ImportError:
+                parquet_file.close()
+                return Response(
+                    {"detail": "Parquet export is not available on this server."}, status=status.HTTP_400_BAD_REQUEST
+                )
+            parquet_file.seek(0)
+            return FileResponse(
+                parquet_file,
+                as_attachment=True,
+                filename=f"{filename}.parquet",
+                content_type="application/vnd.apache.parquet",
+            )
+
+        response = StreamingHttpResponse(iter_csv(rows), content_type=CONTENT_TYPE_CSV)
+        response["Content-Disposition"] = f"attachment; filename={filename}.csv"
+        return response
 
     def get_serializer_class(self):
         if self.action == "create":
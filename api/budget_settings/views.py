@@ -3,6 +3,7 @@ from rest_framework import viewsets
 from plugins.snt_malaria.api.budget_settings.permissions import BudgetSettingsPermission
 from plugins.snt_malaria.api.budget_settings.serializers import BudgetSettingsSerializer
 from plugins.snt_malaria.models.budget_settings import BudgetSettings
+from plugins.snt_malaria.services.budget.inputs import invalidate_account_cached_inputs
 
 
 class BudgetSettingsViewSet(viewsets.ModelViewSet):
@@ -14,3 +15,7 @@ class BudgetSettingsViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         return BudgetSettings.objects.filter(account=self.request.user.iaso_profile.account)
+
+    def perform_update(self, serializer):
+        budget_settings = serializer.save()
+        invalidate_account_cached_inputs(budget_settings.account_id)
@@ -12,6 +12,7 @@ from plugins.snt_malaria.services.composite.persistence import (
     run_and_persist_composite_layer,
     update_composite_metric_type,
 )
+from plugins.snt_malaria.services.rules.cache import invalidate_matches_cache
 
 from .permissions import SHOW_DEV_FEATURES, CompositeLayerPermission
 from .serializers import (
@@ -136,6 +137,7 @@ class CompositeLayerViewSet(viewsets.ModelViewSet):
         super().perform_destroy(instance)
         if metric_type is not None:
             metric_type.delete()
+            invalidate_matches_cache(metric_type.account_id)
 
     @action(detail=False, methods=["post"])
     def preview(self, request, *args, **kwargs):
@@ -1,10 +1,13 @@
 from django.db import IntegrityError
 from django.utils.translation import gettext_lazy as _
-from rest_framework import serializers, viewsets
+from rest_framework import serializers, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
 
 from plugins.snt_malaria.api.grants.permissions import GrantPermission
 from plugins.snt_malaria.api.grants.serializers import GrantSerializer
 from plugins.snt_malaria.models import Grant
+from plugins.snt_malaria.services.budget.grants import grant_utilization
 
 
 class GrantViewSet(viewsets.ModelViewSet):
@@ -28,6 +31,12 @@ class GrantViewSet(viewsets.ModelViewSet):
         except IntegrityError as e:
             self._raise_for_integrity_error(e)
 
+    @action(detail=False, methods=["get"])
+    def utilization(self, request):
+        """Return, per grant, its consumption by the latest budget of each scenario versus its amount."""
+        items = grant_utilization(request.user.iaso_profile.account)
+        return Response([item.model_dump(mode="json") for item in items], status=status.HTTP_200_OK)
+
     # Deleting a grant unassigns it from any interventions/assignments
     # (grant FK uses on_delete=SET_NULL), so the default destroy is sufficient.
 
@@ -52,22 +52,26 @@ class ImpactViewSet(viewsets.ViewSet):
         year_to = data["year_to"]
 
         ttl = impact_cache.get_ttl(request.user.iaso_profile.account)
+        return Response(get_scenario_impact_data(provider, scenario, age_group, year_from, year_to, ttl))
 
-        if ttl:
-            cached = impact_cache.get(scenario.id, age_group, year_from, year_to)
-            if cached is not None:
-                return Response(cached)
 
-        service = ImpactService(provider)
-        result = service.get_scenario_impact(
-            scenario=scenario,
-            age_group=age_group,
-            year_from=year_from,
-            year_to=year_to,
-        )
-        response_data = ScenarioImpactSerializer(result).data
+def get_scenario_impact_data(provider, scenario, age_group, year_from, year_to, ttl):
+    """Serialized impact of a scenario, served from the view-level cache when ttl is set."""
+    if ttl:
+        cached = impact_cache.get(scenario.id, age_group, year_from, year_to)
+        if cached is not None:
+            return cached
 
-        if ttl:
-            impact_cache.set(scenario.id, age_group, year_from, year_to, response_data, ttl)
+    service = ImpactService(provider)
+    result = service.get_scenario_impact(
+        scenario=scenario,
+        age_group=age_group,
+        year_from=year_from,
+        year_to=year_to,
+    )
+    response_data = ScenarioImpactSerializer(result).data
 
-        return Response(response_data)
+    if ttl:
+        impact_cache.set(scenario.id, age_group, year_from, year_to, response_data, ttl)
+
+    return response_data
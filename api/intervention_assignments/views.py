@@ -9,6 +9,7 @@ from plugins.snt_malaria.api.intervention_assignments.filters import (
 )
 from plugins.snt_malaria.models import InterventionAssignment
 from plugins.snt_malaria.permissions import SNT_SCENARIO_FULL_WRITE_PERMISSION
+from plugins.snt_malaria.services.budget.inputs import invalidate_cached_inputs
 
 from .permissions import InterventionAssignmentsPermission
 from .serializers import (
@@ -41,6 +42,7 @@ class InterventionAssignmentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
         assignment.delete()
+        invalidate_cached_inputs(scenario.id)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -73,7 +75,10 @@ class InterventionAssignmentViewSet(viewsets.ModelViewSet):
                     {"assignment_id": "This assigment was not found."},
                     status=status.HTTP_404_NOT_FOUND,
                 )
+        scenario_ids = {assignment.scenario_id for assignment in assignments}
         deleted_count, _ = assignments.delete()
+        for scenario_id in scenario_ids:
+            invalidate_cached_inputs(scenario_id)
         return Response(
             {"message": f"{deleted_count} intervention assignments deleted."},
             status=status.HTTP_204_NO_CONTENT,
@@ -1,6 +1,7 @@
 from decimal import Decimal
 
 from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 
 from iaso.models.metric import MetricType
@@ -13,6 +14,7 @@ class InterventionCostBreakdownLineWriteListSerializer(serializers.ListSerialize
         request = self.context.get("request")
         request_user = request.user if request else None
 
+        now = timezone.now()
         existing_lines = {line.id: line for line in queryset}
         lines_to_update = []
         lines_to_create = []
@@ -25,6 +27,8 @@ class InterventionCostBreakdownLineWriteListSerializer(serializers.ListSerialize
                     setattr(line, attr, value)
 
                 line.updated_by = request_user
+                # bulk_update does not apply auto_now: the budget caches read updated_at.
+                line.updated_at = now
                 lines_to_update.append(line)
                 lines_to_delete.discard(line_id)
             else:
@@ -47,6 +51,7 @@ class InterventionCostBreakdownLineWriteListSerializer(serializers.ListSerialize
                         "category",
                         "intervention",
                         "updated_by",
+                        "updated_at",
                         "population_layer",
                         "is_proportional",
                         "conversion_factor",
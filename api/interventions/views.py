@@ -11,7 +11,7 @@ from plugins.snt_malaria.api.interventions.serializers import (
 )
 from plugins.snt_malaria.models import Intervention
 from plugins.snt_malaria.models.intervention import InterventionAssignment
-from plugins.snt_malaria.services import BudgetCalculationService
+from plugins.snt_malaria.tasks.recompute_budget import request_budget_recompute
 
 
 class InterventionViewSet(viewsets.ModelViewSet):
@@ -47,7 +47,6 @@ class InterventionViewSet(viewsets.ModelViewSet):
 
         scenarios = intervention.intervention_category.account.scenario_set.filter(id__in=scenario_ids)
         for scenario in scenarios:
-            budget_service = BudgetCalculationService(scenario)
-            budget_service.calculate_and_save_all_years(self.request.user)
+            request_budget_recompute(scenario, self.request.user)
 
         return Response(InterventionDetailSerializer(intervention).data, status=status.HTTP_200_OK)
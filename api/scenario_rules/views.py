@@ -4,7 +4,8 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from plugins.snt_malaria.models import ScenarioRule
-from plugins.snt_malaria.services import BudgetCalculationService
+from plugins.snt_malaria.services.rules.cache import cached_matched_org_units
+from plugins.snt_malaria.tasks.recompute_budget import request_budget_recompute
 
 from .permissions import ScenarioRulePermission
 from .serializers import (
@@ -62,15 +63,14 @@ class ScenarioRuleViewSet(viewsets.ModelViewSet):
         user = self.request.user
         scenario = serializer.validated_data["scenario"]
         matching_criteria = serializer.validated_data.get("matching_criteria")
-        org_units_matched = ScenarioRule.resolve_matched_org_units(
+        org_units_matched = cached_matched_org_units(
             scenario.account, matching_criteria, reference_year=scenario.reference_year
         )
 
         rule: ScenarioRule = serializer.save(created_by=user, org_units_matched=org_units_matched)
         rule.scenario.refresh_assignments(user)
 
-        budget_service = BudgetCalculationService(scenario)
-        budget_service.calculate_and_save_all_years(user)
+        request_budget_recompute(scenario, user)
 
     @transaction.atomic
     def create(self, request, *args, **kwargs):
@@ -98,15 +98,14 @@ class ScenarioRuleViewSet(viewsets.ModelViewSet):
         user = self.request.user
         instance = serializer.instance
         matching_criteria = serializer.validated_data.get("matching_criteria", instance.matching_criteria)
-        org_units_matched = ScenarioRule.resolve_matched_org_units(
+        org_units_matched = cached_matched_org_units(
             instance.scenario.account, matching_criteria, reference_year=instance.scenario.reference_year
         )
 
         rule: ScenarioRule = serializer.save(updated_by=user, org_units_matched=org_units_matched)
         rule.scenario.refresh_assignments(user)
 
-        budget_service = BudgetCalculationService(rule.scenario)
-        budget_service.calculate_and_save_all_years(user)
+        request_budget_recompute(rule.scenario, user)
 
     @transaction.atomic
     def update(self, request, *args, **kwargs):
@@ -129,8 +128,7 @@ class ScenarioRuleViewSet(viewsets.ModelViewSet):
         scenario = instance.scenario
         super().perform_destroy(instance)
         scenario.refresh_assignments(self.request.user)
-        budget_service = BudgetCalculationService(scenario)
-        budget_service.calculate_and_save_all_years(self.request.user)
+        request_budget_recompute(scenario, self.request.user)
 
     @action(detail=False, methods=["post"])
     def preview(self, request, *args, **kwargs):
@@ -140,7 +138,7 @@ class ScenarioRuleViewSet(viewsets.ModelViewSet):
         account = request.user.iaso_profile.account
         matching_criteria = serializer.validated_data.get("matching_criteria")
         reference_year = serializer.validated_data.get("reference_year")
-        matched = set(ScenarioRule.resolve_matched_org_units(account, matching_criteria, reference_year=reference_year))
+        matched = set(cached_matched_org_units(account, matching_criteria, reference_year=reference_year))
 
         excluded = set(serializer.validated_data.get("org_units_excluded", []))
         included = set(serializer.validated_data.get("org_units_included", []))
@@ -1,3 +1,6 @@
+import random
+
+from django.conf import settings
 from rest_framework import status, viewsets
 from rest_framework.response import Response
 
@@ -9,6 +12,7 @@ from plugins.snt_malaria.api.scenario_yearly_cost_assignment.serializers import
 )
 from plugins.snt_malaria.models import ScenarioYearlyCostAssignment
 from plugins.snt_malaria.services import BudgetCalculationService
+from plugins.snt_malaria.tasks.recompute_budget import is_budget_recompute_pending, request_budget_recompute
 
 
 class ScenarioYearlyCostAssignmentViewSet(viewsets.ModelViewSet):
@@ -37,8 +41,22 @@ class ScenarioYearlyCostAssignmentViewSet(viewsets.ModelViewSet):
 
         return Response(list_serializer.data, status=status.HTTP_200_OK)
 
-    def _recalculate_budget(self, scenario):
-        BudgetCalculationService(scenario).calculate_and_save_all_years(self.request.user)
+    def _recalculate_budget(self, yearly_cost_assignment):
+        scenario = yearly_cost_assignment.scenario
+        if is_budget_recompute_pending(scenario):
+            # The latest budget is about to be replaced: patching it would be lost or race with the recompute.
+            request_budget_recompute(scenario, self.request.user)
+            return
+
+        # Only the edited (cost line, year) cell changed: patch the latest budget instead of recomputing it.
+        # A sample of the patches is checked against a full recompute, which replaces the patch if they differ.
+        BudgetCalculationService.recalculate_cost_line_year(
+            scenario,
+            yearly_cost_assignment.cost_line_id,
+            yearly_cost_assignment.year,
+            self.request.user,
+            verify=random.random() < settings.BUDGET_PATCH_VERIFY_RATE,
+        )
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -52,8 +70,7 @@ class ScenarioYearlyCostAssignmentViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         response = super().perform_create(serializer)
         # After creating/updating the ScenarioYearlyCostAssignment, we need to recalculate the budget for the related scenario to reflect the changes in the assigned costs
-        scenario = serializer.validated_data["scenario"]
-        self._recalculate_budget(scenario)
+        self._recalculate_budget(serializer.instance)
 
         return response
 
@@ -70,7 +87,6 @@ class ScenarioYearlyCostAssignmentViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         response = super().perform_update(serializer)
         # After creating/updating the ScenarioYearlyCostAssignment, we need to recalculate the budget for the related scenario to reflect the changes in the assigned costs
-        scenario = serializer.instance.scenario
-        self._recalculate_budget(scenario)
+        self._recalculate_budget(serializer.instance)
 
         return response
@@ -0,0 +1,118 @@
+"""
+Side-by-side comparison of the budget and impact of several scenarios, for ScenarioViewSet.compare.
+
+The budgets of all the scenarios are computed by one job (compare_scenario_budgets loads their shared
+inputs once) and the impact of each scenario by a job of its own, since each may query the provider's
+database. The jobs run concurrently in a pool of settings.SCENARIO_COMPARE_MAX_WORKERS threads.
+
+The first scenario is the baseline: a scenario's cases averted and cost per case averted are relative to it.
+The impacts and cost totals of all the scenarios cover the same years, by default the baseline's, so the
+cost per case averted divides costs and cases of the same period.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from functools import partial
+
+from django.conf import settings
+from django.db import connections
+
+from plugins.snt_malaria.api.impact import cache as impact_cache
+from plugins.snt_malaria.api.impact.views import get_scenario_impact_data
+from plugins.snt_malaria.providers.impact import get_provider_for_account
+from plugins.snt_malaria.services.budget.comparison import compare_scenario_budgets
+
+
+COMPARED_METRICS = ("number_cases", "number_severe_cases", "prevalence_rate", "direct_deaths")
+
+
+def run_jobs(jobs, max_workers):
+    """Call the jobs, at most max_workers at a time, and return their results in order.
+
+    With a single worker the jobs are called one after the other in the current thread.
+    """
+    if max_workers <= 1 or len(jobs) <= 1:
+        return [job() for job in jobs]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as executor:
+        futures = [executor.submit(_run_job, job) for job in jobs]
+        return [future.result() for future in futures]
+
+
+def _run_job(job):
+    try:
+        return job()
+    finally:
+        # Django opens database connections per thread: close the ones this worker thread opened.
+        connections.close_all()
+
+
+def compare_scenarios(account, scenarios, age_group=None, year_from=None, year_to=None):
+    """Return the comparison summary of each scenario, in order.
+
+    Impact is only fetched for an age group, when the account has an impact provider. Impact, total cost
+    and cost delta cover year_from to year_to for every scenario, by default the years of the baseline;
+    the per-year series cover every year of the scenario.
+    """
+    baseline = scenarios[0]
+    year_from = year_from if year_from is not None else baseline.start_year
+    year_to = year_to if year_to is not None else baseline.end_year
+    jobs = [partial(compare_scenario_budgets, scenarios)]
+    provider = get_provider_for_account(account) if age_group else None
+    if provider is not None:
+        ttl = impact_cache.get_ttl(account)
+        jobs += [
+            partial(get_scenario_impact_data, provider, scenario, age_group, year_from, year_to, ttl)
+            for scenario in scenarios
+        ]
+
+    budgets, *impacts = run_jobs(jobs, settings.SCENARIO_COMPARE_MAX_WORKERS)
+    summaries = [
+        _summary(scenario, budget, impact, year_from, year_to)
+        for scenario, budget, impact in zip(scenarios, budgets, impacts or [None] * len(scenarios))
+    ]
+    for summary in summaries:
+        summary["cost_delta"] = summary["total_cost"] - summaries[0]["total_cost"]
+        summary["cases_averted"], summary["cost_per_case_averted"] = _cost_per_case_averted(summary, summaries[0])
+    return summaries
+
+
+def _metrics(impact):
+    return {name: dict(impact[name]) if impact else None for name in COMPARED_METRICS}
+
+
+def _summary(scenario, budget, impact, year_from, year_to):
+    cost_by_year = {year.year: float(year.total_cost) for year in budget.years}
+    window_cost = sum(
+        (year.total_cost for year in budget.years if year_from <= year.year <= year_to), start=Decimal("0")
+    )
+    impact_by_year = {year["year"]: year for year in impact["by_year"]} if impact else {}
+    return {
+        "scenario_id": scenario.id,
+        "name": scenario.name,
+        "start_year": scenario.start_year,
+        "end_year": scenario.end_year,
+        "total_cost": float(window_cost),
+        # Set against the baseline once every summary is built.
+        "cost_delta": None,
+        **_metrics(impact),
+        "years": [
+            {"year": year, "total_cost": cost_by_year.get(year, 0.0), **_metrics(impact_by_year.get(year))}
+            for year in sorted(set(cost_by_year) | set(impact_by_year))
+        ],
+    }
+
+
+def _cost_per_case_averted(summary, baseline):
+    """(cases averted, cost per case averted) of a scenario compared to the baseline, None when unknown.
+
+    The cost per case averted is the scenario's extra cost over the number of cases it averts; it is
+    only defined when it averts some.
+    """
+    cases = (summary["number_cases"] or {}).get("value")
+    baseline_cases = (baseline["number_cases"] or {}).get("value")
+    if cases is None or baseline_cases is None:
+        return None, None
+    cases_averted = baseline_cases - cases
+    if cases_averted <= 0:
+        return cases_averted, None
+    return cases_averted, summary["cost_delta"] / cases_averted
@@ -4,7 +4,8 @@ from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
 from iaso.api.common import UserSerializer
-from plugins.snt_malaria.api.scenarios.utils import get_interventions, get_missing_headers
+from plugins.snt_malaria.api.budget.serializers import BudgetCompareQuerySerializer
+from plugins.snt_malaria.api.scenarios.utils import get_import_errors, get_interventions
 from plugins.snt_malaria.models import Scenario, ScenarioRule
 from plugins.snt_malaria.models.account_settings import get_intervention_org_units
 
@@ -97,26 +98,57 @@ class ImportScenarioSerializer(serializers.Serializer):
         if "org_unit_id" not in df.columns:
             raise serializers.ValidationError(_("The CSV must contain an 'org_unit_id' column."))
 
-        # We are more interested in missing headers for intervention names than fixed ones
-        header_errors = get_missing_headers(df, interventions)
+        org_unit_ids = pd.to_numeric(df["org_unit_id"], errors="coerce")
+        if org_unit_ids.isna().any() or not org_unit_ids.eq(org_unit_ids.round()).all():
+            raise serializers.ValidationError(_("The 'org_unit_id' column must only contain org unit ids."))
+        df["org_unit_id"] = org_unit_ids.astype(int)
 
-        csv_org_unit_ids = set(df["org_unit_id"].dropna().astype(int).unique().tolist())
+        csv_org_unit_ids = set(df["org_unit_id"].unique().tolist())
         org_units = get_intervention_org_units(request.user.iaso_profile.account)
         available_org_unit_ids = set(org_units.values_list("id", flat=True))
-        not_found_org_units = csv_org_unit_ids - available_org_unit_ids
-        missing_org_units_from_file = available_org_unit_ids - csv_org_unit_ids
-
-        if header_errors or not_found_org_units or missing_org_units_from_file:
-            errors = {
-                "header_errors": header_errors,
-                "not_found_org_units": list(not_found_org_units),
-                "missing_org_units_from_file": list(missing_org_units_from_file),
-            }
+        self.context["org_unit_ids"] = available_org_unit_ids
+
+        # We are more interested in missing headers for intervention names than fixed ones
+        errors = get_import_errors(df.columns.tolist(), csv_org_unit_ids, interventions, available_org_unit_ids)
+        if errors:
             raise serializers.ValidationError(errors)
 
         return value
 
 
+class ImportScenarioAsyncSerializer(serializers.Serializer):
+    """Only checks the file type and header: the rows are read and validated by the import task."""
+
+    file = serializers.FileField(required=True)
+
+    def validate_file(self, value):
+        if not value.name.endswith(".csv"):
+            raise serializers.ValidationError(_("The file must be a CSV."))
+
+        columns = pd.read_csv(value, nrows=0).columns
+        value.seek(0)
+        if "org_unit_id" not in columns:
+            raise serializers.ValidationError(_("The CSV must contain an 'org_unit_id' column."))
+
+        return value
+
+
+class ScenarioCompareQuerySerializer(BudgetCompareQuerySerializer):
+    """Query parameters of the scenario comparison: the budget comparison's scenario_ids, and the age group and
+    years of the impact, which is left out without an age group."""
+
+    age_group = serializers.CharField(required=False)
+    year_from = serializers.IntegerField(required=False, allow_null=True, default=None)
+    year_to = serializers.IntegerField(required=False, allow_null=True, default=None)
+
+    def validate(self, attrs):
+        year_from = attrs.get("year_from")
+        year_to = attrs.get("year_to")
+        if year_from is not None and year_to is not None and year_from > year_to:
+            raise serializers.ValidationError({"year_from": "year_from must be less than or equal to year_to."})
+        return attrs
+
+
 class ScenarioRulesReorderSerializer(serializers.Serializer):
     new_order = serializers.PrimaryKeyRelatedField(many=True, queryset=ScenarioRule.objects.none(), required=True)
 
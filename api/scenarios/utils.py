@@ -1,14 +1,23 @@
-from collections import defaultdict
-from copy import deepcopy
+import csv
+import io
+
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 
 from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
 
 from iaso.utils.colors import COLOR_CHOICES, DISPERSED_COLOR_ORDER
+from plugins.snt_malaria.models.budget import Budget, BudgetGrantTotal, BudgetLine
 from plugins.snt_malaria.models.intervention import Intervention, InterventionAssignment
 from plugins.snt_malaria.models.scenario import Scenario, ScenarioRule
+from plugins.snt_malaria.models.scenario_yearly_cost_assignment import ScenarioYearlyCostAssignment
+
+
+EXPORT_BATCH_SIZE = 2000
 
 
 def get_intervention_column(name, code):
@@ -36,41 +45,31 @@ def get_csv_headers(interventions):
     return csv_header_columns
 
 
-def get_missing_headers(df, interventions):
-    file_headers = df.columns.tolist()
-    csv_headers = get_csv_headers(interventions)
-    return [header for header in csv_headers if header not in file_headers]
-
-
-def get_csv_row(org_unit_id, org_unit_name, org_unit_interventions, interventions):
+def get_csv_row(org_unit_id, org_unit_name, assigned, intervention_ids):
+    """assigned: set of the (org_unit_id, intervention_id) assignments of the scenario."""
     row = [org_unit_id, org_unit_name]
-    for intervention in interventions:
-        if any(assignment.intervention.id == intervention.id for assignment in org_unit_interventions):
-            row.append(1)
-        else:
-            row.append(0)
-
+    row.extend(1 if (org_unit_id, intervention_id) in assigned else 0 for intervention_id in intervention_ids)
     return row
 
 
-def get_assignments_from_row(user, scenario, row, interventions):
-    assignments = []
-    for intervention in interventions:
-        intervention_name = get_intervention_column(intervention["name"], intervention["code"])
+def iter_scenario_csv(interventions, org_units, assigned):
+    """Yield the CSV export of a scenario, EXPORT_BATCH_SIZE rows at a time.
 
-        assigned_value = row[intervention_name]
-        if assigned_value == 1:
-            print(
-                f"creating intervention with name {intervention_name} and id {intervention['id']} and for OU {row['org_unit_id']}"
-            )
-            assignment = InterventionAssignment(
-                scenario=scenario,
-                org_unit_id=row["org_unit_id"],
-                intervention_id=intervention["id"],
-                created_by=user,
-            )
-            assignments.append(assignment)
-    return assignments
+    interventions: the account's interventions, ordered as the header columns.
+    org_units: (id, name) values queryset of the exported org units, read with a server-side cursor.
+    assigned: set of the (org_unit_id, intervention_id) assignments of the scenario.
+    """
+    intervention_ids = list(interventions.values_list("id", flat=True).order_by("name"))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(get_csv_headers(interventions))
+    for index, (org_unit_id, org_unit_name) in enumerate(org_units.iterator(chunk_size=EXPORT_BATCH_SIZE), 1):
+        writer.writerow(get_csv_row(org_unit_id, org_unit_name, assigned, intervention_ids))
+        if index % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
 
 
 def _get_dispersed_color(index: int) -> str:
@@ -79,12 +78,65 @@ def _get_dispersed_color(index: int) -> str:
     return COLOR_CHOICES[palette_index][0]
 
 
+def _intervention_id_by_column(interventions_qs) -> dict[str, int]:
+    return {
+        get_intervention_column(intervention["name"], intervention["code"]): intervention["id"]
+        for intervention in interventions_qs
+    }
+
+
+def _assignment_flags(assignment_df: pd.DataFrame, intervention_id_by_column: dict[str, int]) -> pd.DataFrame:
+    """
+    One row of booleans per org unit with at least one assignment, one column per intervention id.
+
+    A cell equal to 1 assigns the intervention of its column to the org unit of its row; the rows of
+    an org unit listed several times are merged. Org units are ordered by their first row assigning
+    something.
+    """
+    columns = [column for column in intervention_id_by_column if column in assignment_df.columns]
+    assigned = assignment_df[columns].eq(1)
+    has_assignment = assigned.any(axis=1)
+    assigned = (
+        assigned[has_assignment]
+        .groupby(assignment_df.loc[has_assignment, "org_unit_id"].astype(int).to_numpy(), sort=False)
+        .any()
+    )
+    return assigned.rename(columns=intervention_id_by_column)
+
+
+def _merge_assignment_flags(flags: list[pd.DataFrame]) -> pd.DataFrame:
+    """Merge the _assignment_flags of consecutive chunks of the same CSV."""
+    if len(flags) == 1:
+        return flags[0]
+    return pd.concat(flags).fillna(False).astype(bool).groupby(level=0, sort=False).any()
+
+
+def _groups_from_flags(flags: pd.DataFrame) -> list[dict]:
+    """Group the org units of _assignment_flags by intervention combination, in the order of their first org unit."""
+    if flags.empty or not len(flags.columns):
+        return []
+
+    combinations, first_rows, group_of_row = np.unique(flags.to_numpy(), axis=0, return_index=True, return_inverse=True)
+    group_of_row = group_of_row.reshape(-1)
+    org_unit_ids = flags.index.to_numpy()
+    intervention_ids = flags.columns.to_numpy()
+    rows_by_group = np.split(np.argsort(group_of_row, kind="stable"), np.cumsum(np.bincount(group_of_row))[:-1])
+
+    return [
+        {
+            "intervention_ids": frozenset(intervention_ids[combinations[group]].tolist()),
+            "org_unit_ids": sorted(org_unit_ids[rows_by_group[group]].tolist()),
+        }
+        for group in np.argsort(first_rows)
+    ]
+
+
 def _build_intervention_groups(
     assignment_df: pd.DataFrame,
     interventions_qs,
 ) -> list[dict]:
     """
-    Group org units by their intervention combination.
+    Group org units by their intervention combination (see _assignment_flags for how cells are read).
 
     Returns a list of dicts:
         {
@@ -92,27 +144,51 @@ def _build_intervention_groups(
             "org_unit_ids": list of org unit ids,
         }
     """
-    intervention_lookup = {}
-    for intervention in interventions_qs:
-        col_name = get_intervention_column(intervention["name"], intervention["code"])
-        intervention_lookup[col_name] = intervention["id"]
-
-    org_unit_interventions: dict[int, set[int]] = defaultdict(set)
-    for _, row in assignment_df.iterrows():
-        org_unit_id = int(row["org_unit_id"])
-        for col_name, intervention_id in intervention_lookup.items():
-            if row.get(col_name) == 1:
-                org_unit_interventions[org_unit_id].add(intervention_id)
-
-    groups_map: dict[frozenset[int], list[int]] = defaultdict(list)
-    for org_unit_id, intervention_ids in org_unit_interventions.items():
-        if intervention_ids:
-            groups_map[frozenset(intervention_ids)].append(org_unit_id)
+    return _groups_from_flags(_assignment_flags(assignment_df, _intervention_id_by_column(interventions_qs)))
 
-    return [
-        {"intervention_ids": intervention_ids, "org_unit_ids": sorted(org_unit_ids)}
-        for intervention_ids, org_unit_ids in groups_map.items()
-    ]
+
+def read_import_csv_in_chunks(file, interventions_qs, chunk_size, on_chunk=None):
+    """Read a scenario import CSV chunk_size rows at a time.
+
+    Returns (columns, org unit ids of the file, invalid org unit id count, intervention groups), the
+    groups as _build_intervention_groups returns them. on_chunk(rows read so far) is called after
+    each chunk. Only the assignment flags of each org unit are kept in memory.
+    """
+    intervention_id_by_column = _intervention_id_by_column(interventions_qs)
+    columns = []
+    org_unit_ids = set()
+    invalid_count = 0
+    flags = []
+    rows_read = 0
+    for chunk in pd.read_csv(file, chunksize=chunk_size):
+        columns = chunk.columns.tolist()
+        if "org_unit_id" not in chunk.columns:
+            break
+        chunk_org_unit_ids = pd.to_numeric(chunk["org_unit_id"], errors="coerce")
+        valid = chunk_org_unit_ids.notna() & chunk_org_unit_ids.eq(chunk_org_unit_ids.round())
+        invalid_count += int((~valid).sum())
+        chunk = chunk[valid].assign(org_unit_id=chunk_org_unit_ids[valid].astype(int))
+        org_unit_ids.update(chunk["org_unit_id"].unique().tolist())
+        flags.append(_assignment_flags(chunk, intervention_id_by_column))
+        rows_read += len(valid)
+        if on_chunk:
+            on_chunk(rows_read)
+    groups = _groups_from_flags(_merge_assignment_flags(flags)) if flags else []
+    return columns, org_unit_ids, invalid_count, groups
+
+
+def get_import_errors(columns, csv_org_unit_ids, interventions, available_org_unit_ids):
+    """The errors of an import whose file has these columns and org unit ids, as a dict, or None when valid."""
+    header_errors = [header for header in get_csv_headers(interventions) if header not in columns]
+    not_found_org_units = csv_org_unit_ids - available_org_unit_ids
+    missing_org_units_from_file = available_org_unit_ids - csv_org_unit_ids
+    if header_errors or not_found_org_units or missing_org_units_from_file:
+        return {
+            "header_errors": header_errors,
+            "not_found_org_units": list(not_found_org_units),
+            "missing_org_units_from_file": list(missing_org_units_from_file),
+        }
+    return None
 
 
 def create_rules_from_import(
@@ -125,11 +201,22 @@ def create_rules_from_import(
     """Create ScenarioRules from a CSV import's assignment DataFrame.
 
     Analyses the DataFrame to group org units by their intervention combination,
-    then creates one rule per group:
+    then creates one rule per group (see create_rules_from_groups).
+    """
+    groups = _build_intervention_groups(assignment_df, interventions_qs)
+    return create_rules_from_groups(scenario, groups, all_org_unit_ids, user)
+
+
+def create_rules_from_groups(
+    scenario: Scenario,
+    groups: list[dict],
+    all_org_unit_ids: set[int],
+    user: User,
+) -> list[ScenarioRule]:
+    """Create one ScenarioRule per intervention group of an import:
     - Groups covering >50% of org units get a "match all" rule with exclusions.
     - Smaller groups get an inclusion-only rule.
     """
-    groups = _build_intervention_groups(assignment_df, interventions_qs)
     if not groups:
         return []
 
@@ -171,38 +258,149 @@ def create_rules_from_import(
         rules.append(rule)
         groups_for_rules.append(group)
 
+    # all_org_unit_ids are what a "match all" criteria resolves to.
     for rule in rules:
-        rule.org_units_matched = ScenarioRule.resolve_matched_org_units(scenario.account, rule.matching_criteria)
+        rule.org_units_matched = sorted(all_org_unit_ids) if rule.matching_criteria else []
 
     ScenarioRule.objects.bulk_create(rules)
 
-    for rule, group in zip(rules, groups_for_rules):
-        rule.interventions.set(group["intervention_ids"])
+    through = ScenarioRule.interventions.through
+    through.objects.bulk_create(
+        through(scenariorule_id=rule.id, intervention_id=intervention_id)
+        for rule, group in zip(rules, groups_for_rules)
+        for intervention_id in sorted(group["intervention_ids"])
+    )
 
     return rules
 
 
+def _copy_rows(model, source_filter, overrides, joins="", returning=False):
+    """INSERT INTO model's table the rows of that table matching source_filter, in one statement.
+
+    Columns are copied from the source rows (aliased "src"), except those of overrides:
+    {column: (sql expression, params)}. source_filter and joins are (sql, params).
+    Returns the number of rows inserted, or the id of the single inserted row with returning=True.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns, expressions, params = [], [], []
+    for field in model._meta.concrete_fields:
+        if field.primary_key:
+            continue
+        columns.append(connection.ops.quote_name(field.column))
+        if field.column in overrides:
+            expression, expression_params = overrides[field.column]
+            expressions.append(expression)
+            params.extend(expression_params)
+        else:
+            expressions.append(f"src.{connection.ops.quote_name(field.column)}")
+    joins_sql, joins_params = joins or ("", [])
+    where_sql, where_params = source_filter
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"SELECT {', '.join(expressions)} FROM {table} src {joins_sql} WHERE {where_sql}"
+    )
+    if returning:
+        sql += " RETURNING id"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + joins_params + where_params)
+        return cursor.fetchone()[0] if returning else cursor.rowcount
+
+
+def _new_rule_join(scenario_to: Scenario):
+    """Joins the copy (in scenario_to) of the source row's rule, found by priority (unique per scenario)."""
+    rule_table = connection.ops.quote_name(ScenarioRule._meta.db_table)
+    return (
+        f"LEFT JOIN {rule_table} old_rule ON old_rule.id = src.rule_id "
+        f"LEFT JOIN {rule_table} new_rule ON new_rule.scenario_id = %s AND new_rule.priority = old_rule.priority",
+        [scenario_to.id],
+    )
+
+
 def duplicate_rules(scenario_from: Scenario, scenario_to: Scenario, user: User):
-    for rule in scenario_from.rules.prefetch_related("interventions").all():
-        intervention_ids = list(rule.interventions.values_list("id", flat=True))
-        new_rule = ScenarioRule.objects.create(
-            scenario=scenario_to,
-            name=rule.name,
-            priority=rule.priority,
-            color=rule.color,
-            matching_criteria=rule.matching_criteria,
-            org_units_matched=rule.org_units_matched,
-            org_units_excluded=rule.org_units_excluded,
-            org_units_included=rule.org_units_included,
-            org_units_scope=rule.org_units_scope,
-            created_by=user,
+    now = timezone.now()
+    _copy_rows(
+        ScenarioRule,
+        ("src.scenario_id = %s", [scenario_from.id]),
+        {
+            "scenario_id": ("%s", [scenario_to.id]),
+            "created_at": ("%s", [now]),
+            "created_by_id": ("%s", [user.id]),
+            "updated_at": ("%s", [now]),
+            "updated_by_id": ("NULL", []),
+        },
+    )
+
+    quote_name = connection.ops.quote_name
+    through = ScenarioRule.interventions.through
+    through_table = quote_name(through._meta.db_table)
+    rule_column = quote_name(through._meta.get_field("scenariorule").column)
+    intervention_column = quote_name(through._meta.get_field("intervention").column)
+    rule_table = quote_name(ScenarioRule._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {through_table} ({rule_column}, {intervention_column}) "
+            f"SELECT new_rule.id, link.{intervention_column} FROM {through_table} link "
+            f"JOIN {rule_table} old_rule ON old_rule.id = link.{rule_column} "
+            f"JOIN {rule_table} new_rule ON new_rule.scenario_id = %s AND new_rule.priority = old_rule.priority "
+            "WHERE old_rule.scenario_id = %s",
+            [scenario_to.id, scenario_from.id],
         )
-        new_rule.interventions.set(intervention_ids)
+
+
+def duplicate_assignments(scenario_from: Scenario, scenario_to: Scenario, user: User):
+    """Copy the intervention assignments, pointing them to the copies of their rules (see duplicate_rules)."""
+    _copy_rows(
+        InterventionAssignment,
+        ("src.scenario_id = %s", [scenario_from.id]),
+        {
+            "scenario_id": ("%s", [scenario_to.id]),
+            "rule_id": ("new_rule.id", []),
+            "created_by_id": ("%s", [user.id]),
+            "created_at": ("%s", [timezone.now()]),
+        },
+        joins=_new_rule_join(scenario_to),
+    )
 
 
 def duplicate_scenario_yearly_cost_assignment(scenario_from: Scenario, scenario_to: Scenario, user: User):
-    for cost_assignment in scenario_from.yearly_cost_assignments.all():
-        initial_cost_assignment = deepcopy(cost_assignment)
-        initial_cost_assignment.pk = None
-        initial_cost_assignment.scenario = scenario_to
-        initial_cost_assignment.save()
+    _copy_rows(
+        ScenarioYearlyCostAssignment,
+        ("src.scenario_id = %s", [scenario_from.id]),
+        {"scenario_id": ("%s", [scenario_to.id])},
+    )
+
+
+def duplicate_latest_budget(scenario_from: Scenario, scenario_to: Scenario, user: User):
+    """Copy the latest budget of scenario_from, with its lines and grant totals, to scenario_to.
+
+    Only valid when both scenarios have the same inputs (assignments, cost lines, yearly values and
+    years): the copy keeps the input fingerprint. Returns the new budget id, or None when scenario_from
+    has no budget.
+    """
+    latest_budget_id = (
+        Budget.objects.filter(scenario=scenario_from).order_by("-created_at").values_list("id", flat=True).first()
+    )
+    if latest_budget_id is None:
+        return None
+
+    now = timezone.now()
+    budget_id = _copy_rows(
+        Budget,
+        ("src.id = %s", [latest_budget_id]),
+        {
+            "scenario_id": ("%s", [scenario_to.id]),
+            "name": ("%s", [f"Budget for {scenario_to.name}"]),
+            "created_at": ("%s", [now]),
+            "created_by_id": ("%s", [user.id]),
+            "updated_at": ("%s", [now]),
+            "updated_by_id": ("%s", [user.id]),
+        },
+        returning=True,
+    )
+    for model in (BudgetLine, BudgetGrantTotal):
+        _copy_rows(
+            model,
+            ("src.budget_id = %s", [latest_budget_id]),
+            {"budget_id": ("%s", [budget_id]), "scenario_id": ("%s", [scenario_to.id])},
+        )
+    return budget_id
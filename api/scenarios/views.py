@@ -1,9 +1,7 @@
-import csv
-
 from datetime import datetime
 
 from django.db import IntegrityError, transaction
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -14,22 +12,29 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
 from iaso.api.common import CONTENT_TYPE_CSV
+from iaso.api.tasks.serializers import TaskSerializer
+from plugins.snt_malaria.api.scenarios.comparison import compare_scenarios
 from plugins.snt_malaria.api.scenarios.utils import (
     create_rules_from_import,
+    duplicate_assignments,
+    duplicate_latest_budget,
     duplicate_rules,
     duplicate_scenario_yearly_cost_assignment,
-    get_csv_headers,
-    get_csv_row,
     get_scenario,
+    iter_scenario_csv,
 )
-from plugins.snt_malaria.models import InterventionAssignment, Scenario, ScenarioRule
+from plugins.snt_malaria.models import InterventionAssignment, Scenario, ScenarioImport, ScenarioRule
 from plugins.snt_malaria.models.account_settings import get_intervention_org_units
 from plugins.snt_malaria.models.intervention import Intervention
-from plugins.snt_malaria.services import BudgetCalculationService
+from plugins.snt_malaria.services.rules.batch import resolve_rules_matched_org_units
+from plugins.snt_malaria.tasks.import_scenario import is_scenario_import_running, launch_scenario_import
+from plugins.snt_malaria.tasks.recompute_budget import is_budget_recompute_pending, request_budget_recompute
 
 from .permissions import ScenarioPermission
 from .serializers import (
+    ImportScenarioAsyncSerializer,
     ImportScenarioSerializer,
+    ScenarioCompareQuerySerializer,
     ScenarioRulesReorderSerializer,
     ScenarioSerializer,
     ScenarioWriteSerializer,
@@ -95,16 +100,16 @@ class ScenarioViewSet(viewsets.ModelViewSet):
         """Recompute org_units_matched for every rule of the scenario using the new reference_year,
         then refresh assignments and budget once for the whole scenario rather than per rule."""
         rules = list(scenario.rules.all())
+        matched_by_rule_id = resolve_rules_matched_org_units(
+            scenario.account, rules, reference_year=scenario.reference_year
+        )
         for rule in rules:
-            rule.org_units_matched = ScenarioRule.resolve_matched_org_units(
-                scenario.account, rule.matching_criteria, reference_year=scenario.reference_year
-            )
+            rule.org_units_matched = matched_by_rule_id[rule.id]
         ScenarioRule.objects.bulk_update(rules, ["org_units_matched"])
 
         scenario.refresh_assignments(self.request.user)
 
-        budget_service = BudgetCalculationService(scenario)
-        budget_service.calculate_and_save_all_years(self.request.user)
+        request_budget_recompute(scenario, self.request.user)
 
     # Custom action to duplicate a scenario
     @transaction.atomic
@@ -121,13 +126,19 @@ class ScenarioViewSet(viewsets.ModelViewSet):
         except Exception as e:
             raise ValidationError(f"Error saving scenario: {e}")
 
+        # Set-based copies of the source rows: the source assignments and budget are already up to date.
         duplicate_rules(initial_scenario, new_scenario, request.user)
+        duplicate_assignments(initial_scenario, new_scenario, request.user)
         duplicate_scenario_yearly_cost_assignment(initial_scenario, new_scenario, request.user)
 
-        new_scenario.refresh_assignments(request.user)
-
-        budget_service = BudgetCalculationService(new_scenario)
-        budget_service.calculate_and_save_all_years(request.user)
+        if new_scenario.reference_year != initial_scenario.reference_year:
+            self._refresh_rules_for_reference_year_change(new_scenario)
+        elif (
+            (new_scenario.start_year, new_scenario.end_year) != (initial_scenario.start_year, initial_scenario.end_year)
+            or is_budget_recompute_pending(initial_scenario)
+            or duplicate_latest_budget(initial_scenario, new_scenario, request.user) is None
+        ):
+            request_budget_recompute(new_scenario, request.user)
 
         serializer = ScenarioSerializer(new_scenario)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -145,32 +156,24 @@ class ScenarioViewSet(viewsets.ModelViewSet):
             intervention_category__account=self.request.user.iaso_profile.account
         )
 
-        org_units = get_intervention_org_units(self.request.user.iaso_profile.account).order_by("name")
-
-        assignments = (
-            InterventionAssignment.objects.select_related("org_unit", "intervention").filter(scenario__id=scenario_id)
-            if scenario_id
-            else []
-        )
-
-        csv_header_columns = get_csv_headers(interventions)
+        org_units = get_intervention_org_units(self.request.user.iaso_profile.account)
 
-        response = HttpResponse(content_type=CONTENT_TYPE_CSV)
-        writer = csv.writer(response)
-        writer.writerow(csv_header_columns)
-
-        org_unit_interventions = {ou.id: {"name": ou.name, "assignments": []} for ou in org_units}
-        for assignment in assignments:
-            ou_id = assignment.org_unit.id
-            if ou_id in org_unit_interventions:
-                org_unit_interventions[ou_id]["assignments"].append(assignment)
-            else:
-                raise PermissionError(f"User doesn't have access to org unit {ou_id} of an assignment")
-
-        for org_unit_id, oui in org_unit_interventions.items():
-            row = get_csv_row(org_unit_id, oui["name"], oui["assignments"], interventions)
-            writer.writerow(row)
+        assigned = set()
+        if scenario_id:
+            assignments = InterventionAssignment.objects.filter(scenario__id=scenario_id)
+            outside_org_unit_id = (
+                assignments.exclude(org_unit_id__in=org_units.values("id"))
+                .values_list("org_unit_id", flat=True)
+                .first()
+            )
+            if outside_org_unit_id is not None:
+                raise PermissionError(f"User doesn't have access to org unit {outside_org_unit_id} of an assignment")
+            assigned = set(assignments.values_list("org_unit_id", "intervention_id"))
 
+        response = StreamingHttpResponse(
+            iter_scenario_csv(interventions, org_units.order_by("name").values_list("id", "name"), assigned),
+            content_type=CONTENT_TYPE_CSV,
+        )
         filename = "%s_%s.csv" % (scenario_name, datetime.now().strftime("%Y-%m-%d"))
         response["Content-Disposition"] = "attachment; filename=" + filename
         return response
@@ -182,8 +185,7 @@ class ScenarioViewSet(viewsets.ModelViewSet):
 
         assignment_df = serializer.context.get("assignment_df")
         interventions = serializer.context.get("interventions")
-        account = request.user.iaso_profile.account
-        all_org_unit_ids = set(ScenarioRule.resolve_matched_org_units(account, {"all": True}))
+        all_org_unit_ids = serializer.context.get("org_unit_ids")
 
         scenario = get_scenario(request.user, base_name="Imported Scenario")
         with transaction.atomic():
@@ -197,6 +199,64 @@ class ScenarioViewSet(viewsets.ModelViewSet):
 
         return Response({"status": "Import successful", "id": scenario.id}, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=["get"])
+    def compare(self, request):
+        """Compare the budgets and impacts of 2 to 10 scenarios side by side, the first one being the baseline.
+
+        Returns per-scenario totals and per-year series of cost and impact metrics, with the cases averted
+        and cost per case averted relative to the baseline. Budgets and impacts are computed concurrently.
+        """
+        query_serializer = ScenarioCompareQuerySerializer(data=request.query_params, context={"request": request})
+        query_serializer.is_valid(raise_exception=True)
+        data = query_serializer.validated_data
+        scenarios = data["scenario_ids"]
+
+        summaries = compare_scenarios(
+            request.user.iaso_profile.account,
+            scenarios,
+            age_group=data.get("age_group"),
+            year_from=data["year_from"],
+            year_to=data["year_to"],
+        )
+        return Response(
+            {"baseline_scenario_id": scenarios[0].id, "age_group": data.get("age_group"), "scenarios": summaries},
+            status=status.HTTP_200_OK,
+        )
+
+    @action(detail=False, methods=["post"])
+    def import_from_csv_async(self, request):
+        """Import a scenario CSV in a background task, for files too large to import within a request.
+
+        Returns the task to poll; its success message holds the id of the created scenario.
+        """
+        serializer = ImportScenarioAsyncSerializer(data=request.data, context={"request": request})
+        serializer.is_valid(raise_exception=True)
+
+        scenario_import = ScenarioImport.objects.create(
+            account=request.user.iaso_profile.account,
+            file=serializer.validated_data["file"],
+            created_by=request.user,
+        )
+        task = launch_scenario_import(scenario_import, request.user)
+        return Response(
+            {"import_id": scenario_import.id, "task": TaskSerializer(instance=task).data},
+            status=status.HTTP_201_CREATED,
+        )
+
+    @action(detail=False, methods=["post"], url_path=r"import_from_csv_async/(?P<import_id>\d+)/resume")
+    def resume_import_from_csv(self, request, import_id=None):
+        """Start a new task for an interrupted background import: it continues where the previous one stopped."""
+        scenario_import = get_object_or_404(
+            ScenarioImport, id=import_id, account=request.user.iaso_profile.account, completed_at__isnull=True
+        )
+        if is_scenario_import_running(scenario_import):
+            raise ValidationError("This import is still running.")
+
+        task = launch_scenario_import(scenario_import, request.user)
+        return Response(
+            {"import_id": scenario_import.id, "task": TaskSerializer(instance=task).data}, status=status.HTTP_200_OK
+        )
+
     @action(methods=["PATCH"], detail=True)
     def reorder_rules(self, request, pk=None):
         scenario = self.get_object()
@@ -220,6 +280,7 @@ class ScenarioViewSet(viewsets.ModelViewSet):
         # now that priorities have been updated,
         # we need to refresh the assignments of the scenario to reflect the new order of rules
         # only if transaction commit is successful
-        scenario.refresh_assignments(user)
+        if scenario.refresh_assignments(user):
+            request_budget_recompute(scenario, user)
 
         return Response({}, status=status.HTTP_200_OK)
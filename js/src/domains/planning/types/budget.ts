@@ -4,6 +4,8 @@ export type Budget = {
     year: number;
     interventions: BudgetIntervention[];
     org_units_costs: BudgetOrgUnit[];
+    // Org unit costs summed at the account's focus org unit type (e.g. regions).
+    org_unit_rollups?: BudgetOrgUnit[];
 };
 
 export type BudgetOrgUnit = {
@@ -6,6 +6,7 @@ from django.core.management.base import BaseCommand, CommandError
 from iaso.models.base import Account
 from iaso.models.metric import MetricType, MetricValue
 from iaso.utils.legend import get_legend_config
+from plugins.snt_malaria.services.rules.cache import invalidate_matches_cache
 
 
 class Command(BaseCommand):
@@ -108,6 +109,8 @@ class Command(BaseCommand):
                             f" metric {metric_type.code}"
                         )
 
+        # Cached rule matches read these values.
+        invalidate_matches_cache(account.id)
         self._configure_legends()
 
         self.stdout.write(self.style.SUCCESS("Population metric types creation complete."))
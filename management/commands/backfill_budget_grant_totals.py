@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from iaso.models import Account
+from plugins.snt_malaria.models import Budget
+from plugins.snt_malaria.services.budget.budget_calculation import BudgetCalculationService
+from plugins.snt_malaria.services.budget.grants import latest_budget_ids, without_grant_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the latest budgets stored before budget lines and grant totals existed, so grant utilization "
+        "covers their scenarios. Their results are not split by grant, so each is replaced by a new budget "
+        "computed from the current inputs of its scenario."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--account", type=int, help="Only backfill the scenarios of this account id")
+        parser.add_argument("--dry-run", action="store_true", help="List the budgets without recomputing them")
+
+    def handle(self, *args, **options):
+        accounts = Account.objects.all()
+        if options["account"]:
+            accounts = accounts.filter(id=options["account"])
+
+        for account in accounts:
+            budgets = without_grant_totals(Budget.objects.filter(id__in=latest_budget_ids(account))).select_related(
+                "scenario", "created_by", "updated_by"
+            )
+            for budget in budgets:
+                if options["dry_run"]:
+                    self.stdout.write(f"Budget {budget.id} of scenario {budget.scenario_id} has no grant totals")
+                    continue
+                new_budget = BudgetCalculationService(budget.scenario).calculate_and_save_all_years(
+                    budget.updated_by or budget.created_by
+                )
+                self.stdout.write(f"Budget {budget.id} of scenario {budget.scenario_id} recomputed as {new_budget.id}")
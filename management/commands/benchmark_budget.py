@@ -0,0 +1,155 @@
+import json
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from plugins.snt_malaria.models import Budget
+from plugins.snt_malaria.services.budget.budget_calculation import BudgetCalculationService
+from plugins.snt_malaria.services.budget.inputs import clear_inputs_cache
+from plugins.snt_malaria.services.budget.population import clear_population_cache
+from plugins.snt_malaria.services.budget.rollups import clear_rollup_indexes
+
+from .support.budget_benchmark_fixtures import SyntheticBudgetFixture
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the budget engine on a synthetic account: wall time, query count and peak memory of "
+        "calculate_all_years, calculate_grant_costs and calculate_and_save_all_years. "
+        "Everything is created in a transaction that is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--org-units", type=int, default=500)
+        parser.add_argument("--interventions", type=int, default=10)
+        parser.add_argument("--cost-lines", type=int, default=3, help="Cost lines per intervention")
+        parser.add_argument("--years", type=int, default=10)
+        parser.add_argument("--population-layers", type=int, default=4)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per operation; the median is reported")
+        parser.add_argument("--engine", choices=BudgetCalculationService.ENGINES, default="decimal")
+        parser.add_argument("--baseline", help="JSON file of stored baselines to compare against")
+        parser.add_argument(
+            "--save-baseline", action="store_true", help="Store the results as the baseline of this fixture size"
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Allowed relative increase of wall time and peak memory over the baseline",
+        )
+
+    def handle(self, *args, **options):
+        if options["save_baseline"] and not options["baseline"]:
+            raise CommandError("--save-baseline requires --baseline")
+
+        fixture = SyntheticBudgetFixture(
+            org_units=options["org_units"],
+            interventions=options["interventions"],
+            cost_lines_per_intervention=options["cost_lines"],
+            years=options["years"],
+            population_layers=options["population_layers"],
+            seed=options["seed"],
+            stdout_writer=self.stdout.write,
+        )
+        engine = options["engine"]
+
+        with transaction.atomic():
+            scenario = fixture.create()
+            operations = {
+                "calculate_all_years": lambda: BudgetCalculationService(scenario, engine=engine).calculate_all_years(),
+                "calculate_grant_costs": lambda: BudgetCalculationService(
+                    scenario, engine=engine
+                ).calculate_grant_costs(),
+                "calculate_and_save_all_years": lambda: BudgetCalculationService(
+                    scenario, engine=engine
+                ).calculate_and_save_all_years(fixture.user),
+            }
+            results = {}
+            for name, operation in operations.items():
+                results[name] = self._measure(operation, options["repeat"], scenario)
+                self.stdout.write(
+                    f"{name}: {results[name]['wall_time_s']:.3f}s, {results[name]['queries']} queries, "
+                    f"{results[name]['peak_memory_bytes'] / 1024 / 1024:.1f} MiB peak"
+                )
+            transaction.set_rollback(True)
+
+        profile = f"{fixture.profile}_{engine}"
+        if not options["baseline"]:
+            return
+
+        baselines = self._read_baselines(options["baseline"])
+        if options["save_baseline"]:
+            baselines[profile] = results
+            with open(options["baseline"], "w") as baseline_file:
+                json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f"Baseline {profile} saved to {options['baseline']}"))
+            return
+
+        if profile not in baselines:
+            raise CommandError(f"No baseline for {profile} in {options['baseline']}")
+        regressions = self._find_regressions(results, baselines[profile], options["tolerance"])
+        if regressions:
+            raise CommandError("Budget benchmark regressions:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regression against baseline {profile}"))
+
+    def _measure(self, operation, repeat, scenario):
+        wall_times = []
+        queries = []
+        for _ in range(repeat):
+            self._reset(scenario)
+            with CaptureQueriesContext(connection) as captured_queries:
+                start = time.perf_counter()
+                operation()
+                wall_times.append(time.perf_counter() - start)
+            queries.append(len(captured_queries))
+
+        # Separate run: tracing allocations slows the operation down too much to time it at the same time.
+        self._reset(scenario)
+        tracemalloc.start()
+        try:
+            operation()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return {
+            "wall_time_s": statistics.median(wall_times),
+            "queries": max(queries),
+            "peak_memory_bytes": peak_memory,
+        }
+
+    @staticmethod
+    def _reset(scenario):
+        """Make every run start cold: without the budget stored by the previous run nor its cached inputs."""
+        Budget.objects.filter(scenario=scenario).delete()
+        clear_population_cache()
+        clear_inputs_cache()
+        clear_rollup_indexes()
+
+    def _read_baselines(self, path):
+        try:
+            with open(path) as baseline_file:
+                return json.load(baseline_file)
+        except FileNotFoundError:
+            return {}
+
+    def _find_regressions(self, results, baseline, tolerance):
+        regressions = []
+        for name, measures in results.items():
+            expected = baseline.get(name)
+            if not expected:
+                continue
+            if measures["queries"] > expected["queries"]:
+                regressions.append(f"{name}: {measures['queries']} queries, baseline {expected['queries']}")
+            for measure in ("wall_time_s", "peak_memory_bytes"):
+                if measures[measure] > expected[measure] * (1 + tolerance):
+                    regressions.append(
+                        f"{name}: {measure} {measures[measure]:.3f}, baseline {expected[measure]:.3f} "
+                        f"(+{tolerance:.0%} allowed)"
+                    )
+        return regressions
@@ -0,0 +1,185 @@
+"""
+Generate a synthetic, country-scale account to benchmark the budget engine.
+"""
+
+import logging
+import random
+import uuid
+
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+
+from iaso.models import Account, OrgUnit, OrgUnitType
+from iaso.models.metric import MetricType, MetricValue
+from plugins.snt_malaria.models import (
+    BudgetSettings,
+    Intervention,
+    InterventionAssignment,
+    InterventionCategory,
+    InterventionCostBreakdownLine,
+    Scenario,
+    ScenarioYearlyCostAssignment,
+)
+from plugins.snt_malaria.models.cost_unit_type import CostUnitType
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+START_YEAR = 2025
+
+# Share of the org units each intervention is assigned to.
+ASSIGNMENT_COVERAGE = 0.6
+
+
+class SyntheticBudgetFixture:
+    """Create an account with org units, population layers, interventions with cost lines and one scenario.
+
+    Every intervention gets one fixed-cost line and cost_lines_per_intervention - 1 population-driven lines,
+    each driven by one of the population layers. Values are drawn from a seeded random generator, so the
+    same parameters always produce the same data.
+    """
+
+    def __init__(
+        self,
+        org_units=500,
+        interventions=10,
+        cost_lines_per_intervention=3,
+        years=10,
+        population_layers=4,
+        seed=1,
+        stdout_writer=None,
+    ):
+        self.org_unit_count = org_units
+        self.intervention_count = interventions
+        self.cost_lines_per_intervention = cost_lines_per_intervention
+        self.year_count = years
+        self.population_layer_count = population_layers
+        self.random = random.Random(seed)
+        self.stdout_write = stdout_writer or logger.info
+
+    @property
+    def profile(self):
+        """Name identifying the fixture size, used to key stored baselines."""
+        return (
+            f"ou{self.org_unit_count}_iv{self.intervention_count}_cl{self.cost_lines_per_intervention}"
+            f"_y{self.year_count}_pop{self.population_layer_count}"
+        )
+
+    def create(self):
+        suffix = uuid.uuid4().hex[:8]
+        self.account = Account.objects.create(name=f"Budget benchmark {suffix}")
+        self.user = User.objects.create(username=f"budget_benchmark_{suffix}")
+        end_year = START_YEAR + self.year_count - 1
+        years = range(START_YEAR, end_year + 1)
+
+        org_unit_type = OrgUnitType.objects.create(name=f"Benchmark district {suffix}")
+        org_units = OrgUnit.objects.bulk_create(
+            [OrgUnit(name=f"District {index}", org_unit_type=org_unit_type) for index in range(self.org_unit_count)],
+            batch_size=BATCH_SIZE,
+        )
+        self.stdout_write(f"Created {len(org_units)} org units")
+
+        population_layers = [
+            MetricType.objects.create(
+                account=self.account,
+                name=f"Population {index}",
+                code=f"BENCHMARK_POP_{index}",
+                description="Synthetic population layer",
+                units="people",
+            )
+            for index in range(self.population_layer_count)
+        ]
+        metric_values = [
+            MetricValue(
+                metric_type=layer,
+                org_unit=org_unit,
+                year=year,
+                value=self.random.randint(1_000, 500_000),
+            )
+            for layer in population_layers
+            for org_unit in org_units
+            for year in years
+        ]
+        MetricValue.objects.bulk_create(metric_values, batch_size=BATCH_SIZE)
+        self.stdout_write(f"Created {len(metric_values)} population values")
+
+        BudgetSettings.objects.create(
+            account=self.account,
+            local_currency="USD",
+            exchange_rate=Decimal("1"),
+            inflation_rate=Decimal("0.03"),
+        )
+        category = InterventionCategory.objects.create(account=self.account, created_by=self.user, name="Benchmark")
+        unit_type = CostUnitType.objects.create(account=self.account, name="per unit")
+        interventions = [
+            Intervention.objects.create(
+                intervention_category=category,
+                created_by=self.user,
+                name=f"Intervention {index}",
+                short_name=f"IV {index}",
+                code=f"iv_{index}",
+            )
+            for index in range(self.intervention_count)
+        ]
+
+        categories = InterventionCostBreakdownLine.InterventionCostBreakdownLineCategory.values
+        cost_lines = []
+        for intervention in interventions:
+            for index in range(self.cost_lines_per_intervention):
+                is_proportional = index > 0 and bool(population_layers)
+                cost_lines.append(
+                    InterventionCostBreakdownLine(
+                        intervention=intervention,
+                        name=f"{intervention.code} line {index}",
+                        category=categories[index % len(categories)],
+                        unit_type=unit_type,
+                        population_layer=self.random.choice(population_layers) if is_proportional else None,
+                        is_proportional=is_proportional,
+                        conversion_factor=Decimal(str(self.random.choice([0.25, 0.5, 1, 2]))),
+                        unit_cost=Decimal(self.random.randint(50, 50_000)) / 100,
+                        created_by=self.user,
+                    )
+                )
+        cost_lines = InterventionCostBreakdownLine.objects.bulk_create(cost_lines, batch_size=BATCH_SIZE)
+
+        self.scenario = Scenario.objects.create(
+            account=self.account,
+            created_by=self.user,
+            name=f"Benchmark scenario {suffix}",
+            start_year=START_YEAR,
+            end_year=end_year,
+        )
+        assignments = [
+            InterventionAssignment(
+                scenario=self.scenario,
+                org_unit=org_unit,
+                intervention=intervention,
+                created_by=self.user,
+            )
+            for intervention in interventions
+            for org_unit in self.random.sample(org_units, round(len(org_units) * ASSIGNMENT_COVERAGE))
+        ]
+        InterventionAssignment.objects.bulk_create(assignments, batch_size=BATCH_SIZE)
+        ScenarioYearlyCostAssignment.objects.bulk_create(
+            [
+                ScenarioYearlyCostAssignment(
+                    scenario=self.scenario,
+                    cost_line=cost_line,
+                    year=year,
+                    value=(
+                        Decimal(self.random.randint(50, 100)) / 100
+                        if cost_line.is_proportional
+                        else self.random.randint(1, 20)
+                    ),
+                )
+                for cost_line in cost_lines
+                for year in years
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        self.stdout_write(
+            f"Created scenario {self.scenario.id} with {len(assignments)} assignments and {len(cost_lines)} cost lines"
+        )
+        return self.scenario
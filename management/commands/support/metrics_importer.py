@@ -12,6 +12,7 @@ from django.db import transaction
 
 from iaso.models import MetricType, MetricValue, OrgUnit
 from iaso.utils.legend import get_legend_config
+from plugins.snt_malaria.services.rules.cache import invalidate_matches_cache
 
 
 class MetricsImporter:
@@ -57,6 +58,8 @@ class MetricsImporter:
                 if pop_dataset_file_path
                 else 0
             )
+            # Cached rule matches read these values.
+            invalidate_matches_cache(self.account.id)
             return metrics_count + popmetrics_count
 
         except Exception as e:
@@ -0,0 +1,84 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:12
+
+import django.db.models.deletion
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("iaso", "0394_remove_show_pages_feature_flag"),
+        ("snt_malaria", "0056_costunittype_is_commodity"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BudgetLine",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("year", models.PositiveSmallIntegerField()),
+                ("category", models.CharField(max_length=40)),
+                ("population", models.DecimalField(decimal_places=6, default=0, max_digits=24)),
+                ("quantity", models.DecimalField(decimal_places=6, max_digits=24)),
+                ("cost", models.DecimalField(decimal_places=6, max_digits=24)),
+                (
+                    "budget",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="lines", to="snt_malaria.budget"
+                    ),
+                ),
+                (
+                    "cost_line",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="snt_malaria.interventioncostbreakdownline",
+                    ),
+                ),
+                (
+                    "grant",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="snt_malaria.grant",
+                    ),
+                ),
+                (
+                    "intervention",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to="snt_malaria.intervention"
+                    ),
+                ),
+                (
+                    "org_unit",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="iaso.orgunit",
+                    ),
+                ),
+                (
+                    "scenario",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="budget_lines",
+                        to="snt_malaria.scenario",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["budget", "year"], name="idx_budget_line_budget_year"),
+                    models.Index(fields=["budget", "org_unit"], name="idx_budget_line_budget_ou"),
+                    models.Index(fields=["budget", "intervention"], name="idx_budget_line_budget_iv"),
+                    models.Index(fields=["budget", "category"], name="idx_budget_line_budget_cat"),
+                    models.Index(fields=["budget", "cost_line", "year"], name="idx_budget_line_line_year"),
+                ],
+            },
+        ),
+    ]
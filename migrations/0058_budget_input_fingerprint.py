@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("snt_malaria", "0057_budgetline"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="budget",
+            name="input_fingerprint",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
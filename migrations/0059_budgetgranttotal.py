@@ -0,0 +1,74 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:41
+
+import django.db.models.deletion
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_budget_grant_totals(apps, schema_editor):
+    # Budgets stored before budget lines existed have no lines to sum and their results are not split
+    # by grant: the backfill_budget_grant_totals command recomputes the latest ones.
+    BudgetLine = apps.get_model("snt_malaria", "BudgetLine")
+    BudgetGrantTotal = apps.get_model("snt_malaria", "BudgetGrantTotal")
+    db_alias = schema_editor.connection.alias
+
+    totals = (
+        BudgetLine.objects.using(db_alias)
+        .values("budget_id", "scenario_id", "grant_id", "year")
+        .annotate(cost=Sum("cost"))
+        .order_by()
+    )
+    BudgetGrantTotal.objects.using(db_alias).bulk_create(
+        (BudgetGrantTotal(**total) for total in totals.iterator()), batch_size=5000
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("snt_malaria", "0058_budget_input_fingerprint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BudgetGrantTotal",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("year", models.PositiveSmallIntegerField()),
+                ("cost", models.DecimalField(decimal_places=6, max_digits=24)),
+                (
+                    "budget",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="grant_totals",
+                        to="snt_malaria.budget",
+                    ),
+                ),
+                (
+                    "grant",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="budget_totals",
+                        to="snt_malaria.grant",
+                    ),
+                ),
+                (
+                    "scenario",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="budget_grant_totals",
+                        to="snt_malaria.scenario",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["budget", "grant"], name="idx_budget_grant_budget_grant"),
+                    models.Index(fields=["grant", "budget"], name="idx_budget_grant_grant_budget"),
+                ],
+            },
+        ),
+        migrations.RunPython(fill_budget_grant_totals, migrations.RunPython.noop),
+    ]
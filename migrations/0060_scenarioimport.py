@@ -0,0 +1,64 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:20
+
+import django.db.models.deletion
+
+from django.conf import settings
+from django.db import migrations, models
+
+import plugins.snt_malaria.models.scenario_import
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("iaso", "0394_remove_show_pages_feature_flag"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("snt_malaria", "0059_budgetgranttotal"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ScenarioImport",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "file",
+                    models.FileField(
+                        upload_to=plugins.snt_malaria.models.scenario_import.scenario_import_file_upload_to
+                    ),
+                ),
+                ("completed_at", models.DateTimeField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "account",
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="+", to="iaso.account"),
+                ),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT, related_name="+", to=settings.AUTH_USER_MODEL
+                    ),
+                ),
+                (
+                    "scenario",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="snt_malaria.scenario",
+                    ),
+                ),
+                (
+                    "task",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="iaso.task",
+                    ),
+                ),
+            ],
+        ),
+    ]
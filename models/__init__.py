@@ -1,5 +1,5 @@
 from .account_settings import AccountSettings
-from .budget import Budget
+from .budget import Budget, BudgetGrantTotal, BudgetLine
 from .budget_settings import BudgetSettings
 from .composite_layer import CompositeLayer
 from .cost_breakdown import InterventionCostBreakdownLine
@@ -13,6 +13,7 @@ from .intervention import (
     InterventionCategory,
 )
 from .scenario import Scenario, ScenarioRule
+from .scenario_import import ScenarioImport
 from .scenario_yearly_cost_assignment import ScenarioYearlyCostAssignment
 from .snt_account_setup import SNTAccountSetup
 
@@ -23,6 +24,7 @@ __all__ = [
     "InterventionCategory",
     "Scenario",
     "ScenarioRule",
+    "ScenarioImport",
     "CostUnitType",
     "Donor",
     "Grant",
@@ -31,6 +33,8 @@ __all__ = [
     "ImpactOrgUnitMapping",
     "ImpactProviderConfig",
     "Budget",
+    "BudgetGrantTotal",
+    "BudgetLine",
     "BudgetSettings",
     "AccountSettings",
     "SNTAccountSetup",
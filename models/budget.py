@@ -18,6 +18,8 @@ class Budget(SoftDeletableModel):
     scenario = models.ForeignKey(Scenario, on_delete=models.CASCADE)
     name = models.TextField()
     results = models.JSONField()
+    # Hash of the inputs the results were computed from, see BudgetCalculationService.input_fingerprint.
+    input_fingerprint = models.CharField(max_length=64, blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="budget_created_set")
     # TODO: Not sure we will need this, but I'd rather have them already.
@@ -27,3 +29,66 @@ class Budget(SoftDeletableModel):
     objects = DefaultSoftDeletableManager()
     objects_only_deleted = OnlyDeletedSoftDeletableManager()
     objects_include_deleted = IncludeDeletedSoftDeletableManager()
+
+
+class BudgetLine(models.Model):
+    """One cost row of a budget: a (year, org unit, cost line) contribution.
+
+    Mirrors the rows aggregated into Budget.results, so reads that only need a slice
+    (one year, one district, one intervention...) can be answered with SQL aggregations.
+    Fixed-cost rows have no org unit.
+    """
+
+    class Meta:
+        app_label = "snt_malaria"
+        indexes = [
+            models.Index(fields=["budget", "year"], name="idx_budget_line_budget_year"),
+            models.Index(fields=["budget", "org_unit"], name="idx_budget_line_budget_ou"),
+            models.Index(fields=["budget", "intervention"], name="idx_budget_line_budget_iv"),
+            models.Index(fields=["budget", "category"], name="idx_budget_line_budget_cat"),
+            models.Index(fields=["budget", "cost_line", "year"], name="idx_budget_line_line_year"),
+        ]
+
+    budget = models.ForeignKey(Budget, on_delete=models.CASCADE, related_name="lines")
+    scenario = models.ForeignKey(Scenario, on_delete=models.CASCADE, related_name="budget_lines")
+    year = models.PositiveSmallIntegerField()
+    org_unit = models.ForeignKey("iaso.OrgUnit", on_delete=models.CASCADE, null=True, blank=True, related_name="+")
+    intervention = models.ForeignKey("snt_malaria.Intervention", on_delete=models.CASCADE, related_name="+")
+    # Cost lines and grants can be edited away after the budget was computed; keep the row and its amounts.
+    cost_line = models.ForeignKey(
+        "snt_malaria.InterventionCostBreakdownLine", on_delete=models.SET_NULL, null=True, related_name="+"
+    )
+    grant = models.ForeignKey("snt_malaria.Grant", on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    category = models.CharField(max_length=40)
+    population = models.DecimalField(max_digits=24, decimal_places=6, default=0)
+    quantity = models.DecimalField(max_digits=24, decimal_places=6)
+    cost = models.DecimalField(max_digits=24, decimal_places=6)
+
+    def __str__(self):
+        return f"{self.budget_id}:{self.year}:{self.org_unit_id}:{self.cost_line_id}"
+
+
+class BudgetGrantTotal(models.Model):
+    """Cost of a budget attributed to one grant in one year: the BudgetLine costs summed per (grant, year).
+
+    Kept alongside each stored budget so grant consumption across scenarios is read without
+    touching the lines. Costs without a grant are stored under grant None.
+    """
+
+    class Meta:
+        app_label = "snt_malaria"
+        indexes = [
+            models.Index(fields=["budget", "grant"], name="idx_budget_grant_budget_grant"),
+            models.Index(fields=["grant", "budget"], name="idx_budget_grant_grant_budget"),
+        ]
+
+    budget = models.ForeignKey(Budget, on_delete=models.CASCADE, related_name="grant_totals")
+    scenario = models.ForeignKey(Scenario, on_delete=models.CASCADE, related_name="budget_grant_totals")
+    grant = models.ForeignKey(
+        "snt_malaria.Grant", on_delete=models.SET_NULL, null=True, blank=True, related_name="budget_totals"
+    )
+    year = models.PositiveSmallIntegerField()
+    cost = models.DecimalField(max_digits=24, decimal_places=6)
+
+    def __str__(self):
+        return f"{self.budget_id}:{self.grant_id}:{self.year}"
@@ -1,11 +1,11 @@
+from dataclasses import dataclass, field
+
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import ArrayField
 from django.db import connection, models, transaction
 from django.db.models import Deferrable, Q
 
-from iaso.models import MetricValue
 from iaso.utils.colors import DEFAULT_COLOR
-from iaso.utils.jsonlogic import jsonlogic_to_exists_q_clauses
 from iaso.utils.models.color import ColorField
 from iaso.utils.models.soft_deletable import (
     DefaultSoftDeletableManager,
@@ -14,7 +14,30 @@ from iaso.utils.models.soft_deletable import (
     SoftDeletableModel,
 )
 from iaso.utils.validators import JSONSchemaValidator
-from plugins.snt_malaria.models.account_settings import get_intervention_org_units
+
+
+@dataclass(frozen=True)
+class AssignmentChanges:
+    """What Scenario.refresh_assignments changed, as sorted (org_unit_id, intervention_id) keys.
+
+    updated holds the kept assignments whose rule changed or whose grant override was cleared.
+    Falsy when nothing changed.
+    """
+
+    created: list[tuple[int, int]] = field(default_factory=list)
+    deleted: list[tuple[int, int]] = field(default_factory=list)
+    updated: list[tuple[int, int]] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.created or self.deleted or self.updated)
+
+    @property
+    def org_unit_ids(self) -> set[int]:
+        return {org_unit_id for org_unit_id, _ in self.created + self.deleted + self.updated}
+
+    @property
+    def intervention_ids(self) -> set[int]:
+        return {intervention_id for _, intervention_id in self.created + self.deleted + self.updated}
 
 
 class Scenario(SoftDeletableModel):
@@ -62,14 +85,59 @@ class Scenario(SoftDeletableModel):
         return self.rules.aggregate(max_priority=models.Max("priority"))["max_priority"] + 1
 
     @transaction.atomic()
-    def refresh_assignments(self, user: User) -> None:
-        self.intervention_assignments.all().delete()
-        new_assignments = {}
-        for rule in self.rules.order_by("-priority"):
-            rule.refresh_assignments(user, new_assignments)
+    def refresh_assignments(self, user: User) -> AssignmentChanges:
+        """
+        Bring the intervention assignments in line with the rules and return what changed.
+
+        The target assignments are computed in memory with boolean masks over the org units, rule
+        by rule from the highest priority (see services.rules.resolution), then only the difference
+        with the stored assignments is written: missing ones are created, obsolete ones deleted, and
+        kept ones whose rule changed are updated. The result is the same as recreating every assignment, except that
+        kept assignments keep their id and creation data; like recreated ones, they lose any grant override.
+        """
+        from plugins.snt_malaria.models.intervention import InterventionAssignment
+        from plugins.snt_malaria.services.rules.resolution import resolve_assignments
+
+        target_rule_ids = resolve_assignments(self.rules.order_by("-priority").prefetch_related("interventions"))
+
+        existing = {
+            (assignment.org_unit_id, assignment.intervention_id): assignment
+            for assignment in self.intervention_assignments.only(
+                "id", "org_unit_id", "intervention_id", "rule_id", "grant_id"
+            )
+        }
+        deleted = sorted(key for key in existing if key not in target_rule_ids)
+        created = sorted(key for key in target_rule_ids if key not in existing)
+        to_update = []
+        for key, assignment in existing.items():
+            rule_id = target_rule_ids.get(key)
+            if rule_id is not None and (assignment.rule_id != rule_id or assignment.grant_id is not None):
+                assignment.rule_id = rule_id
+                assignment.grant_id = None
+                to_update.append(assignment)
+
+        if deleted:
+            self.intervention_assignments.filter(id__in=[existing[key].id for key in deleted]).delete()
+        if to_update:
+            InterventionAssignment.objects.bulk_update(to_update, ["rule", "grant"])
+        InterventionAssignment.objects.bulk_create(
+            InterventionAssignment(
+                scenario_id=self.id,
+                org_unit_id=org_unit_id,
+                intervention_id=intervention_id,
+                rule_id=target_rule_ids[(org_unit_id, intervention_id)],
+                created_by=user,
+            )
+            for org_unit_id, intervention_id in created
+        )
 
         # Bump updated_at so the impact API cache (keyed on this timestamp) self-invalidates.
         self.save()
+        return AssignmentChanges(
+            created=created,
+            deleted=deleted,
+            updated=sorted((assignment.org_unit_id, assignment.intervention_id) for assignment in to_update),
+        )
 
 
 SCENARIO_RULE_MATCHING_CRITERIA_SCHEMA = {
@@ -194,32 +262,11 @@ class ScenarioRule(models.Model):
         year=reference_year is preferred; falls back to year=NULL (timeless values) when
         no reference_year data exists for that metric type.
         """
+        from plugins.snt_malaria.services.rules.matcher import CompiledMatcher
+
         if matching_criteria is None:
             return []
-
-        org_units = get_intervention_org_units(account)
-
-        if isinstance(matching_criteria, dict) and matching_criteria.get("all"):
-            return list(org_units.values_list("id", flat=True).distinct())
-
-        metric_values = MetricValue.objects.filter(metric_type__account=account, org_unit_id__isnull=False)
-
-        if reference_year is not None:
-            conditions = matching_criteria.get("and", [])
-            year_q = Q()
-            for condition in conditions:
-                op = next(iter(condition))
-                mt_id = condition[op][0]["var"]
-                if metric_values.filter(metric_type_id=mt_id, year=reference_year).exists():
-                    year_q |= Q(metric_type_id=mt_id, year=reference_year)
-                else:
-                    year_q |= Q(metric_type_id=mt_id, year__isnull=True)
-            if conditions:
-                metric_values = metric_values.filter(year_q)
-
-        q = jsonlogic_to_exists_q_clauses(matching_criteria, metric_values, "metric_type_id", "org_unit_id")
-        matched_ids = metric_values.filter(q).distinct().values_list("org_unit_id", flat=True)
-        return list(org_units.filter(id__in=matched_ids).values_list("id", flat=True).distinct())
+        return CompiledMatcher(account, matching_criteria, reference_year).org_unit_ids()
 
     def _compute_org_unit_ids(self) -> set[int]:
         """Resolve the set of org unit ids this rule targets based on its matching mode."""
@@ -230,51 +277,49 @@ class ScenarioRule(models.Model):
             return set()
         return (matched - set(self.org_units_excluded)) | set(self.org_units_included)
 
-    def refresh_assignments(self, user: User, previous_assignments: dict[int, set[int]]) -> None:
-        # """
-        # Refresh intervention assignment based on this rule.
-        # This method should be called for each rule of a scenario, in the order of their priority (highest priority first),
-        # and with a dict of previous assignments that is updated at each step to make sure that we don't create duplicate assignments for the same org unit and intervention category.
-
-        # If a rule has two intervention of the same category, only the first one will be assigned.
-
-        # previous_assignments is a dict where keys are intervention category ids and values are sets of org unit ids that already have an assignment for this category from a higher priority rule. This is used to make sure that we don't create multiple assignments for the same org unit and intervention category, as the rule priority should determine which intervention gets assigned in case of overlap.
-        # This dict is updated in place with the new assignments created by this method.
-        # """
-        from plugins.snt_malaria.models.intervention import InterventionAssignment
-
-        if not self.interventions.exists():
-            return
+    def get_target_assignments(self, previous_assignments: dict[int, set[int]]) -> list[tuple[int, int]]:
+        """
+        Return the (org_unit_id, intervention_id) assignments this rule produces.
+
+        This method should be called for each rule of a scenario, in the order of their priority (highest
+        priority first), with the same previous_assignments dict: keys are intervention category ids and values
+        the org unit ids that already have an assignment for this category from a higher priority rule. Those
+        org units are skipped, as the rule priority determines which intervention gets assigned in case of
+        overlap; if a rule has two interventions of the same category, only the first one is assigned.
+        The dict is updated in place with the assignments returned.
+        """
+        interventions = list(self.interventions.select_related("intervention_category").all())
+        if not interventions:
+            return []
 
         org_unit_ids = self._compute_org_unit_ids()
         if not org_unit_ids:
             # No org units to assign to (no matched, included, or "match all" org units)
-            return
-
-        intervention_assignments_to_create = []
-        for intervention in self.interventions.select_related("intervention_category").all():
-            category_id = intervention.intervention_category_id
-            if category_id not in previous_assignments:
-                previous_assignments[category_id] = set()
+            return []
 
-            previous_assignments_for_category = previous_assignments[category_id]
+        assignments = []
+        for intervention in interventions:
+            previous_assignments_for_category = previous_assignments.setdefault(
+                intervention.intervention_category_id, set()
+            )
             for org_unit_id in org_unit_ids:
                 if org_unit_id in previous_assignments_for_category:
-                    # This means that a higher priority rule already assigned an intervention for this category and org unit, so we skip creating this assignment
                     continue
-
-                # Create the assignment
-                intervention_assignments_to_create.append(
-                    InterventionAssignment(
-                        rule=self,
-                        intervention_id=intervention.id,
-                        org_unit_id=org_unit_id,
-                        created_by=user,
-                        scenario_id=self.scenario_id,
-                    )
-                )
-
-                # Update the dict to keep track of this new assignment
+                assignments.append((org_unit_id, intervention.id))
                 previous_assignments_for_category.add(org_unit_id)
+        return assignments
 
-        InterventionAssignment.objects.bulk_create(intervention_assignments_to_create)
+    def refresh_assignments(self, user: User, previous_assignments: dict[int, set[int]]) -> None:
+        """Create the assignments returned by get_target_assignments (see there for previous_assignments)."""
+        from plugins.snt_malaria.models.intervention import InterventionAssignment
+
+        InterventionAssignment.objects.bulk_create(
+            InterventionAssignment(
+                rule=self,
+                intervention_id=intervention_id,
+                org_unit_id=org_unit_id,
+                created_by=user,
+                scenario_id=self.scenario_id,
+            )
+            for org_unit_id, intervention_id in self.get_target_assignments(previous_assignments)
+        )
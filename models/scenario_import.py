@@ -0,0 +1,46 @@
+import os
+
+from django.contrib.auth.models import User
+from django.db import models
+from django.utils import timezone
+
+from plugins.snt_malaria.models.scenario import Scenario
+
+
+def scenario_import_file_upload_to(scenario_import: "ScenarioImport", filename: str):
+    today = timezone.now().date()
+    year_month = today.strftime("%Y_%m")
+
+    return os.path.join(
+        "snt_scenario_imports",
+        year_month,
+        filename,
+    )
+
+
+class ScenarioImport(models.Model):
+    """A scenario CSV uploaded for a background import (see tasks.import_scenario).
+
+    The task records its progress here, so running it again for the same import resumes it: the
+    scenario and its rules are created once, then only the missing assignments are written. The
+    scenario is locked until completed_at is set, and the file is deleted then.
+    """
+
+    class Meta:
+        app_label = "snt_malaria"
+
+    account = models.ForeignKey("iaso.Account", on_delete=models.CASCADE, related_name="+")
+    file = models.FileField(upload_to=scenario_import_file_upload_to)
+    # Set with the rules, in the same transaction.
+    scenario = models.ForeignKey(Scenario, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    # The latest task run for this import.
+    task = models.ForeignKey("iaso.Task", on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    created_by = models.ForeignKey(User, on_delete=models.PROTECT, related_name="+")
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Also bumped by every progress report of the task, to tell a running import from a dead one.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.account_id}:{self.file.name}"
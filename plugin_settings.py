@@ -11,6 +11,12 @@ CONSTANTS = {
     # Used by the configureAccount wizard's "Restart" link.
     "LOGOUT_NEXT_ALLOWED_PATHS": ["/snt_malaria/public/setupAccount"],
     "COMPOSITE_LAYER_AI_MODEL": os.environ.get("COMPOSITE_LAYER_AI_MODEL", "claude-opus-4-7"),
+    # Recompute scenario budgets in a background task (coalesced per scenario) instead of inside API requests.
+    "ASYNC_BUDGET_RECOMPUTE": os.environ.get("ASYNC_BUDGET_RECOMPUTE", "false").lower() == "true",
+    # Share of incremental budget patches (yearly cost edits) checked against a full recompute, between 0 and 1.
+    "BUDGET_PATCH_VERIFY_RATE": float(os.environ.get("BUDGET_PATCH_VERIFY_RATE", "0.05")),
+    # Size of the thread pool computing the budgets and impacts compared by /scenarios/compare; 1 runs them inline.
+    "SCENARIO_COMPARE_MAX_WORKERS": int(os.environ.get("SCENARIO_COMPARE_MAX_WORKERS", "4")),
 }
 DEFAULT_THROTTLE_RATES = {
     "snt_public_account": os.environ.get("PUBLIC_ACCOUNT_THROTTLE_RATE", "5/hour"),
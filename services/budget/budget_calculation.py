@@ -1,26 +1,37 @@
+import hashlib
+import logging
+
 from collections import defaultdict
 from decimal import Decimal
+from itertools import chain
 from typing import Any, Optional
 
-from iaso.models import MetricValue
+from django.db import transaction
+from django.db.models import Min, Sum
+
 from plugins.snt_malaria.models import (
     Budget,
-    BudgetSettings,
+    BudgetGrantTotal,
+    BudgetLine,
     Grant,
-    InterventionCostBreakdownLine,
-    ScenarioYearlyCostAssignment,
+    InterventionAssignment,
 )
 
 from .dataclasses import (
-    BudgetBreakdownItem,
     BudgetGrantCostItem,
     BudgetGrantYearCost,
-    BudgetInterventionItem,
     BudgetLineRow,
-    BudgetOrgUnitInterventionItem,
-    BudgetOrgUnitItem,
-    BudgetYearResult,
 )
+from .incremental import patch_year_result, results_match
+from .inputs import BudgetInputs, invalidate_cached_inputs
+from .rollups import build_org_unit_rollups, get_rollup_ancestors
+from .serialization import JSON_ITEMS, MODEL_ITEMS
+from .vectorized import VectorizedBudgetEngine
+
+
+logger = logging.getLogger(__name__)
+
+BUDGET_LINES_BATCH_SIZE = 2000
 
 
 class BudgetCalculationService:
@@ -29,85 +40,275 @@ class BudgetCalculationService:
     Implemented formula:
     quantity = population * yearly_assignment_value * conversion_ratio * buffer
     total_cost = quantity * cost_line_unit_cost * (1 + inflation_rate)^(year - start_year)
+
+    Two engines evaluate this formula:
+    - ENGINE_DECIMAL (default): row by row with Decimal arithmetic.
+    - ENGINE_VECTORIZED: all years at once with NumPy arrays, see ``vectorized.py`` for the
+      rounding rules and the tolerance against the Decimal engine.
     """
 
-    def __init__(self, scenario):
+    ENGINE_DECIMAL = "decimal"
+    ENGINE_VECTORIZED = "vectorized"
+    ENGINES = (ENGINE_DECIMAL, ENGINE_VECTORIZED)
+
+    def __init__(self, scenario, engine=ENGINE_DECIMAL, only_cost_line_ids=None, inputs=None):
+        """When only_cost_line_ids is given, only those cost lines (and the assignments of their
+        interventions) are loaded, so the results hold nothing but their contributions.
+
+        inputs are the scenario's BudgetInputs when already loaded (see for_scenarios).
+        """
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown budget engine: {engine}")
+        self.engine = engine
+        self._vectorized_engine = None
+        self._line_rows_by_year = None
+        self._rollup_ancestors = None
+
         self.scenario = scenario
         self.start_year = scenario.start_year
         self.end_year = scenario.end_year
 
-        self.assignments = list(
-            scenario.intervention_assignments.select_related("intervention", "org_unit")
-            .all()
-            .order_by("org_unit_id", "intervention_id")
-        )
+        if inputs is None:
+            inputs = BudgetInputs.load(scenario, only_cost_line_ids)
+        self.assignments = inputs.assignments
         self.intervention_meta_by_id = {}
-        intervention_ids = set()
-        org_unit_ids = set()
         for assignment in self.assignments:
             self.intervention_meta_by_id[assignment.intervention_id] = {
                 "code": assignment.intervention.code,
                 "type": assignment.intervention.short_name,
             }
-            intervention_ids.add(assignment.intervention_id)
-            org_unit_ids.add(assignment.org_unit_id)
-
-        population_cost_lines = list(
-            InterventionCostBreakdownLine.objects.filter(intervention_id__in=intervention_ids)
-            .select_related("population_layer", "unit_type", "intervention")
-            .order_by("intervention_id", "id")
-        )
 
         self.cost_lines_by_intervention_id = defaultdict(list)
         self.cost_line_by_id = {}
-        cost_line_ids = []
-        metric_type_ids = set()
-        for line in population_cost_lines:
+        for line in inputs.cost_lines:
             self.cost_lines_by_intervention_id[line.intervention_id].append(line)
             self.cost_line_by_id[line.id] = line
-            cost_line_ids.append(line.id)
-            if line.population_layer_id is not None:
-                metric_type_ids.add(line.population_layer_id)
-
-        metric_values = MetricValue.objects.filter(
-            org_unit_id__in=org_unit_ids,
-            year__gte=self.start_year,
-            year__lte=self.end_year,
-            metric_type_id__in=metric_type_ids,
-        ).values("org_unit_id", "year", "metric_type_id", "value")
-        self.population_by_key = {
-            (row["org_unit_id"], row["year"], row["metric_type_id"]): Decimal(str(row["value"]))
-            for row in metric_values
-        }
 
-        yearly_assignments = ScenarioYearlyCostAssignment.objects.filter(
-            scenario=scenario,
-            year__gte=self.start_year,
-            year__lte=self.end_year,
-            cost_line_id__in=cost_line_ids,
-        ).values("cost_line_id", "year", "value")
+        self.population = inputs.population
+        self.yearly_value_by_key = inputs.yearly_value_by_key
+        self.inflation_rate = inputs.inflation_rate
+        self.buffer = inputs.buffer
 
-        self.yearly_value_by_key = {
-            (row["cost_line_id"], row["year"]): Decimal(str(row["value"])) for row in yearly_assignments
-        }
+    @classmethod
+    def for_scenarios(cls, scenarios, engine=ENGINE_DECIMAL):
+        """Return one service per scenario, loading the inputs they share only once."""
+        inputs_by_scenario_id = BudgetInputs.load_many(scenarios)
+        return [cls(scenario, engine=engine, inputs=inputs_by_scenario_id[scenario.id]) for scenario in scenarios]
 
-        budget_settings = BudgetSettings.objects.filter(account=scenario.account).first()
-        self.inflation_rate = Decimal(str(budget_settings.inflation_rate)) if budget_settings else Decimal("0")
-        self.buffer = Decimal(str(budget_settings.buffer)) if budget_settings else Decimal("1.1")
+    def input_fingerprint(self):
+        """Hash of every loaded input the results depend on.
+
+        Built from the data already loaded by __init__, so it costs no extra query. Two services
+        with the same fingerprint produce the same budget.
+        """
+        inputs = [
+            ("years", self.start_year, self.end_year),
+            ("settings", str(self.inflation_rate), str(self.buffer)),
+        ]
+        inputs.extend(
+            (
+                "assignment",
+                assignment.org_unit_id,
+                assignment.intervention_id,
+                assignment.grant_id,
+                assignment.intervention.grant_id,
+                assignment.intervention.code,
+                assignment.intervention.short_name,
+            )
+            for assignment in self.assignments
+        )
+        inputs.extend(
+            (
+                "cost_line",
+                line.id,
+                line.intervention_id,
+                line.updated_at.isoformat() if line.updated_at else None,
+                line.category,
+                str(line.unit_cost),
+                line.is_proportional,
+                str(line.conversion_factor),
+                line.invert_conversion_factor,
+                line.unit_type.name if line.unit_type else None,
+                line.population_layer_id,
+                line.population_layer.name if line.population_layer else None,
+            )
+            for line in self.cost_line_by_id.values()
+        )
+        inputs.extend(("yearly_value", *key, str(value)) for key, value in sorted(self.yearly_value_by_key.items()))
+        inputs.append(("rollups", sorted(self.get_rollup_ancestors().items())))
+        inputs.append(
+            (
+                "population",
+                self.population.fingerprint(
+                    sorted({line.population_layer_id for line in self.cost_line_by_id.values()} - {None}),
+                    sorted({assignment.org_unit_id for assignment in self.assignments}),
+                    self.start_year,
+                    self.end_year,
+                ),
+            )
+        )
+        return hashlib.sha256(repr(inputs).encode()).hexdigest()
 
     def calculate_and_save_all_years(self, user):
-        all_years_results = self.calculate_all_years()
-        return Budget.objects.create(
-            scenario=self.scenario,
-            name=f"Budget for {self.scenario.name}",
-            results=[budget_result.model_dump(mode="json") for budget_result in all_years_results],
-            created_by=user,
-            updated_by=user,
+        """Compute and store a new budget, unless the latest stored budget was computed from the same inputs.
+
+        In that case the latest budget is returned as is.
+        """
+        input_fingerprint = self.input_fingerprint()
+        latest_budget = Budget.objects.filter(scenario=self.scenario).order_by("-created_at").first()
+        if latest_budget and latest_budget.input_fingerprint == input_fingerprint:
+            return latest_budget
+
+        results = self.calculate_all_years_json()
+        with transaction.atomic():
+            budget = Budget.objects.create(
+                scenario=self.scenario,
+                name=f"Budget for {self.scenario.name}",
+                results=results,
+                input_fingerprint=input_fingerprint,
+                created_by=user,
+                updated_by=user,
+            )
+            self._save_lines(budget, self.get_line_rows())
+            self._save_grant_totals(budget)
+        return budget
+
+    @staticmethod
+    def _save_grant_totals(budget):
+        """Rebuild the BudgetGrantTotal rows of a budget from its stored lines."""
+        budget.grant_totals.all().delete()
+        BudgetGrantTotal.objects.bulk_create(
+            BudgetGrantTotal(budget=budget, scenario_id=budget.scenario_id, **total)
+            for total in budget.lines.values("grant_id", "year").annotate(cost=Sum("cost")).order_by()
+        )
+
+    def _save_lines(self, budget, rows):
+        BudgetLine.objects.bulk_create(
+            (
+                BudgetLine(
+                    budget=budget,
+                    scenario=self.scenario,
+                    year=row.year,
+                    org_unit_id=row.org_unit_id,
+                    intervention_id=row.intervention_id,
+                    cost_line_id=row.cost_line_id,
+                    grant_id=row.grant_id,
+                    category=row.category,
+                    population=row.population,
+                    quantity=row.quantity,
+                    cost=row.total_cost,
+                )
+                for row in rows
+            ),
+            batch_size=BUDGET_LINES_BATCH_SIZE,
+        )
+
+    @classmethod
+    def recalculate_cost_line_year(cls, scenario, cost_line_id, year, user, verify=False):
+        """Patch the latest stored budget after the yearly value of one (cost line, year) changed.
+
+        Only the rows of that cost line and year are recomputed; their previous contribution is
+        swapped out of the stored results in place. Falls back to a full recompute (new Budget)
+        when there is no stored budget covering that year, or when it has no stored lines to patch
+        (budgets stored before budget lines existed). The category ids are worked out from the
+        stored lines of the year. With verify=True, a full recompute is also run and saved instead
+        of the patch if both disagree.
+        """
+        invalidate_cached_inputs(scenario.id)
+        budget = Budget.objects.filter(scenario=scenario).order_by("-created_at").first()
+        year_results = budget.results if budget and isinstance(budget.results, list) else []
+        year_index = next((index for index, result in enumerate(year_results) if result.get("year") == year), None)
+        if year_index is None or not budget.lines.exists():
+            return cls(scenario).calculate_and_save_all_years(user)
+
+        delta_service = cls(scenario, only_cost_line_ids=[cost_line_id])
+        cost_line = delta_service.cost_line_by_id.get(cost_line_id)
+        if cost_line is None:
+            # The cost line's intervention is not assigned in this scenario: nothing to patch.
+            return budget
+
+        delta_rows = delta_service.get_line_rows(year)
+        patched_year = patch_year_result(
+            year_results[year_index],
+            delta_service.calculate_year_json(year),
+            cost_line_id=cost_line.id,
+            intervention_id=cost_line.intervention_id,
         )
+        category_line_ids = cls._category_line_ids(budget, year, cost_line.id, delta_rows)
+        patched_year["category_costs"] = [
+            {**item, "id": category_line_ids.get(item["category"], item["id"])}
+            for item in patched_year["category_costs"]
+        ]
+        patched_results = list(year_results)
+        patched_results[year_index] = patched_year
+
+        full_service = None
+        if verify:
+            full_service = cls(scenario)
+            full_results = full_service.calculate_all_years_json()
+            if results_match(patched_results, full_results):
+                full_service = None
+            else:
+                logger.warning(
+                    "Incremental budget update of scenario %s (cost line %s, year %s) diverged from a full recompute",
+                    scenario.id,
+                    cost_line_id,
+                    year,
+                )
+                patched_results = full_results
+
+        with transaction.atomic():
+            if full_service:
+                budget.lines.all().delete()
+                full_service._save_lines(budget, full_service.get_line_rows())
+            else:
+                budget.lines.filter(cost_line_id=cost_line_id, year=year).delete()
+                delta_service._save_lines(budget, delta_rows)
+            budget.results = patched_results
+            # The delta service only loaded the edited cost line, so the inputs of the whole budget are unknown.
+            budget.input_fingerprint = full_service.input_fingerprint() if full_service else ""
+            budget.updated_by = user
+            budget.save(update_fields=["results", "input_fingerprint", "updated_by", "updated_at"])
+            cls._save_grant_totals(budget)
+        return budget
+
+    @staticmethod
+    def _category_line_ids(budget, year, cost_line_id, rows):
+        """Return the id a full computation reports for each category of a year: the cost line of its last row.
+
+        The rows of the year are the stored lines, with those of cost_line_id replaced by rows. Rows follow
+        the assignments by (org unit, intervention), then the cost lines by id; a fixed-cost row comes with
+        the first assignment of its intervention.
+        """
+        first_org_unit_ids = dict(
+            InterventionAssignment.objects.filter(scenario_id=budget.scenario_id)
+            .values("intervention_id")
+            .annotate(first_org_unit_id=Min("org_unit_id"))
+            .values_list("intervention_id", "first_org_unit_id")
+        )
+        stored_lines = (
+            budget.lines.filter(year=year, cost_line__isnull=False)
+            .exclude(cost_line_id=cost_line_id)
+            .values_list("category", "org_unit_id", "intervention_id", "cost_line_id")
+        )
+        new_lines = [(row.category, row.org_unit_id, row.intervention_id, row.cost_line_id) for row in rows]
+
+        last_rows = {}
+        for category, org_unit_id, intervention_id, line_id in chain(stored_lines, new_lines):
+            if org_unit_id is None:
+                org_unit_id = first_org_unit_ids.get(intervention_id, 0)
+            position = (org_unit_id, intervention_id, line_id)
+            if category not in last_rows or position > last_rows[category]:
+                last_rows[category] = position
+        return {category: position[2] for category, position in last_rows.items()}
 
     def calculate_all_years(self):
         return [self.calculate_year(year) for year in range(self.start_year, self.end_year + 1)]
 
+    def calculate_all_years_json(self):
+        """Same as calculate_all_years, dumped with model_dump(mode="json"), but built directly as dicts."""
+        return [self.calculate_year_json(year) for year in range(self.start_year, self.end_year + 1)]
+
     def calculate_grant_costs(self):
         """Aggregate the budget by grant across all scenario years.
 
@@ -118,10 +319,9 @@ class BudgetCalculationService:
         totals: dict[Optional[int], dict[str, Any]] = defaultdict(
             lambda: {"total": Decimal("0"), "by_year": defaultdict(lambda: Decimal("0"))}
         )
-        for year in range(self.start_year, self.end_year + 1):
-            for row in self._compute_breakdown_line_rows(year):
-                totals[row.grant_id]["total"] += row.total_cost
-                totals[row.grant_id]["by_year"][year] += row.total_cost
+        for (grant_id, year), cost in self._grant_year_costs().items():
+            totals[grant_id]["total"] += cost
+            totals[grant_id]["by_year"][year] += cost
 
         grant_ids = [grant_id for grant_id in totals if grant_id is not None]
         grants_by_id = {grant.id: grant for grant in Grant.objects.filter(id__in=grant_ids)}
@@ -154,7 +354,17 @@ class BudgetCalculationService:
 
         return a BudgetYearResult object containing the total cost and quantity for the year, as well as the detailed breakdown by intervention, org unit and category.
         """
-        rows = self._compute_breakdown_line_rows(year)
+        return self._calculate_year(year, MODEL_ITEMS)
+
+    def calculate_year_json(self, year):
+        """Return calculate_year(year).model_dump(mode="json"), built from the aggregation buffers without models."""
+        return self._calculate_year(year, JSON_ITEMS)
+
+    def _calculate_year(self, year, items):
+        if self.engine == self.ENGINE_VECTORIZED:
+            return self._get_vectorized_engine().calculate_year(year, items)
+
+        rows = self.get_line_rows(year)
 
         intervention_totals = defaultdict(lambda: {"total_cost": Decimal("0")})
         intervention_breakdowns = defaultdict(
@@ -244,35 +454,92 @@ class BudgetCalculationService:
 
             total_cost += row.total_cost
 
-        interventions = self._build_interventions(intervention_totals, intervention_breakdowns)
+        interventions = self._build_interventions(intervention_totals, intervention_breakdowns, items)
         org_units_costs = self._build_org_units_costs(
             org_unit_totals,
             org_unit_intervention_totals,
             org_unit_intervention_breakdowns,
+            items,
+        )
+        category_costs = self._build_category_costs(category_totals, items)
+        org_unit_rollups = build_org_unit_rollups(
+            self,
+            (
+                (org_unit_id, intervention_id, bd["id"], bd["total_cost"], bd["quantity"], bd["population"])
+                for org_unit_id, breakdowns_by_intervention in org_unit_intervention_breakdowns.items()
+                for intervention_id, breakdowns in breakdowns_by_intervention.items()
+                for bd in breakdowns.values()
+            ),
+            items,
         )
-        category_costs = self._build_category_costs(category_totals)
 
-        return BudgetYearResult(
+        return items.year(
             year=year,
             total_cost=total_cost,
             interventions=interventions,
             org_units_costs=org_units_costs,
             category_costs=category_costs,
+            org_unit_rollups=org_unit_rollups,
         )
 
-    def _compute_breakdown_line_rows(self, year):
+    def get_rollup_ancestors(self):
+        """Return {org_unit_id: ancestor id} at the account's focus org unit type, loaded on first use.
+
+        Empty when the account has no focus org unit type; see ``rollups.py``.
+        """
+        if self._rollup_ancestors is None:
+            self._rollup_ancestors = get_rollup_ancestors(
+                self.scenario.account_id, sorted({assignment.org_unit_id for assignment in self.assignments})
+            )
+        return self._rollup_ancestors
+
+    def _get_vectorized_engine(self):
+        """Build the dense arrays on first use; they cover every scenario year."""
+        if self._vectorized_engine is None:
+            self._vectorized_engine = VectorizedBudgetEngine(self)
+        return self._vectorized_engine
+
+    def get_line_rows(self, year=None):
+        """Return the raw budget line rows of one year, or of every scenario year when year is None.
+
+        Rows are the single materialized row set of the service: they are computed once, in one pass,
+        and then shared by the per-year results, the grant aggregation and any other slicer.
         """
-        Compute the raw cost breakdown lines for a given year, without any aggregation, to be used as input for the budget calculation.
+        if self.engine == self.ENGINE_VECTORIZED:
+            return list(self._get_vectorized_engine().iter_line_rows(year))
+
+        if self._line_rows_by_year is None:
+            self._line_rows_by_year = self._compute_line_rows()
+        if year is not None:
+            return self._line_rows_by_year.get(year, [])
+        return [row for year_rows in self._line_rows_by_year.values() for row in year_rows]
+
+    def _grant_year_costs(self):
+        """Return the total cost of the line rows per (grant_id, year)."""
+        if self.engine == self.ENGINE_VECTORIZED:
+            return self._get_vectorized_engine().grant_year_costs()
+
+        costs = defaultdict(lambda: Decimal("0"))
+        for row in self.get_line_rows():
+            costs[(row.grant_id, row.year)] += row.total_cost
+        return costs
+
+    def _compute_line_rows(self):
+        """
+        Compute the raw cost breakdown lines of every scenario year, without any aggregation, to be used as input for the budget calculation.
         Calculation is based on the population-driven formula, only processing cost lines with population as cost driver
         And skipping lines with missing population or yearly per scenario cost values.
         Formula quantity: population * yearly_cost_value * conversion_ratio * buffer
         Formula total cost: quantity * cost_line_unit_cost * (1 + inflation_rate)^(year - start_year)
-        """
 
-        rows = []
+        Returns a dict of rows per year; within a year, rows follow the assignment order.
+        """
+        years = range(self.start_year, self.end_year + 1)
+        rows_by_year = {year: [] for year in years}
+        inflation_multipliers = {
+            year: (Decimal("1") + self.inflation_rate) ** (year - self.start_year) for year in years
+        }
         seen_fixed_cost_line_ids = set()
-        years_offset = year - self.start_year
-        inflation_multiplier = (Decimal("1") + self.inflation_rate) ** years_offset
         for assignment in self.assignments:
             intervention = assignment.intervention
             org_unit_id = assignment.org_unit_id
@@ -281,19 +548,21 @@ class BudgetCalculationService:
             grant_id = assignment.grant_id or intervention.grant_id
 
             for line in self.cost_lines_by_intervention_id.get(intervention.id, []):
-                lineToAdd = None
                 if line.is_proportional:
-                    lineToAdd = self._compute_population_cost_row(
-                        line, org_unit_id, year, inflation_multiplier, intervention.id, grant_id
-                    )
+                    compute_row = self._compute_population_cost_row
+                    row_args = (line, org_unit_id)
                 elif line.id not in seen_fixed_cost_line_ids:
                     seen_fixed_cost_line_ids.add(line.id)
-                    lineToAdd = self._compute_fixed_cost_row(
-                        line, year, inflation_multiplier, intervention.id, grant_id
-                    )
-                if lineToAdd:
-                    rows.append(lineToAdd)
-        return rows
+                    compute_row = self._compute_fixed_cost_row
+                    row_args = (line,)
+                else:
+                    continue
+
+                for year in years:
+                    lineToAdd = compute_row(*row_args, year, inflation_multipliers[year], intervention.id, grant_id)
+                    if lineToAdd:
+                        rows_by_year[year].append(lineToAdd)
+        return rows_by_year
 
     def _get_yearly_value(self, line, year):
         default = Decimal("1") if line.is_proportional else Decimal("0")
@@ -306,7 +575,7 @@ class BudgetCalculationService:
         if line.population_layer_id is None:
             return None
 
-        population = self.population_by_key.get((org_unit_id, year, line.population_layer_id), Decimal("0"))
+        population = self.population.get(org_unit_id, year, line.population_layer_id, Decimal("0"))
         if population <= 0:
             return None
 
@@ -322,6 +591,7 @@ class BudgetCalculationService:
 
         category = line.get_category_display()
         return BudgetLineRow(
+            year=year,
             cost_line_id=line.id,
             org_unit_id=org_unit_id,
             intervention_id=intervention_id,
@@ -343,6 +613,7 @@ class BudgetCalculationService:
 
         category = line.get_category_display()
         return BudgetLineRow(
+            year=year,
             cost_line_id=line.id,
             org_unit_id=None,
             intervention_id=intervention_id,
@@ -356,7 +627,7 @@ class BudgetCalculationService:
         # Buffer is already included in ``quantity``; only unit cost and inflation apply here.
         return quantity * Decimal(str(unit_cost)) * inflation_multiplier
 
-    def _build_interventions(self, intervention_totals, intervention_breakdowns):
+    def _build_interventions(self, intervention_totals, intervention_breakdowns, items=MODEL_ITEMS):
         """
         Build the list of interventions with their cost breakdown, based on the computed totals and breakdowns.
         Interventions with total cost <= 0 are filtered out, as well as breakdown items with total cost <= 0.
@@ -364,7 +635,7 @@ class BudgetCalculationService:
         interventions = []
         for intervention_id, totals in sorted(intervention_totals.items(), key=lambda x: x[0]):
             breakdown_items = [
-                BudgetBreakdownItem(
+                items.breakdown(
                     id=bd["id"],
                     category=bd["category"],
                     total_cost=bd["total_cost"],
@@ -384,7 +655,7 @@ class BudgetCalculationService:
                 continue
             intervention_meta = self.intervention_meta_by_id.get(intervention_id, {})
             interventions.append(
-                BudgetInterventionItem(
+                items.intervention(
                     id=intervention_id,
                     code=intervention_meta.get("code", ""),
                     type=intervention_meta.get("type", ""),
@@ -399,6 +670,7 @@ class BudgetCalculationService:
         org_unit_totals,
         org_unit_intervention_totals,
         org_unit_intervention_breakdowns,
+        items=MODEL_ITEMS,
     ):
         """
         Build the list of org units costs with their interventions and breakdown, based on the computed totals and breakdowns.
@@ -414,7 +686,7 @@ class BudgetCalculationService:
                 org_unit_intervention_totals[org_unit_id].items(), key=lambda x: x[0]
             ):
                 breakdown_items = [
-                    BudgetBreakdownItem(
+                    items.breakdown(
                         id=bd["id"],
                         category=bd["category"],
                         total_cost=bd["total_cost"],
@@ -437,7 +709,7 @@ class BudgetCalculationService:
                 intervention_meta = self.intervention_meta_by_id.get(intervention_id, {})
 
                 intervention_items.append(
-                    BudgetOrgUnitInterventionItem(
+                    items.org_unit_intervention(
                         id=intervention_id,
                         code=intervention_meta.get("code", ""),
                         type=intervention_meta.get("type", ""),
@@ -447,7 +719,7 @@ class BudgetCalculationService:
                 )
 
             org_units_costs.append(
-                BudgetOrgUnitItem(
+                items.org_unit(
                     org_unit_id=org_unit_id,
                     total_cost=totals["total_cost"],
                     interventions=intervention_items,
@@ -456,13 +728,13 @@ class BudgetCalculationService:
         return org_units_costs
 
     @staticmethod
-    def _build_category_costs(category_totals):
+    def _build_category_costs(category_totals, items=MODEL_ITEMS):
         """
         Build the list of category costs based on the computed totals.
         Categories with total cost <= 0 are filtered out.
         """
         return [
-            BudgetBreakdownItem(
+            items.breakdown(
                 id=totals["id"],
                 category=category,
                 total_cost=totals["total_cost"],
@@ -0,0 +1,80 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from .budget_calculation import BudgetCalculationService
+from .dataclasses import (
+    BudgetComparisonIntervention,
+    BudgetComparisonOrgUnit,
+    BudgetComparisonYear,
+    BudgetScenarioComparison,
+)
+
+
+def _totals(rows):
+    by_year = defaultdict(Decimal)
+    by_intervention = defaultdict(Decimal)
+    by_org_unit = defaultdict(Decimal)
+    for row in rows:
+        by_year[row.year] += row.total_cost
+        by_intervention[row.intervention_id] += row.total_cost
+        # Fixed costs are not attributed to an org unit, as in the budget results.
+        if row.org_unit_id is not None:
+            by_org_unit[row.org_unit_id] += row.total_cost
+    return by_year, by_intervention, by_org_unit
+
+
+def _with_deltas(totals, baseline_totals):
+    """Yield (key, total, delta) for every key of either side, missing ones counting as zero."""
+    for key in sorted(set(totals) | set(baseline_totals)):
+        total = totals.get(key, Decimal("0"))
+        yield key, total, total - baseline_totals.get(key, Decimal("0"))
+
+
+def compare_scenario_budgets(scenarios):
+    """Compute the budgets of several scenarios and compare them to the first one.
+
+    The inputs are loaded once for all scenarios (see BudgetCalculationService.for_scenarios).
+    Returns one BudgetScenarioComparison per scenario, in the given order; deltas are relative to the
+    first scenario, whose deltas are therefore zero.
+    """
+    services = BudgetCalculationService.for_scenarios(scenarios)
+    totals = [_totals(service.get_line_rows()) for service in services]
+    baseline_by_year, baseline_by_intervention, baseline_by_org_unit = totals[0]
+    baseline_total = sum(baseline_by_year.values(), Decimal("0"))
+
+    intervention_codes = {}
+    for service in services:
+        for intervention_id, meta in service.intervention_meta_by_id.items():
+            intervention_codes[intervention_id] = meta["code"]
+
+    comparisons = []
+    for scenario, (by_year, by_intervention, by_org_unit) in zip(scenarios, totals):
+        total = sum(by_year.values(), Decimal("0"))
+        comparisons.append(
+            BudgetScenarioComparison(
+                scenario_id=scenario.id,
+                name=scenario.name,
+                total_cost=total,
+                delta=total - baseline_total,
+                years=[
+                    BudgetComparisonYear(year=year, total_cost=year_total, delta=delta)
+                    for year, year_total, delta in _with_deltas(by_year, baseline_by_year)
+                ],
+                interventions=[
+                    BudgetComparisonIntervention(
+                        intervention_id=intervention_id,
+                        code=intervention_codes.get(intervention_id),
+                        total_cost=intervention_total,
+                        delta=delta,
+                    )
+                    for intervention_id, intervention_total, delta in _with_deltas(
+                        by_intervention, baseline_by_intervention
+                    )
+                ],
+                org_units=[
+                    BudgetComparisonOrgUnit(org_unit_id=org_unit_id, total_cost=org_unit_total, delta=delta)
+                    for org_unit_id, org_unit_total, delta in _with_deltas(by_org_unit, baseline_by_org_unit)
+                ],
+            )
+        )
+    return comparisons
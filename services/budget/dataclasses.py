@@ -53,9 +53,12 @@ class BudgetYearResult(BudgetBaseModel):
     interventions: list[BudgetInterventionItem]
     org_units_costs: list[BudgetOrgUnitItem]
     category_costs: list[BudgetBreakdownItem]
+    # org_units_costs summed per ancestor at the account's focus org unit type (see rollups.py).
+    org_unit_rollups: list[BudgetOrgUnitItem] = Field(default_factory=list)
 
 
 class BudgetLineRow(BudgetBaseModel):
+    year: int
     cost_line_id: int
     org_unit_id: Optional[int]
     intervention_id: int
@@ -78,3 +81,79 @@ class BudgetGrantCostItem(BudgetBaseModel):
     amount: Optional[Decimal] = None
     total_cost: Decimal = Decimal("0.0")
     yearly_costs: list[BudgetGrantYearCost] = Field(default_factory=list)
+
+
+class GrantScenarioUtilization(BudgetBaseModel):
+    scenario_id: int
+    scenario_name: str
+    budget_id: int
+    total_cost: Decimal = Decimal("0.0")
+    # total_cost / grant amount, None when the grant has no amount.
+    utilization: Optional[float] = None
+    remaining: Optional[Decimal] = None
+
+
+class GrantUtilizationItem(BudgetBaseModel):
+    grant_id: int
+    name: str
+    short_name: str = ""
+    amount: Optional[Decimal] = None
+    scenarios: list[GrantScenarioUtilization] = Field(default_factory=list)
+    # Scenarios whose latest budget was stored before grant totals existed: their consumption is unknown.
+    scenario_ids_without_totals: list[int] = Field(default_factory=list)
+
+
+class BudgetComparisonYear(BudgetBaseModel):
+    year: int
+    total_cost: Decimal = Decimal("0.0")
+    delta: Decimal = Decimal("0.0")
+
+
+class BudgetComparisonIntervention(BudgetBaseModel):
+    intervention_id: int
+    code: Optional[str] = None
+    total_cost: Decimal = Decimal("0.0")
+    delta: Decimal = Decimal("0.0")
+
+
+class BudgetComparisonOrgUnit(BudgetBaseModel):
+    org_unit_id: int
+    total_cost: Decimal = Decimal("0.0")
+    delta: Decimal = Decimal("0.0")
+
+
+class BudgetScenarioComparison(BudgetBaseModel):
+    scenario_id: int
+    name: str
+    total_cost: Decimal = Decimal("0.0")
+    delta: Decimal = Decimal("0.0")
+    years: list[BudgetComparisonYear] = Field(default_factory=list)
+    interventions: list[BudgetComparisonIntervention] = Field(default_factory=list)
+    org_units: list[BudgetComparisonOrgUnit] = Field(default_factory=list)
+
+
+class BudgetSensitivityBand(BudgetBaseModel):
+    base: float
+    mean: float
+    # {percentile: value}, e.g. {"5": ..., "50": ..., "95": ...}
+    percentiles: dict[str, float] = Field(default_factory=dict)
+
+
+class BudgetSensitivityYear(BudgetBaseModel):
+    year: int
+    total_cost: BudgetSensitivityBand
+
+
+class BudgetSensitivityIntervention(BudgetBaseModel):
+    intervention_id: int
+    code: Optional[str] = None
+    total_cost: BudgetSensitivityBand
+    years: list[BudgetSensitivityYear] = Field(default_factory=list)
+
+
+class BudgetSensitivityResult(BudgetBaseModel):
+    scenario_id: int
+    draws: int
+    total_cost: BudgetSensitivityBand
+    years: list[BudgetSensitivityYear] = Field(default_factory=list)
+    interventions: list[BudgetSensitivityIntervention] = Field(default_factory=list)
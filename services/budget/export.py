@@ -0,0 +1,164 @@
+"""
+Flat export of budget line rows (one row per year, org unit and cost line).
+
+Rows are read from the stored ``BudgetLine`` table with a server-side cursor and written out one
+batch at a time, so memory does not grow with the size of the budget. Budgets stored before budget
+lines existed have no such rows; their rows are recomputed from the scenario instead.
+"""
+
+import csv
+
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+
+from .budget_calculation import BudgetCalculationService
+
+
+EXPORT_BATCH_SIZE = 5000
+
+EXPORT_COLUMNS = [
+    "year",
+    "org_unit_id",
+    "org_unit_name",
+    "intervention_id",
+    "intervention_code",
+    "cost_line_id",
+    "cost_line_name",
+    "category",
+    "grant_id",
+    "population",
+    "quantity",
+    "cost",
+]
+
+_STORED_LINE_FIELDS = [
+    "year",
+    "org_unit_id",
+    "org_unit__name",
+    "intervention_id",
+    "intervention__code",
+    "cost_line_id",
+    "cost_line__name",
+    "category",
+    "grant_id",
+    "population",
+    "quantity",
+    "cost",
+]
+
+_DECIMAL_COLUMNS = {"population", "quantity", "cost"}
+
+
+def iter_stored_line_rows(lines):
+    """Yield export rows from a BudgetLine queryset."""
+    return (
+        lines.order_by("year", "org_unit_id", "intervention_id", "cost_line_id")
+        .values_list(*_STORED_LINE_FIELDS)
+        .iterator(chunk_size=EXPORT_BATCH_SIZE)
+    )
+
+
+def _filter_rows(rows, filters):
+    """filters maps BudgetLineRow attributes (year, org_unit_id, intervention_id, category) to the value to keep."""
+    filters = filters or {}
+    return (row for row in rows if all(getattr(row, field) == value for field, value in filters.items()))
+
+
+def iter_computed_line_rows(scenario, filters=None):
+    """Yield export rows computed from the current scenario inputs, see _filter_rows for filters."""
+    service = BudgetCalculationService(scenario)
+    org_unit_names = {assignment.org_unit_id: assignment.org_unit.name for assignment in service.assignments}
+    for row in _filter_rows(service.get_line_rows(), filters):
+        cost_line = service.cost_line_by_id[row.cost_line_id]
+        yield (
+            row.year,
+            row.org_unit_id,
+            org_unit_names.get(row.org_unit_id),
+            row.intervention_id,
+            service.intervention_meta_by_id[row.intervention_id]["code"],
+            row.cost_line_id,
+            cost_line.name,
+            row.category,
+            row.grant_id,
+            row.population,
+            row.quantity,
+            row.total_cost,
+        )
+
+
+def aggregate_computed_line_rows(scenario, filters=None, group_by=()):
+    """Aggregate the rows computed from the current scenario inputs, as the budget lines action aggregates
+    stored rows.
+
+    Returns (total quantity, total cost, groups), groups being [(group_by values, quantity, cost)] ordered by
+    the group_by values, missing ones last.
+    """
+    total_quantity = total_cost = Decimal("0")
+    totals_by_group = defaultdict(lambda: [Decimal("0"), Decimal("0")])
+    for row in _filter_rows(BudgetCalculationService(scenario).get_line_rows(), filters):
+        total_quantity += row.quantity
+        total_cost += row.total_cost
+        if group_by:
+            group_totals = totals_by_group[tuple(getattr(row, field) for field in group_by)]
+            group_totals[0] += row.quantity
+            group_totals[1] += row.total_cost
+
+    groups = sorted(
+        ((key, quantity, cost) for key, (quantity, cost) in totals_by_group.items()),
+        key=lambda group: [(value is None, value) for value in group[0]],
+    )
+    return total_quantity, total_cost, groups
+
+
+class _Echo:
+    """File-like object whose write returns the value, for csv.writer to produce lines on demand."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_parquet(rows, file):
+    """Write rows to a Parquet file, one row group per batch.
+
+    Requires the optional pyarrow dependency (ImportError otherwise).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ("year", pa.int32()),
+            ("org_unit_id", pa.int64()),
+            ("org_unit_name", pa.string()),
+            ("intervention_id", pa.int64()),
+            ("intervention_code", pa.string()),
+            ("cost_line_id", pa.int64()),
+            ("cost_line_name", pa.string()),
+            ("category", pa.string()),
+            ("grant_id", pa.int64()),
+            ("population", pa.float64()),
+            ("quantity", pa.float64()),
+            ("cost", pa.float64()),
+        ]
+    )
+    rows = iter(rows)
+    with pq.ParquetWriter(file, schema) as writer:
+        while batch := list(islice(rows, EXPORT_BATCH_SIZE)):
+            columns = list(zip(*batch))
+            writer.write_batch(
+                pa.record_batch(
+                    [
+                        [float(value) for value in column] if name in _DECIMAL_COLUMNS else list(column)
+                        for name, column in zip(EXPORT_COLUMNS, columns)
+                    ],
+                    schema=schema,
+                )
+            )
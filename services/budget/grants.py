@@ -0,0 +1,100 @@
+"""
+Grant consumption read from the ``BudgetGrantTotal`` rows stored with each budget.
+
+Only the latest budget of each scenario counts. The scenarios of an account are alternatives, so
+consumption is reported per scenario rather than summed across them.
+"""
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import Exists, FilteredRelation, IntegerField, OuterRef, Q, Subquery, Sum
+
+from plugins.snt_malaria.models import Budget, BudgetGrantTotal, Grant
+
+from .dataclasses import GrantScenarioUtilization, GrantUtilizationItem
+
+
+def latest_budget_ids(account):
+    """Subquery of the id of the latest budget of each scenario of the account."""
+    return (
+        Budget.objects.filter(scenario__account=account, scenario__deleted_at__isnull=True)
+        .order_by("scenario_id", "-created_at")
+        .distinct("scenario_id")
+        .values("id")
+    )
+
+
+def without_grant_totals(budgets):
+    """Filter budgets to the ones stored before grant totals existed.
+
+    Those have no fingerprint (patched budgets neither, but they have totals) and no BudgetGrantTotal
+    row; the backfill_budget_grant_totals command recomputes them.
+    """
+    return budgets.filter(input_fingerprint="").exclude(
+        Exists(BudgetGrantTotal.objects.filter(budget_id=OuterRef("id")))
+    )
+
+
+def grant_utilization(account):
+    """Return one GrantUtilizationItem per grant of the account, with its consumption in each scenario.
+
+    A single query groups the stored grant totals of the latest budgets by grant and scenario. Grants
+    no scenario uses come back with no scenarios. Scenarios whose latest budget has no stored totals
+    are listed apart on every grant, their consumption being unknown.
+    """
+    scenario_ids_without_totals = (
+        without_grant_totals(Budget.objects.filter(id__in=latest_budget_ids(account)))
+        .order_by()
+        .values("scenario__account_id")
+        .annotate(scenario_ids=ArrayAgg("scenario_id", ordering="scenario_id"))
+        .values("scenario_ids")
+    )
+    rows = (
+        Grant.objects.filter(account=account)
+        .annotate(
+            latest_totals=FilteredRelation(
+                "budget_totals", condition=Q(budget_totals__budget_id__in=latest_budget_ids(account))
+            )
+        )
+        .values(
+            "id",
+            "name",
+            "short_name",
+            "amount",
+            "latest_totals__scenario_id",
+            "latest_totals__scenario__name",
+            "latest_totals__budget_id",
+        )
+        .annotate(
+            total_cost=Sum("latest_totals__cost"),
+            scenario_ids_without_totals=Subquery(scenario_ids_without_totals, output_field=ArrayField(IntegerField())),
+        )
+        .order_by("name", "id", "latest_totals__scenario_id")
+    )
+
+    items = {}
+    for row in rows:
+        item = items.get(row["id"])
+        if item is None:
+            item = items[row["id"]] = GrantUtilizationItem(
+                grant_id=row["id"],
+                name=row["name"],
+                short_name=row["short_name"],
+                amount=row["amount"],
+                scenario_ids_without_totals=row["scenario_ids_without_totals"] or [],
+            )
+        # The single row of a grant the latest budgets do not use.
+        if row["latest_totals__scenario_id"] is None:
+            continue
+        amount = row["amount"]
+        item.scenarios.append(
+            GrantScenarioUtilization(
+                scenario_id=row["latest_totals__scenario_id"],
+                scenario_name=row["latest_totals__scenario__name"],
+                budget_id=row["latest_totals__budget_id"],
+                total_cost=row["total_cost"],
+                utilization=float(row["total_cost"] / amount) if amount else None,
+                remaining=amount - row["total_cost"] if amount is not None else None,
+            )
+        )
+    return list(items.values())
@@ -0,0 +1,135 @@
+"""
+Incremental patching of stored budget results.
+
+A stored budget is a list of ``BudgetYearResult`` dumps (``model_dump(mode="json")``). When a single
+cost line changes for a single year, its contribution can be swapped out of the stored year without
+recomputing any other cost line: the line's breakdown items are dropped from every intervention and
+org unit (and org unit rollup), the freshly computed ones (a ``BudgetYearResult`` holding nothing but that line) are merged
+in, and every total above them is re-summed from its breakdown items.
+
+The category totals are the one place the line cannot be isolated, so they are adjusted by the
+difference between the removed and the added amounts. Their ids (the cost line of the last row of the
+category) depend on rows outside the line: the caller sets them from the stored budget lines.
+"""
+
+import math
+
+
+# Float comparisons between a patched and a fully recomputed budget.
+RELATIVE_TOLERANCE = 1e-9
+ABSOLUTE_TOLERANCE = 1e-6
+
+
+def _without_line(breakdown, cost_line_id):
+    return [item for item in breakdown if item["id"] != cost_line_id]
+
+
+def _merge_interventions(items, delta_items, cost_line_id):
+    """Swap the cost line's breakdown items of a list of (org unit) intervention items, re-summing totals."""
+    items_by_id = {
+        item["id"]: {**item, "cost_breakdown": _without_line(item["cost_breakdown"], cost_line_id)} for item in items
+    }
+    for delta_item in delta_items:
+        if delta_item["id"] in items_by_id:
+            items_by_id[delta_item["id"]]["cost_breakdown"].extend(delta_item["cost_breakdown"])
+        else:
+            items_by_id[delta_item["id"]] = {**delta_item, "cost_breakdown": list(delta_item["cost_breakdown"])}
+
+    merged = []
+    for intervention_id in sorted(items_by_id):
+        item = items_by_id[intervention_id]
+        if not item["cost_breakdown"]:
+            continue
+        item["cost_breakdown"].sort(key=lambda breakdown_item: breakdown_item["id"])
+        item["total_cost"] = sum(breakdown_item["total_cost"] for breakdown_item in item["cost_breakdown"])
+        merged.append(item)
+    return merged
+
+
+def _merge_org_units(org_units, delta_org_units, cost_line_id):
+    delta_by_org_unit_id = {item["org_unit_id"]: item for item in delta_org_units}
+    org_unit_ids = sorted({item["org_unit_id"] for item in org_units} | set(delta_by_org_unit_id))
+    org_units_by_id = {item["org_unit_id"]: item for item in org_units}
+
+    merged = []
+    for org_unit_id in org_unit_ids:
+        stored = org_units_by_id.get(org_unit_id, {"interventions": []})
+        delta = delta_by_org_unit_id.get(org_unit_id, {"interventions": []})
+        interventions = _merge_interventions(stored["interventions"], delta["interventions"], cost_line_id)
+        if not interventions:
+            continue
+        merged.append(
+            {
+                "org_unit_id": org_unit_id,
+                "total_cost": sum(item["total_cost"] for item in interventions),
+                "interventions": interventions,
+            }
+        )
+    return merged
+
+
+def _merge_category_costs(category_costs, removed, delta_category_costs):
+    """Adjust the category totals by the removed and added amounts of the cost line."""
+    categories = {item["category"]: dict(item) for item in category_costs}
+    for item in removed:
+        category = categories.get(item["category"])
+        if category:
+            category["total_cost"] -= item["total_cost"]
+            category["quantity"] -= item["quantity"]
+    for item in delta_category_costs:
+        if item["category"] in categories:
+            categories[item["category"]]["total_cost"] += item["total_cost"]
+            categories[item["category"]]["quantity"] += item["quantity"]
+        else:
+            categories[item["category"]] = dict(item)
+
+    return [
+        item
+        for _, item in sorted(categories.items(), key=lambda x: x[0])
+        if item["total_cost"] > 0 and not math.isclose(item["total_cost"], 0, abs_tol=ABSOLUTE_TOLERANCE)
+    ]
+
+
+def patch_year_result(year_result, delta_result, cost_line_id, intervention_id):
+    """Return a copy of a stored year result where the given cost line's contribution is replaced by delta_result.
+
+    delta_result is the dump of a BudgetYearResult computed from that single cost line.
+    """
+    removed = [
+        breakdown_item
+        for item in year_result["interventions"]
+        if item["id"] == intervention_id
+        for breakdown_item in item["cost_breakdown"]
+        if breakdown_item["id"] == cost_line_id
+    ]
+    interventions = _merge_interventions(year_result["interventions"], delta_result["interventions"], cost_line_id)
+    patched = {
+        **year_result,
+        "total_cost": sum(item["total_cost"] for item in interventions),
+        "interventions": interventions,
+        "org_units_costs": _merge_org_units(
+            year_result["org_units_costs"], delta_result["org_units_costs"], cost_line_id
+        ),
+        "category_costs": _merge_category_costs(year_result["category_costs"], removed, delta_result["category_costs"]),
+    }
+    # Results stored before rollups existed have none to patch; the next full recompute adds them.
+    if "org_unit_rollups" in year_result:
+        patched["org_unit_rollups"] = _merge_org_units(
+            year_result["org_unit_rollups"], delta_result.get("org_unit_rollups", []), cost_line_id
+        )
+    return patched
+
+
+def results_match(actual, expected):
+    """Compare two lists of budget year result dumps, allowing float rounding differences."""
+    return _values_match(actual, expected)
+
+
+def _values_match(actual, expected):
+    if isinstance(expected, dict):
+        return set(actual) == set(expected) and all(_values_match(actual[key], expected[key]) for key in expected)
+    if isinstance(expected, list):
+        return len(actual) == len(expected) and all(map(_values_match, actual, expected))
+    if isinstance(expected, float) and isinstance(actual, (int, float)):
+        return math.isclose(actual, expected, rel_tol=RELATIVE_TOLERANCE, abs_tol=ABSOLUTE_TOLERANCE)
+    return actual == expected
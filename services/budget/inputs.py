@@ -0,0 +1,232 @@
+import threading
+import time
+
+from collections import OrderedDict, defaultdict
+from decimal import Decimal
+
+from django.db.models import BigIntegerField, Count, DecimalField, ExpressionWrapper, F, Max, Sum, Value
+from django.db.models.functions import Coalesce
+
+from iaso.models import MetricValue
+from plugins.snt_malaria.models import (
+    BudgetSettings,
+    Intervention,
+    InterventionAssignment,
+    InterventionCostBreakdownLine,
+    ScenarioYearlyCostAssignment,
+)
+
+from .population import data_version, load_population
+
+
+DEFAULT_BUFFER = Decimal("1.1")
+
+INPUTS_CACHE_SIZE = 32
+INPUTS_CACHE_TTL_SECONDS = 300
+
+# {scenario_id: (account_id, inputs version, loaded_at, BudgetInputs)}, least recently used first.
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class BudgetInputs:
+    """Everything the budget of one scenario is computed from.
+
+    load_many reads the inputs of several scenarios with one query per kind of input, so the cost
+    lines, budget settings and population rows they share are only read once. Each scenario then
+    gets its own slice, identical to what loading it alone would return, except for the population
+    lookup, which is shared (see ``population.py``).
+    """
+
+    def __init__(self, assignments, cost_lines, population, yearly_value_by_key, inflation_rate, buffer):
+        # Assignments ordered by (org_unit_id, intervention_id), with intervention and org_unit selected.
+        self.assignments = assignments
+        # Cost lines of the assigned interventions, ordered by (intervention_id, id).
+        self.cost_lines = cost_lines
+        # PopulationLookup covering at least the assigned org units, the cost lines' layers and the years.
+        self.population = population
+        # {(cost_line_id, year): value}
+        self.yearly_value_by_key = yearly_value_by_key
+        self.inflation_rate = inflation_rate
+        self.buffer = buffer
+
+    @classmethod
+    def load(cls, scenario, only_cost_line_ids=None):
+        """When only_cost_line_ids is given, only those cost lines (and the assignments of their
+        interventions) are loaded."""
+        return cls.load_many([scenario], only_cost_line_ids)[scenario.id]
+
+    @classmethod
+    def load_cached(cls, scenario):
+        """Return the scenario's inputs from the process cache, loading them when missing or stale.
+
+        An entry is stale once the scenario's inputs_version moved, which any write to the inputs does,
+        in this process or another, or after INPUTS_CACHE_TTL_SECONDS. The returned inputs are shared:
+        callers must not mutate them.
+        """
+        version = inputs_version(scenario)
+        with _cache_lock:
+            entry = _cache.get(scenario.id)
+            if entry:
+                _, entry_version, loaded_at, inputs = entry
+                if entry_version == version and time.monotonic() - loaded_at < INPUTS_CACHE_TTL_SECONDS:
+                    _cache.move_to_end(scenario.id)
+                    return inputs
+
+        inputs = cls.load(scenario)
+        with _cache_lock:
+            _cache[scenario.id] = (scenario.account_id, version, time.monotonic(), inputs)
+            _cache.move_to_end(scenario.id)
+            while len(_cache) > INPUTS_CACHE_SIZE:
+                _cache.popitem(last=False)
+        return inputs
+
+    @classmethod
+    def load_many(cls, scenarios, only_cost_line_ids=None):
+        """Return {scenario_id: BudgetInputs} for the given scenarios."""
+        scenario_ids = [scenario.id for scenario in scenarios]
+
+        assignments = InterventionAssignment.objects.filter(scenario_id__in=scenario_ids).select_related(
+            "intervention", "org_unit"
+        )
+        if only_cost_line_ids is not None:
+            cost_line_interventions = InterventionCostBreakdownLine.objects.filter(id__in=only_cost_line_ids)
+            assignments = assignments.filter(intervention_id__in=cost_line_interventions.values("intervention_id"))
+        assignments_by_scenario_id = defaultdict(list)
+        for assignment in assignments.order_by("scenario_id", "org_unit_id", "intervention_id"):
+            assignments_by_scenario_id[assignment.scenario_id].append(assignment)
+
+        intervention_ids = {
+            assignment.intervention_id
+            for assignments in assignments_by_scenario_id.values()
+            for assignment in assignments
+        }
+        cost_lines = InterventionCostBreakdownLine.objects.filter(intervention_id__in=intervention_ids)
+        if only_cost_line_ids is not None:
+            cost_lines = cost_lines.filter(id__in=only_cost_line_ids)
+        cost_lines_by_intervention_id = defaultdict(list)
+        for line in cost_lines.select_related("population_layer", "unit_type", "intervention").order_by(
+            "intervention_id", "id"
+        ):
+            cost_lines_by_intervention_id[line.intervention_id].append(line)
+
+        metric_type_ids = {
+            line.population_layer_id
+            for lines in cost_lines_by_intervention_id.values()
+            for line in lines
+            if line.population_layer_id is not None
+        }
+        start_year = min((scenario.start_year for scenario in scenarios), default=None)
+        end_year = max((scenario.end_year for scenario in scenarios), default=None)
+        population = load_population(metric_type_ids, start_year, end_year)
+
+        yearly_values_by_scenario_id = defaultdict(dict)
+        yearly_assignments = ScenarioYearlyCostAssignment.objects.filter(
+            scenario_id__in=scenario_ids,
+            year__gte=start_year,
+            year__lte=end_year,
+            cost_line_id__in=[line.id for lines in cost_lines_by_intervention_id.values() for line in lines],
+        ).values_list("scenario_id", "cost_line_id", "year", "value")
+        for scenario_id, cost_line_id, year, value in yearly_assignments:
+            yearly_values_by_scenario_id[scenario_id][(cost_line_id, year)] = Decimal(str(value))
+
+        settings_by_account_id = {
+            budget_settings.account_id: budget_settings
+            for budget_settings in BudgetSettings.objects.filter(
+                account_id__in={scenario.account_id for scenario in scenarios}
+            )
+        }
+
+        inputs_by_scenario_id = {}
+        for scenario in scenarios:
+            years = range(scenario.start_year, scenario.end_year + 1)
+            scenario_assignments = assignments_by_scenario_id[scenario.id]
+            scenario_intervention_ids = sorted({assignment.intervention_id for assignment in scenario_assignments})
+            scenario_cost_lines = [
+                line
+                for intervention_id in scenario_intervention_ids
+                for line in cost_lines_by_intervention_id[intervention_id]
+            ]
+            scenario_cost_line_ids = {line.id for line in scenario_cost_lines}
+            budget_settings = settings_by_account_id.get(scenario.account_id)
+
+            inputs_by_scenario_id[scenario.id] = cls(
+                assignments=scenario_assignments,
+                cost_lines=scenario_cost_lines,
+                population=population,
+                yearly_value_by_key={
+                    (cost_line_id, year): value
+                    for (cost_line_id, year), value in yearly_values_by_scenario_id[scenario.id].items()
+                    if cost_line_id in scenario_cost_line_ids and year in years
+                },
+                inflation_rate=Decimal(str(budget_settings.inflation_rate)) if budget_settings else Decimal("0"),
+                buffer=Decimal(str(budget_settings.buffer)) if budget_settings else DEFAULT_BUFFER,
+            )
+        return inputs_by_scenario_id
+
+
+def _checksum(field, output_field=None):
+    """Sum of field * id: moves when the field of one of the rows is updated in place."""
+    return Sum(ExpressionWrapper(F(field) * F("id"), output_field=output_field or DecimalField()))
+
+
+def inputs_version(scenario):
+    """Summary of everything BudgetInputs.load reads for the scenario, read with aggregate queries only.
+
+    It changes whenever an assignment, an assigned intervention or its cost lines, a yearly value, the
+    budget settings or the population rows of the cost lines' layers are created, deleted or updated.
+    """
+    assignments = InterventionAssignment.objects.filter(scenario_id=scenario.id)
+    intervention_ids = assignments.values("intervention_id")
+    cost_lines = InterventionCostBreakdownLine.objects.filter(intervention_id__in=intervention_ids)
+    budget_settings = BudgetSettings.objects.filter(account_id=scenario.account_id)
+    return (
+        scenario.start_year,
+        scenario.end_year,
+        tuple(
+            assignments.annotate(grant_or_zero=Coalesce("grant_id", Value(0), output_field=BigIntegerField()))
+            .aggregate(count=Count("id"), max_id=Max("id"), grants=_checksum("grant_or_zero", BigIntegerField()))
+            .values()
+        ),
+        tuple(Intervention.objects.filter(id__in=intervention_ids).aggregate(Count("id"), Max("updated_at")).values()),
+        tuple(
+            cost_lines.aggregate(
+                count=Count("id"),
+                max_id=Max("id"),
+                updated_at=Max("updated_at"),
+                unit_costs=_checksum("unit_cost"),
+                conversion_factors=_checksum("conversion_factor"),
+            ).values()
+        ),
+        tuple(
+            ScenarioYearlyCostAssignment.objects.filter(scenario_id=scenario.id)
+            .aggregate(count=Count("id"), max_id=Max("id"), values=_checksum("value"))
+            .values()
+        ),
+        budget_settings.values_list("inflation_rate", "buffer").first(),
+        data_version(
+            MetricValue.objects.filter(
+                metric_type_id__in=cost_lines.exclude(population_layer=None).values("population_layer_id"),
+                year__gte=scenario.start_year,
+                year__lte=scenario.end_year,
+                value__isnull=False,
+            )
+        ),
+    )
+
+
+def invalidate_cached_inputs(scenario_id):
+    with _cache_lock:
+        _cache.pop(scenario_id, None)
+
+
+def invalidate_account_cached_inputs(account_id):
+    """Drop the cached inputs of all the scenarios of an account, after an edit shared by them."""
+    with _cache_lock:
+        for scenario_id in [scenario_id for scenario_id, entry in _cache.items() if entry[0] == account_id]:
+            del _cache[scenario_id]
+
+
+def clear_inputs_cache():
+    with _cache_lock:
+        _cache.clear()
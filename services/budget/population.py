@@ -0,0 +1,170 @@
+"""
+Population values read by the budget engines.
+
+Population rows (``MetricValue`` of the cost lines' population layers) are the largest budget input.
+Instead of one ``{(org_unit_id, year, metric_type_id): Decimal}`` entry per row, a ``PopulationLookup``
+holds them in a single float64 array indexed by (layer, org unit, year), with the org unit ids and
+layer ids interned once in sorted arrays. The array is filled straight from a ``values_list`` cursor,
+chunk by chunk.
+
+Lookups cover every org unit of the requested layers and years, so all the scenarios of an account
+share them. ``load_population`` keeps the most recently used ones in a process-wide cache keyed by
+the layers, the years and the data version of their rows (see ``data_version``); any change to
+those rows gives a new data version, hence a fresh load.
+"""
+
+import hashlib
+import threading
+
+from collections import OrderedDict
+from decimal import Decimal
+from itertools import islice
+
+import numpy as np
+
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Max, Sum
+
+from iaso.models import MetricValue
+
+
+POPULATION_CACHE_SIZE = 8
+POPULATION_LOAD_CHUNK_SIZE = 20000
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class PopulationLookup:
+    """Population per (org unit, year, metric type), NaN where no value is stored."""
+
+    def __init__(self, metric_type_ids, org_unit_ids, start_year, year_count, values):
+        self.metric_type_ids = np.asarray(metric_type_ids, dtype=np.int64)
+        self.org_unit_ids = np.asarray(org_unit_ids, dtype=np.int64)
+        self.start_year = start_year
+        self.year_count = year_count
+        # Shape (len(metric_type_ids), len(org_unit_ids), year_count).
+        self.values = values
+        self._metric_type_index = {metric_type_id: index for index, metric_type_id in enumerate(metric_type_ids)}
+        self._org_unit_index = {org_unit_id: index for index, org_unit_id in enumerate(self.org_unit_ids.tolist())}
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], 0, 0, np.empty((0, 0, 0), dtype=np.float64))
+
+    @classmethod
+    def from_rows(cls, rows, metric_type_ids, start_year, end_year):
+        """Build a lookup from (org_unit_id, year, metric_type_id, value) rows of the given layers and years."""
+        rows = iter(rows)
+        chunks = []
+        while chunk := list(islice(rows, POPULATION_LOAD_CHUNK_SIZE)):
+            chunks.append(np.array(chunk, dtype=np.float64))
+        data = np.concatenate(chunks) if chunks else np.empty((0, 4), dtype=np.float64)
+
+        metric_type_ids = sorted(metric_type_ids)
+        year_count = end_year - start_year + 1
+        org_unit_ids, org_unit_positions = np.unique(data[:, 0].astype(np.int64), return_inverse=True)
+        values = np.full((len(metric_type_ids), len(org_unit_ids), year_count), np.nan, dtype=np.float64)
+        values[
+            np.searchsorted(np.array(metric_type_ids, dtype=np.int64), data[:, 2].astype(np.int64)),
+            org_unit_positions,
+            data[:, 1].astype(np.int64) - start_year,
+        ] = data[:, 3]
+        # Lookups are shared through the process cache.
+        values.setflags(write=False)
+        return cls(metric_type_ids, org_unit_ids, start_year, year_count, values)
+
+    def get(self, org_unit_id, year, metric_type_id, default=None):
+        """Return the value as a Decimal (the same Decimal(str(value)) the float column always gave), or default."""
+        metric_type_index = self._metric_type_index.get(metric_type_id)
+        org_unit_index = self._org_unit_index.get(org_unit_id)
+        year_index = year - self.start_year
+        if metric_type_index is None or org_unit_index is None or not 0 <= year_index < self.year_count:
+            return default
+        value = float(self.values[metric_type_index, org_unit_index, year_index])
+        return default if np.isnan(value) else Decimal(str(value))
+
+    def dense(self, metric_type_ids, org_unit_ids, start_year, end_year, fill_value=0.0):
+        """Return a (metric type, org unit, year) array for the given ids and years, fill_value where no value."""
+        result = np.full(
+            (len(metric_type_ids), len(org_unit_ids), end_year - start_year + 1), fill_value, dtype=np.float64
+        )
+        metric_type_positions = [self._metric_type_index.get(metric_type_id) for metric_type_id in metric_type_ids]
+        org_unit_positions = [self._org_unit_index.get(org_unit_id) for org_unit_id in org_unit_ids]
+        known_metric_types = [index for index, position in enumerate(metric_type_positions) if position is not None]
+        known_org_units = [index for index, position in enumerate(org_unit_positions) if position is not None]
+        first_year = max(start_year, self.start_year)
+        last_year = min(end_year, self.start_year + self.year_count - 1)
+        if not known_metric_types or not known_org_units or first_year > last_year:
+            return result
+
+        stored = self.values[
+            np.ix_(
+                [metric_type_positions[index] for index in known_metric_types],
+                [org_unit_positions[index] for index in known_org_units],
+                range(first_year - self.start_year, last_year - self.start_year + 1),
+            )
+        ]
+        result[
+            np.ix_(known_metric_types, known_org_units, range(first_year - start_year, last_year - start_year + 1))
+        ] = stored if np.isnan(fill_value) else np.where(np.isnan(stored), fill_value, stored)
+        return result
+
+    def fingerprint(self, metric_type_ids, org_unit_ids, start_year, end_year):
+        """Hash of the values of the given ids and years; missing values hash differently from zeros."""
+        digest = hashlib.sha256(repr((list(metric_type_ids), list(org_unit_ids), start_year, end_year)).encode())
+        digest.update(self.dense(metric_type_ids, org_unit_ids, start_year, end_year, fill_value=np.nan).tobytes())
+        return digest.hexdigest()
+
+
+def data_version(metric_values):
+    """Checksum of the rows, changing whenever one of them is created or deleted, or updated in value, org unit,
+    year or metric type: each weighted sum of the values moves when a value moves along that dimension."""
+
+    def weighted_total(field):
+        return Sum(ExpressionWrapper(F("value") * F(field), output_field=FloatField()))
+
+    return tuple(
+        metric_values.aggregate(
+            count=Count("id"),
+            max_id=Max("id"),
+            total=Sum("value"),
+            org_unit_total=weighted_total("org_unit_id"),
+            year_total=weighted_total("year"),
+            metric_type_total=weighted_total("metric_type_id"),
+        ).values()
+    )
+
+
+def load_population(metric_type_ids, start_year, end_year):
+    """Return the PopulationLookup of the given layers and years, from the process cache when up to date."""
+    metric_type_ids = tuple(sorted(set(metric_type_ids)))
+    if not metric_type_ids or start_year is None or end_year is None:
+        return PopulationLookup.empty()
+
+    metric_values = MetricValue.objects.filter(
+        metric_type_id__in=metric_type_ids, year__gte=start_year, year__lte=end_year, value__isnull=False
+    )
+    key = (metric_type_ids, start_year, end_year, data_version(metric_values))
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    lookup = PopulationLookup.from_rows(
+        metric_values.values_list("org_unit_id", "year", "metric_type_id", "value").iterator(
+            chunk_size=POPULATION_LOAD_CHUNK_SIZE
+        ),
+        metric_type_ids,
+        start_year,
+        end_year,
+    )
+    with _cache_lock:
+        _cache[key] = lookup
+        while len(_cache) > POPULATION_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return lookup
+
+
+def clear_population_cache():
+    with _cache_lock:
+        _cache.clear()
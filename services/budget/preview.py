@@ -0,0 +1,130 @@
+"""
+"What-if" budget previews: the budget of a scenario with unsaved edits applied, computed without
+storing anything.
+
+The scenario's inputs come from the process-wide cache of ``BudgetInputs.load_cached``, so
+successive previews of a scenario being edited skip the database reads of its assignments, cost
+lines, yearly values and population. The edits are applied to a copy of those inputs; the cached
+ones are shared and never mutated. Only interventions added by the preview that the scenario does
+not use yet cost extra queries (their cost lines and yearly values).
+"""
+
+import copy
+
+from collections import defaultdict
+from decimal import Decimal
+
+from plugins.snt_malaria.models import (
+    InterventionAssignment,
+    InterventionCostBreakdownLine,
+    ScenarioYearlyCostAssignment,
+)
+
+from .budget_calculation import BudgetCalculationService
+from .inputs import BudgetInputs
+from .population import load_population
+
+
+COST_LINE_OVERRIDE_FIELDS = ("unit_cost", "conversion_factor", "invert_conversion_factor")
+
+
+def apply_overrides(
+    scenario,
+    inputs,
+    cost_lines=(),
+    yearly_values=(),
+    add_assignments=(),
+    remove_assignments=(),
+    inflation_rate=None,
+    buffer=None,
+):
+    """Return new BudgetInputs with the overrides applied to inputs, which are left untouched.
+
+    cost_lines: [{"id", and any of "unit_cost", "conversion_factor", "invert_conversion_factor"}]
+    yearly_values: [{"cost_line_id", "year", "value"}]
+    add_assignments, remove_assignments: [{"intervention": Intervention, "org_unit_ids": [...]}]
+    """
+    removed_keys = {
+        (org_unit_id, change["intervention"].id)
+        for change in remove_assignments
+        for org_unit_id in change["org_unit_ids"]
+    }
+    assignment_by_key = {
+        (assignment.org_unit_id, assignment.intervention_id): assignment
+        for assignment in inputs.assignments
+        if (assignment.org_unit_id, assignment.intervention_id) not in removed_keys
+    }
+    for change in add_assignments:
+        intervention = change["intervention"]
+        for org_unit_id in change["org_unit_ids"]:
+            assignment_by_key.setdefault(
+                (org_unit_id, intervention.id),
+                InterventionAssignment(scenario=scenario, org_unit_id=org_unit_id, intervention=intervention),
+            )
+    assignments = [assignment_by_key[key] for key in sorted(assignment_by_key)]
+    intervention_ids = {intervention_id for _, intervention_id in assignment_by_key}
+
+    lines_by_intervention_id = defaultdict(list)
+    for line in inputs.cost_lines:
+        lines_by_intervention_id[line.intervention_id].append(line)
+    yearly_value_by_key = dict(inputs.yearly_value_by_key)
+    # The cost lines of the interventions already assigned are all in inputs, even when there are none.
+    new_intervention_ids = intervention_ids - {assignment.intervention_id for assignment in inputs.assignments}
+    if new_intervention_ids:
+        new_lines = list(
+            InterventionCostBreakdownLine.objects.filter(intervention_id__in=new_intervention_ids)
+            .select_related("population_layer", "unit_type", "intervention")
+            .order_by("intervention_id", "id")
+        )
+        for line in new_lines:
+            lines_by_intervention_id[line.intervention_id].append(line)
+        yearly_value_by_key.update(
+            ((cost_line_id, year), Decimal(str(value)))
+            for cost_line_id, year, value in ScenarioYearlyCostAssignment.objects.filter(
+                scenario=scenario,
+                cost_line__in=new_lines,
+                year__gte=scenario.start_year,
+                year__lte=scenario.end_year,
+            ).values_list("cost_line_id", "year", "value")
+        )
+
+    overrides_by_cost_line_id = {override["id"]: override for override in cost_lines}
+    lines = []
+    for intervention_id in sorted(intervention_ids):
+        for line in lines_by_intervention_id[intervention_id]:
+            override = overrides_by_cost_line_id.get(line.id)
+            if override:
+                line = copy.copy(line)
+                for field in COST_LINE_OVERRIDE_FIELDS:
+                    if field in override:
+                        setattr(line, field, override[field])
+            lines.append(line)
+
+    line_ids = {line.id for line in lines}
+    for yearly_value in yearly_values:
+        if (
+            yearly_value["cost_line_id"] in line_ids
+            and scenario.start_year <= yearly_value["year"] <= scenario.end_year
+        ):
+            yearly_value_by_key[(yearly_value["cost_line_id"], yearly_value["year"])] = yearly_value["value"]
+
+    population = inputs.population
+    metric_type_ids = {line.population_layer_id for line in lines if line.population_layer_id is not None}
+    if not metric_type_ids <= set(population.metric_type_ids.tolist()):
+        population = load_population(metric_type_ids, scenario.start_year, scenario.end_year)
+
+    return BudgetInputs(
+        assignments=assignments,
+        cost_lines=lines,
+        population=population,
+        yearly_value_by_key={key: value for key, value in yearly_value_by_key.items() if key[0] in line_ids},
+        inflation_rate=inputs.inflation_rate if inflation_rate is None else inflation_rate,
+        buffer=inputs.buffer if buffer is None else buffer,
+    )
+
+
+def preview_budget(scenario, **overrides):
+    """Return the budget years, as stored in Budget.results, of the scenario with the overrides applied."""
+    inputs = apply_overrides(scenario, BudgetInputs.load_cached(scenario), **overrides)
+    service = BudgetCalculationService(scenario, engine=BudgetCalculationService.ENGINE_VECTORIZED, inputs=inputs)
+    return service.calculate_all_years_json()
@@ -0,0 +1,164 @@
+"""
+Budget rollups at the account's focus org unit level (``AccountSettings.focus_org_unit_type``, e.g. regions).
+
+Costs attributed to an org unit (the proportional rows of ``org_units_costs``) are summed per ancestor
+of the focus type into ``BudgetYearResult.org_unit_rollups``, with the same shape as ``org_units_costs``.
+Org units without such an ancestor are left out of the rollups, as are fixed costs.
+
+The ancestor of each org unit is resolved by walking up ``OrgUnit.parent``, one query per level for the
+org units not seen before. Resolved ancestors are kept in a process-wide index per org unit type,
+rebuilt every ``ROLLUP_INDEX_TTL_SECONDS`` so hierarchy changes are eventually picked up.
+"""
+
+import threading
+import time
+
+from collections import defaultdict
+from decimal import Decimal
+from itertools import groupby
+
+from iaso.models import OrgUnit
+from plugins.snt_malaria.models import AccountSettings
+
+
+ROLLUP_INDEX_TTL_SECONDS = 600
+# Guards against cycles in a corrupted hierarchy.
+MAX_HIERARCHY_DEPTH = 20
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class OrgUnitRollupIndex:
+    """Maps org unit ids to the id of their ancestor (or themselves) of one org unit type."""
+
+    def __init__(self, org_unit_type_id):
+        self.org_unit_type_id = org_unit_type_id
+        self.created_at = time.monotonic()
+        self._ancestor_by_id = {}
+        self._lock = threading.Lock()
+
+    def ancestors(self, org_unit_ids):
+        """Return {org_unit_id: ancestor_id}, ancestor_id being None when there is no ancestor of the type."""
+        with self._lock:
+            missing_ids = {org_unit_id for org_unit_id in org_unit_ids if org_unit_id not in self._ancestor_by_id}
+            if missing_ids:
+                self._ancestor_by_id.update(self._resolve(missing_ids))
+            return {org_unit_id: self._ancestor_by_id[org_unit_id] for org_unit_id in org_unit_ids}
+
+    def _resolve(self, org_unit_ids):
+        resolved = {}
+        # {org_unit_id: id of the org unit reached so far while walking up}
+        pending = {org_unit_id: org_unit_id for org_unit_id in org_unit_ids}
+        for _ in range(MAX_HIERARCHY_DEPTH):
+            if not pending:
+                break
+            parent_and_type_by_id = {
+                org_unit_id: (parent_id, org_unit_type_id)
+                for org_unit_id, parent_id, org_unit_type_id in OrgUnit.objects.filter(
+                    id__in=set(pending.values())
+                ).values_list("id", "parent_id", "org_unit_type_id")
+            }
+            next_pending = {}
+            for org_unit_id, current_id in pending.items():
+                parent_id, org_unit_type_id = parent_and_type_by_id.get(current_id, (None, None))
+                if org_unit_type_id == self.org_unit_type_id:
+                    resolved[org_unit_id] = current_id
+                elif parent_id is None:
+                    resolved[org_unit_id] = None
+                else:
+                    next_pending[org_unit_id] = parent_id
+            pending = next_pending
+        resolved.update(dict.fromkeys(pending))
+        return resolved
+
+
+def get_rollup_index(org_unit_type_id):
+    with _indexes_lock:
+        index = _indexes.get(org_unit_type_id)
+        if index is None or time.monotonic() - index.created_at > ROLLUP_INDEX_TTL_SECONDS:
+            index = _indexes[org_unit_type_id] = OrgUnitRollupIndex(org_unit_type_id)
+        return index
+
+
+def clear_rollup_indexes():
+    with _indexes_lock:
+        _indexes.clear()
+
+
+def get_rollup_ancestors(account_id, org_unit_ids):
+    """Return {org_unit_id: focus ancestor id or None}, empty when the account has no focus org unit type."""
+    focus_org_unit_type_id = (
+        AccountSettings.objects.filter(account_id=account_id).values_list("focus_org_unit_type_id", flat=True).first()
+    )
+    if focus_org_unit_type_id is None or not org_unit_ids:
+        return {}
+    return get_rollup_index(focus_org_unit_type_id).ancestors(org_unit_ids)
+
+
+def build_org_unit_rollups(service, leaves, items):
+    """Build the org_unit_rollups of a year with the given ItemFactory.
+
+    leaves are (org_unit_id, intervention_id, cost_line_id, total_cost, quantity, population) Decimal tuples,
+    one per org unit x cost line of the year, as aggregated by the engine.
+    """
+    ancestors = service.get_rollup_ancestors()
+    if not ancestors:
+        return []
+
+    totals = defaultdict(lambda: [Decimal("0"), Decimal("0"), Decimal("0")])
+    for org_unit_id, intervention_id, cost_line_id, total_cost, quantity, population in leaves:
+        ancestor_id = ancestors.get(org_unit_id)
+        if ancestor_id is None:
+            continue
+        line_totals = totals[(ancestor_id, intervention_id, cost_line_id)]
+        line_totals[0] += total_cost
+        line_totals[1] += quantity
+        line_totals[2] += population
+
+    rollups = []
+    for ancestor_id, ancestor_keys in groupby(sorted(totals), key=lambda key: key[0]):
+        intervention_items = []
+        ancestor_total = Decimal("0")
+        for intervention_id, intervention_keys in groupby(ancestor_keys, key=lambda key: key[1]):
+            breakdown_items = []
+            intervention_total = Decimal("0")
+            for key in intervention_keys:
+                total_cost, quantity, population = totals[key]
+                if total_cost <= 0:
+                    continue
+                line = service.cost_line_by_id[key[2]]
+                intervention_total += total_cost
+                breakdown_items.append(
+                    items.breakdown(
+                        id=line.id,
+                        category=line.get_category_display(),
+                        total_cost=total_cost,
+                        quantity=quantity,
+                        population=population,
+                        unit_cost=line.unit_cost,
+                        cost_unit_name=line.unit_type.name if line.unit_type else None,
+                        conversion_factor=line.conversion_factor,
+                        invert_conversion_factor=line.invert_conversion_factor,
+                        target_population=line.population_layer.name if line.population_layer else None,
+                        buffer=float(service.buffer),
+                    )
+                )
+            if not breakdown_items:
+                continue
+            ancestor_total += intervention_total
+            intervention_meta = service.intervention_meta_by_id.get(intervention_id, {})
+            intervention_items.append(
+                items.org_unit_intervention(
+                    id=intervention_id,
+                    code=intervention_meta.get("code", ""),
+                    type=intervention_meta.get("type", ""),
+                    total_cost=intervention_total,
+                    cost_breakdown=breakdown_items,
+                )
+            )
+        if intervention_items:
+            rollups.append(
+                items.org_unit(org_unit_id=ancestor_id, total_cost=ancestor_total, interventions=intervention_items)
+            )
+    return rollups
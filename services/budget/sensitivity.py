@@ -0,0 +1,183 @@
+"""
+Monte Carlo sensitivity of a scenario budget to inflation, buffer, unit costs and conversion factors.
+
+The scenario is evaluated once by the vectorized engine, which gives per cost line and year the sum of
+population x yearly value over the rows that enter the budget (``VectorizedBudgetEngine.line_drivers``).
+Every other term of the formula is a per-line or global factor:
+
+    total_cost[line, year] = driver[line, year] * conversion_ratio[line] * buffer * unit_cost[line]
+                             * (1 + inflation_rate)^(year - start_year)
+
+so a draw only rescales that (line, year) matrix, and thousands of draws are a few matrix products.
+
+Distributions are dicts {"distribution": <kind>, <parameters>} (see DISTRIBUTION_PARAMETERS).
+inflation_rate and buffer are drawn as absolute values. unit_cost and conversion_factor are drawn as
+multipliers of each cost line's current value: {"default": <distribution>, "cost_lines": {id: <distribution>}},
+one independent draw per cost line. Parameters without a distribution keep their current value.
+
+Multipliers and buffers are clipped at 0 and inflation rates at -1, so a draw can cancel a row but never
+flip the sign of its cost: the rows entering the budget are the same for every draw.
+"""
+
+from collections import defaultdict
+
+import numpy as np
+
+from .dataclasses import (
+    BudgetSensitivityBand,
+    BudgetSensitivityIntervention,
+    BudgetSensitivityResult,
+    BudgetSensitivityYear,
+)
+
+
+DISTRIBUTION_FIXED = "fixed"
+DISTRIBUTION_UNIFORM = "uniform"
+DISTRIBUTION_NORMAL = "normal"
+DISTRIBUTION_TRIANGULAR = "triangular"
+
+DISTRIBUTION_PARAMETERS = {
+    DISTRIBUTION_FIXED: ("value",),
+    DISTRIBUTION_UNIFORM: ("low", "high"),
+    DISTRIBUTION_NORMAL: ("mean", "std"),
+    DISTRIBUTION_TRIANGULAR: ("low", "mode", "high"),
+}
+
+DEFAULT_DRAWS = 2000
+DEFAULT_PERCENTILES = (5, 50, 95)
+
+
+def sample_distribution(distribution, rng, size):
+    """Draw size values of a distribution dict."""
+    kind = distribution["distribution"]
+    if kind == DISTRIBUTION_FIXED:
+        return np.full(size, distribution["value"], dtype=np.float64)
+    if kind == DISTRIBUTION_UNIFORM:
+        return rng.uniform(distribution["low"], distribution["high"], size)
+    if kind == DISTRIBUTION_NORMAL:
+        return rng.normal(distribution["mean"], distribution["std"], size)
+    if kind == DISTRIBUTION_TRIANGULAR:
+        if distribution["low"] == distribution["high"]:
+            return np.full(size, distribution["low"], dtype=np.float64)
+        return rng.triangular(distribution["low"], distribution["mode"], distribution["high"], size)
+    raise ValueError(f"Unknown distribution: {kind}")
+
+
+class BudgetSensitivityAnalysis:
+    """Run Monte Carlo draws over the budget of the scenario of a BudgetCalculationService."""
+
+    def __init__(self, service):
+        self.service = service
+        engine = service._get_vectorized_engine()
+        self.years = engine.years
+        self.lines = engine.lines
+        # (line, year)
+        self.drivers = engine.line_drivers()
+        self.unit_costs = engine.line_unit_cost
+        self.ratios = engine.line_ratio
+        # A ratio only follows the conversion factor on proportional lines with a non-zero factor.
+        self.scales_with_factor = np.array(
+            [bool(line.is_proportional and line.conversion_factor) for line in self.lines], dtype=bool
+        )
+        self.inverts_factor = np.array([bool(line.invert_conversion_factor) for line in self.lines], dtype=bool)
+
+        self.line_indexes_by_intervention_id = defaultdict(list)
+        for index, line in enumerate(self.lines):
+            if self.drivers[index].any():
+                self.line_indexes_by_intervention_id[line.intervention_id].append(index)
+
+    def run(
+        self,
+        draws=DEFAULT_DRAWS,
+        seed=None,
+        percentiles=DEFAULT_PERCENTILES,
+        inflation_rate=None,
+        buffer=None,
+        unit_cost=None,
+        conversion_factor=None,
+    ):
+        rng = np.random.default_rng(seed)
+        year_offsets = np.arange(len(self.years), dtype=np.float64)
+
+        inflation_rates = self._draw_global(inflation_rate, float(self.service.inflation_rate), rng, draws)
+        inflation = (1 + np.maximum(inflation_rates, -1))[:, np.newaxis] ** year_offsets
+        buffers = np.maximum(self._draw_global(buffer, float(self.service.buffer), rng, draws), 0)
+        unit_costs = self.unit_costs * self._draw_line_multipliers(unit_cost, rng, draws)
+        factor_multipliers = self._draw_line_multipliers(conversion_factor, rng, draws)
+        with np.errstate(divide="ignore"):
+            scaled_ratios = np.where(
+                self.inverts_factor, self.ratios / factor_multipliers, self.ratios * factor_multipliers
+            )
+        # As in InterventionCostBreakdownLine.conversion_ratio, a zero conversion factor means a ratio of 1.
+        ratios = np.where(self.scales_with_factor, np.where(factor_multipliers > 0, scaled_ratios, 1.0), self.ratios)
+        # (draw, line): everything but the driver and the inflation.
+        line_factors = ratios * unit_costs * buffers[:, np.newaxis]
+
+        base_inflation = (1 + float(self.service.inflation_rate)) ** year_offsets
+        base_line_factors = self.ratios * self.unit_costs * float(self.service.buffer)
+
+        interventions = []
+        total_samples = np.zeros((draws, len(self.years)))
+        total_base = np.zeros(len(self.years))
+        for intervention_id in sorted(self.line_indexes_by_intervention_id):
+            line_indexes = self.line_indexes_by_intervention_id[intervention_id]
+            drivers = self.drivers[line_indexes]
+            samples = (line_factors[:, line_indexes] @ drivers) * inflation
+            base = (base_line_factors[line_indexes] @ drivers) * base_inflation
+            total_samples += samples
+            total_base += base
+            intervention_meta = self.service.intervention_meta_by_id.get(intervention_id, {})
+            interventions.append(
+                BudgetSensitivityIntervention(
+                    intervention_id=intervention_id,
+                    code=intervention_meta.get("code"),
+                    total_cost=self._band(base.sum(), samples.sum(axis=1), percentiles),
+                    years=self._year_bands(base, samples, percentiles),
+                )
+            )
+
+        return BudgetSensitivityResult(
+            scenario_id=self.service.scenario.id,
+            draws=draws,
+            total_cost=self._band(total_base.sum(), total_samples.sum(axis=1), percentiles),
+            years=self._year_bands(total_base, total_samples, percentiles),
+            interventions=interventions,
+        )
+
+    @staticmethod
+    def _draw_global(distribution, current_value, rng, draws):
+        if distribution is None:
+            return np.full(draws, current_value, dtype=np.float64)
+        return sample_distribution(distribution, rng, draws)
+
+    def _draw_line_multipliers(self, distributions, rng, draws):
+        """Return a (draw, line) array of multipliers, 1 for lines without a distribution."""
+        multipliers = np.ones((draws, len(self.lines)), dtype=np.float64)
+        if not distributions:
+            return multipliers
+        default = distributions.get("default")
+        by_cost_line_id = {
+            int(cost_line_id): value for cost_line_id, value in distributions.get("cost_lines", {}).items()
+        }
+        for index, line in enumerate(self.lines):
+            distribution = by_cost_line_id.get(line.id, default)
+            if distribution is not None:
+                multipliers[:, index] = sample_distribution(distribution, rng, draws)
+        return np.maximum(multipliers, 0)
+
+    def _year_bands(self, base, samples, percentiles):
+        return [
+            BudgetSensitivityYear(
+                year=year, total_cost=self._band(base[year_index], samples[:, year_index], percentiles)
+            )
+            for year_index, year in enumerate(self.years)
+        ]
+
+    @staticmethod
+    def _band(base, samples, percentiles):
+        values = np.percentile(samples, percentiles) if len(samples) else np.zeros(len(percentiles))
+        return BudgetSensitivityBand(
+            base=float(base),
+            mean=float(samples.mean()) if len(samples) else 0.0,
+            percentiles={f"{percentile:g}": float(value) for percentile, value in zip(percentiles, values)},
+        )
@@ -0,0 +1,108 @@
+"""
+Lean construction of budget results.
+
+The budget builders of both engines create their items through an ``ItemFactory``. ``MODEL_ITEMS``
+builds the pydantic models of ``dataclasses``; ``JSON_ITEMS`` builds plain dicts equal to what
+``model_dump(mode="json")`` returns for those models (same keys, same key order, Decimals as floats),
+without instantiating, validating and dumping a model per item. The dicts are what a stored
+``Budget.results`` holds, so the save path uses them directly.
+
+Builders must keep their running totals as Decimals and only hand the final values to the factory,
+since the dict items hold floats.
+"""
+
+from decimal import Decimal
+from typing import Any, Callable, NamedTuple
+
+from .dataclasses import (
+    BudgetBreakdownItem,
+    BudgetInterventionItem,
+    BudgetOrgUnitInterventionItem,
+    BudgetOrgUnitItem,
+    BudgetYearResult,
+)
+
+
+def _optional_float(value):
+    return float(value) if value is not None else None
+
+
+def breakdown_item_dict(
+    *,
+    id=None,
+    category,
+    total_cost=Decimal("0.0"),
+    quantity=Decimal("0.0"),
+    population=Decimal("0.0"),
+    unit_cost=None,
+    cost_unit_name=None,
+    conversion_factor=None,
+    invert_conversion_factor=False,
+    target_population=None,
+    buffer=None,
+) -> dict:
+    return {
+        "id": id,
+        "category": category,
+        "total_cost": float(total_cost),
+        "quantity": float(quantity),
+        "population": float(population),
+        "unit_cost": _optional_float(unit_cost),
+        "cost_unit_name": cost_unit_name,
+        "conversion_factor": _optional_float(conversion_factor),
+        "invert_conversion_factor": invert_conversion_factor,
+        "target_population": target_population,
+        "buffer": _optional_float(buffer),
+    }
+
+
+def intervention_item_dict(*, id, code, type, total_cost=Decimal("0.0"), cost_breakdown=()) -> dict:
+    return {
+        "id": id,
+        "code": code,
+        "type": type,
+        "total_cost": float(total_cost),
+        "cost_breakdown": list(cost_breakdown),
+    }
+
+
+def org_unit_item_dict(*, org_unit_id, total_cost=Decimal("0.0"), interventions=()) -> dict:
+    return {"org_unit_id": org_unit_id, "total_cost": float(total_cost), "interventions": list(interventions)}
+
+
+def year_result_dict(*, year, total_cost, interventions, org_units_costs, category_costs, org_unit_rollups=()) -> dict:
+    return {
+        "year": year,
+        "total_cost": float(total_cost),
+        "interventions": interventions,
+        "org_units_costs": org_units_costs,
+        "category_costs": category_costs,
+        "org_unit_rollups": list(org_unit_rollups),
+    }
+
+
+class ItemFactory(NamedTuple):
+    """Constructors of the items of a BudgetYearResult, called with the model field names as keywords."""
+
+    breakdown: Callable[..., Any]
+    intervention: Callable[..., Any]
+    org_unit_intervention: Callable[..., Any]
+    org_unit: Callable[..., Any]
+    year: Callable[..., Any]
+
+
+MODEL_ITEMS = ItemFactory(
+    breakdown=BudgetBreakdownItem,
+    intervention=BudgetInterventionItem,
+    org_unit_intervention=BudgetOrgUnitInterventionItem,
+    org_unit=BudgetOrgUnitItem,
+    year=BudgetYearResult,
+)
+
+JSON_ITEMS = ItemFactory(
+    breakdown=breakdown_item_dict,
+    intervention=intervention_item_dict,
+    org_unit_intervention=intervention_item_dict,
+    org_unit=org_unit_item_dict,
+    year=year_result_dict,
+)
@@ -0,0 +1,372 @@
+"""
+NumPy implementation of the scenario budget formula.
+
+The Decimal engine in ``budget_calculation`` walks every assignment x cost line x year and builds one
+``BudgetLineRow`` per combination. This engine lays the same rows out once as dense "slots" (one
+slot per assignment x proportional cost line, plus one slot per fixed cost line) and evaluates the
+formula for every slot and every year with array operations:
+
+    quantity[slot, year] = population[slot, year] * yearly_value[line, year] * conversion_ratio[line] * buffer
+    total_cost[slot, year] = quantity[slot, year] * unit_cost[line] * inflation_multiplier[year]
+
+Aggregations are done with ``np.bincount`` and only the items that end up in ``BudgetYearResult``
+are turned into pydantic objects (or into their JSON dicts, see ``serialization.py``).
+
+Rounding: the arrays are float64, so leaf values (one per cost line, and one per org unit x cost
+line) are quantized to ``DECIMAL_PLACES`` decimals before being converted to ``Decimal``. Every
+total above a leaf (intervention, org unit, year, category) is then the ``Decimal`` sum of its
+quantized leaves, exactly like the Decimal engine sums its rows. Each value therefore matches the
+Decimal engine within ``ABSOLUTE_TOLERANCE`` per leaf it aggregates, or ``RELATIVE_TOLERANCE`` for
+amounts too large for float64 to hold ``DECIMAL_PLACES`` decimals.
+"""
+
+from decimal import Decimal
+
+import numpy as np
+
+from .dataclasses import BudgetLineRow
+from .rollups import build_org_unit_rollups
+from .serialization import MODEL_ITEMS
+
+
+DECIMAL_PLACES = 6
+ABSOLUTE_TOLERANCE = 1e-6
+RELATIVE_TOLERANCE = 1e-12
+
+# Marker used in integer arrays for "no org unit" (fixed cost slots) and "no grant".
+NO_ID = -1
+
+
+def to_decimal(value: float) -> Decimal:
+    """Quantize a float aggregate to DECIMAL_PLACES and return it as a Decimal."""
+    return Decimal(f"{value:.{DECIMAL_PLACES}f}")
+
+
+class VectorizedBudgetEngine:
+    """Compute the budget of every scenario year at once from the inputs loaded by a BudgetCalculationService."""
+
+    def __init__(self, service):
+        self.service = service
+        self.start_year = service.start_year
+        self.years = list(range(service.start_year, service.end_year + 1))
+        self.buffer = float(service.buffer)
+
+        self._build_lines()
+        self._build_slots()
+        self._compute()
+
+    def _build_lines(self):
+        self.lines = [line for lines in self.service.cost_lines_by_intervention_id.values() for line in lines]
+        self.line_index_by_id = {line.id: index for index, line in enumerate(self.lines)}
+        self.categories = sorted({line.get_category_display() for line in self.lines})
+        category_index = {category: index for index, category in enumerate(self.categories)}
+
+        self.line_category = np.array(
+            [category_index[line.get_category_display()] for line in self.lines], dtype=np.int64
+        )
+        self.line_unit_cost = np.array([float(line.unit_cost) for line in self.lines], dtype=np.float64)
+        self.line_ratio = np.array([float(line.conversion_ratio) for line in self.lines], dtype=np.float64)
+
+        year_count = len(self.years)
+        self.yearly_values = np.zeros((len(self.lines), year_count), dtype=np.float64)
+        for index, line in enumerate(self.lines):
+            self.yearly_values[index, :] = 1.0 if line.is_proportional else 0.0
+        for (cost_line_id, year), value in self.service.yearly_value_by_key.items():
+            line_index = self.line_index_by_id.get(cost_line_id)
+            if line_index is not None and self.start_year <= year <= self.years[-1]:
+                self.yearly_values[line_index, year - self.start_year] = float(value)
+
+        offsets = range(year_count)
+        self.inflation = np.array(
+            [float((Decimal("1") + self.service.inflation_rate) ** offset) for offset in offsets], dtype=np.float64
+        )
+
+    def _build_slots(self):
+        """Lay out one slot per row the Decimal engine could produce, in the same order."""
+        slot_line, slot_assignment, slot_org_unit, slot_grant, slot_is_proportional = [], [], [], [], []
+        seen_fixed_cost_line_ids = set()
+
+        for assignment_index, assignment in enumerate(self.service.assignments):
+            intervention = assignment.intervention
+            grant_id = assignment.grant_id or intervention.grant_id
+            for line in self.service.cost_lines_by_intervention_id.get(intervention.id, []):
+                if line.is_proportional:
+                    if line.population_layer_id is None:
+                        continue
+                    org_unit_id = assignment.org_unit_id
+                elif line.id not in seen_fixed_cost_line_ids:
+                    seen_fixed_cost_line_ids.add(line.id)
+                    org_unit_id = NO_ID
+                else:
+                    continue
+                slot_line.append(self.line_index_by_id[line.id])
+                slot_assignment.append(assignment_index)
+                slot_org_unit.append(org_unit_id)
+                slot_grant.append(grant_id if grant_id is not None else NO_ID)
+                slot_is_proportional.append(line.is_proportional)
+
+        self.slot_line = np.array(slot_line, dtype=np.int64)
+        self.slot_assignment = np.array(slot_assignment, dtype=np.int64)
+        self.slot_org_unit = np.array(slot_org_unit, dtype=np.int64)
+        self.slot_grant = np.array(slot_grant, dtype=np.int64)
+        self.slot_is_proportional = np.array(slot_is_proportional, dtype=bool)
+
+    def _population_matrix(self):
+        """Return a (slot, year) population array; fixed cost slots get 1 so they pass through the formula."""
+        population = np.ones((len(self.slot_line), len(self.years)), dtype=np.float64)
+        proportional_slots = np.flatnonzero(self.slot_is_proportional)
+        if not len(proportional_slots):
+            return population
+
+        org_unit_ids = sorted({int(ou_id) for ou_id in self.slot_org_unit[proportional_slots]})
+        org_unit_index = {org_unit_id: index for index, org_unit_id in enumerate(org_unit_ids)}
+        layer_ids = sorted({line.population_layer_id for line in self.lines if line.population_layer_id is not None})
+        layer_index = {layer_id: index for index, layer_id in enumerate(layer_ids)}
+
+        dense = self.service.population.dense(layer_ids, org_unit_ids, self.start_year, self.years[-1])
+
+        line_layer = np.array([layer_index.get(line.population_layer_id, NO_ID) for line in self.lines], dtype=np.int64)
+        slot_layers = line_layer[self.slot_line[proportional_slots]]
+        slot_org_units = np.array(
+            [org_unit_index[int(ou_id)] for ou_id in self.slot_org_unit[proportional_slots]], dtype=np.int64
+        )
+        population[proportional_slots, :] = dense[slot_layers, slot_org_units, :]
+        return population
+
+    def _compute(self):
+        population = self._population_matrix()
+        quantity = (
+            population
+            * self.yearly_values[self.slot_line]
+            * self.line_ratio[self.slot_line][:, np.newaxis]
+            * self.buffer
+        )
+        cost = quantity * self.line_unit_cost[self.slot_line][:, np.newaxis] * self.inflation[np.newaxis, :]
+
+        # Same skip rules as the Decimal engine: no population (proportional lines) or no cost.
+        valid = cost > 0
+        valid &= ~self.slot_is_proportional[:, np.newaxis] | (population > 0)
+
+        self.valid = valid
+        self.quantity = np.where(valid, quantity, 0.0)
+        self.total_cost = np.where(valid, cost, 0.0)
+        self.population = np.where(valid & self.slot_is_proportional[:, np.newaxis], population, 0.0)
+
+    def calculate_year(self, year, items=MODEL_ITEMS):
+        """Build the BudgetYearResult of ``year``, identical in shape to the Decimal engine's.
+
+        items is the ItemFactory the result is built with (see ``serialization.py``).
+        """
+        year_index = year - self.start_year
+        if year_index < 0 or year_index >= len(self.years) or not len(self.slot_line):
+            return items.year(
+                year=year, total_cost=Decimal("0"), interventions=[], org_units_costs=[], category_costs=[]
+            )
+
+        line_count = len(self.lines)
+        cost = self.total_cost[:, year_index]
+        line_cost = np.bincount(self.slot_line, weights=cost, minlength=line_count)
+        line_quantity = np.bincount(self.slot_line, weights=self.quantity[:, year_index], minlength=line_count)
+        line_population = np.bincount(self.slot_line, weights=self.population[:, year_index], minlength=line_count)
+
+        interventions, total_cost = self._build_interventions(line_cost, line_quantity, line_population, items)
+        org_units_costs, org_unit_leaves = self._build_org_units_costs(year_index, items)
+        category_costs = self._build_category_costs(year_index, line_cost, line_quantity, items)
+
+        return items.year(
+            year=year,
+            total_cost=total_cost,
+            interventions=interventions,
+            org_units_costs=org_units_costs,
+            category_costs=category_costs,
+            org_unit_rollups=build_org_unit_rollups(self.service, org_unit_leaves, items),
+        )
+
+    def line_drivers(self):
+        """Return the (line, year) sums of population x yearly value over the rows that enter the budget.
+
+        That is the quantity before the conversion ratio and the buffer: times both, the unit cost and the
+        inflation multiplier, it gives the cost of the line (see ``sensitivity.py``).
+        """
+        driver = np.where(self.slot_is_proportional[:, np.newaxis], self.population, 1.0)
+        driver = np.where(self.valid, driver * self.yearly_values[self.slot_line], 0.0)
+        return np.stack(
+            [
+                np.bincount(self.slot_line, weights=driver[:, year_index], minlength=len(self.lines))
+                for year_index in range(len(self.years))
+            ],
+            axis=1,
+        )
+
+    def iter_line_rows(self, year=None):
+        """Yield the rows of one year (or of every year) as BudgetLineRow, in the Decimal engine order."""
+        year_indexes = range(len(self.years)) if year is None else [year - self.start_year]
+        for year_index in year_indexes:
+            if year_index < 0 or year_index >= len(self.years):
+                continue
+            for slot in np.flatnonzero(self.valid[:, year_index]).tolist():
+                line = self.lines[self.slot_line[slot]]
+                org_unit_id = int(self.slot_org_unit[slot])
+                grant_id = int(self.slot_grant[slot])
+                yield BudgetLineRow(
+                    year=self.years[year_index],
+                    cost_line_id=line.id,
+                    org_unit_id=org_unit_id if org_unit_id != NO_ID else None,
+                    intervention_id=line.intervention_id,
+                    category=line.get_category_display(),
+                    population=to_decimal(self.population[slot, year_index]),
+                    quantity=to_decimal(self.quantity[slot, year_index]),
+                    total_cost=to_decimal(self.total_cost[slot, year_index]),
+                    grant_id=grant_id if grant_id != NO_ID else None,
+                )
+
+    def grant_year_costs(self):
+        """Return the total cost per (grant_id, year), quantized per grant and year."""
+        grant_ids = sorted(set(self.slot_grant.tolist()))
+        grant_positions = np.searchsorted(np.array(grant_ids, dtype=np.int64), self.slot_grant)
+        costs = {}
+        for year_index, year in enumerate(self.years):
+            grant_costs = np.bincount(grant_positions, weights=self.total_cost[:, year_index], minlength=len(grant_ids))
+            for grant_id, cost in zip(grant_ids, grant_costs.tolist()):
+                if cost > 0:
+                    costs[(grant_id if grant_id != NO_ID else None, year)] = to_decimal(cost)
+        return costs
+
+    def _breakdown_item(self, items, line, total_cost, quantity, population):
+        return items.breakdown(
+            id=line.id,
+            category=line.get_category_display(),
+            total_cost=total_cost,
+            quantity=quantity,
+            population=population,
+            unit_cost=line.unit_cost,
+            cost_unit_name=line.unit_type.name if line.unit_type else None,
+            conversion_factor=line.conversion_factor,
+            invert_conversion_factor=line.invert_conversion_factor,
+            target_population=line.population_layer.name if line.population_layer else None,
+            buffer=self.buffer,
+        )
+
+    def _build_interventions(self, line_cost, line_quantity, line_population, items):
+        """Return the intervention items and the Decimal total of their costs."""
+        line_cost = line_cost.tolist()
+        line_quantity = line_quantity.tolist()
+        line_population = line_population.tolist()
+
+        interventions = []
+        year_total = Decimal("0")
+        for intervention_id in sorted(self.service.cost_lines_by_intervention_id):
+            breakdown_items = []
+            intervention_total = Decimal("0")
+            for line in self.service.cost_lines_by_intervention_id[intervention_id]:
+                line_index = self.line_index_by_id[line.id]
+                if line_cost[line_index] <= 0:
+                    continue
+                total_cost = to_decimal(line_cost[line_index])
+                intervention_total += total_cost
+                breakdown_items.append(
+                    self._breakdown_item(
+                        items,
+                        line,
+                        total_cost,
+                        to_decimal(line_quantity[line_index]),
+                        to_decimal(line_population[line_index]),
+                    )
+                )
+            if not breakdown_items:
+                continue
+            year_total += intervention_total
+            intervention_meta = self.service.intervention_meta_by_id.get(intervention_id, {})
+            interventions.append(
+                items.intervention(
+                    id=intervention_id,
+                    code=intervention_meta.get("code", ""),
+                    type=intervention_meta.get("type", ""),
+                    total_cost=intervention_total,
+                    cost_breakdown=breakdown_items,
+                )
+            )
+        return interventions, year_total
+
+    def _build_org_units_costs(self, year_index, items):
+        """Each proportional slot is a unique (org unit, intervention, cost line), so slots are the leaves here.
+
+        Returns the org unit items and the leaves, as (org_unit_id, intervention_id, cost_line_id, total_cost,
+        quantity, population) tuples for build_org_unit_rollups.
+        """
+        slots = np.flatnonzero(self.valid[:, year_index] & self.slot_is_proportional).tolist()
+        cost = self.total_cost[:, year_index]
+        quantity = self.quantity[:, year_index]
+        population = self.population[:, year_index]
+
+        # Slots follow the assignment order, which is (org_unit_id, intervention_id), then cost line id.
+        leaves_by_assignment = {}
+        for slot in slots:
+            leaves_by_assignment.setdefault(int(self.slot_assignment[slot]), []).append(
+                (
+                    self.lines[self.slot_line[slot]],
+                    to_decimal(cost[slot]),
+                    to_decimal(quantity[slot]),
+                    to_decimal(population[slot]),
+                )
+            )
+
+        # [org_unit_id, Decimal total, intervention items] per org unit, in assignment order.
+        org_units = []
+        org_unit_leaves = []
+        for assignment_index, leaves in leaves_by_assignment.items():
+            assignment = self.service.assignments[assignment_index]
+            intervention_meta = self.service.intervention_meta_by_id.get(assignment.intervention_id, {})
+            intervention_total = sum((leaf_cost for _, leaf_cost, _, _ in leaves), Decimal("0"))
+            intervention_item = items.org_unit_intervention(
+                id=assignment.intervention_id,
+                code=intervention_meta.get("code", ""),
+                type=intervention_meta.get("type", ""),
+                total_cost=intervention_total,
+                cost_breakdown=[self._breakdown_item(items, *leaf) for leaf in leaves],
+            )
+            org_unit_leaves.extend(
+                (assignment.org_unit_id, assignment.intervention_id, line.id, *amounts) for line, *amounts in leaves
+            )
+            if org_units and org_units[-1][0] == assignment.org_unit_id:
+                org_units[-1][1] += intervention_total
+                org_units[-1][2].append(intervention_item)
+            else:
+                org_units.append([assignment.org_unit_id, intervention_total, [intervention_item]])
+
+        org_units_costs = [
+            items.org_unit(org_unit_id=org_unit_id, total_cost=total_cost, interventions=intervention_items)
+            for org_unit_id, total_cost, intervention_items in org_units
+        ]
+        return org_units_costs, org_unit_leaves
+
+    def _build_category_costs(self, year_index, line_cost, line_quantity, items):
+        category_count = len(self.categories)
+        category_cost = [Decimal("0")] * category_count
+        category_quantity = [Decimal("0")] * category_count
+        for line_index, (cost, quantity) in enumerate(zip(line_cost.tolist(), line_quantity.tolist())):
+            if cost <= 0:
+                continue
+            category = self.line_category[line_index]
+            category_cost[category] += to_decimal(cost)
+            category_quantity[category] += to_decimal(quantity)
+
+        # The Decimal engine reports the cost line of the last row seen for each category.
+        last_line_id_by_category = {}
+        for slot in reversed(np.flatnonzero(self.valid[:, year_index]).tolist()):
+            category = int(self.line_category[self.slot_line[slot]])
+            if category not in last_line_id_by_category:
+                last_line_id_by_category[category] = self.lines[self.slot_line[slot]].id
+                if len(last_line_id_by_category) == category_count:
+                    break
+
+        return [
+            items.breakdown(
+                id=last_line_id_by_category.get(index),
+                category=category,
+                total_cost=category_cost[index],
+                quantity=category_quantity[index],
+            )
+            for index, category in enumerate(self.categories)
+            if category_cost[index] > 0
+        ]
@@ -16,6 +16,7 @@ from django.db import transaction
 from django.utils.text import slugify
 
 from iaso.models.metric import MetricType, MetricValue
+from plugins.snt_malaria.services.rules.cache import invalidate_matches_cache
 
 from .evaluator import CompositeGraphEvaluator, ValuesByYear
 from .legends import resolve_output_legend
@@ -41,6 +42,7 @@ def _write_metric_values(metric_type: MetricType, values_by_year: ValuesByYear)
                     MetricValue(metric_type=metric_type, org_unit_id=org_unit_id, year=year, value=float(value))
                 )
     MetricValue.objects.bulk_create(rows, batch_size=BULK_CREATE_BATCH_SIZE)
+    invalidate_matches_cache(metric_type.account_id)
 
 
 def preview_composite_layer(account, graph: dict, org_unit_ids: Iterable[int]) -> dict:
@@ -128,6 +130,7 @@ def update_composite_metric_type(
     metric_type.save(update_fields=["name", "legend_type", "legend_config", "updated_at"])
 
     MetricValue.objects.filter(metric_type=metric_type).delete()
+    invalidate_matches_cache(metric_type.account_id)
     _write_metric_values(metric_type, values_by_year)
 
     return name, metric_type
@@ -0,0 +1,109 @@
+"""
+Batch evaluation of the matching_criteria of several rules of an account, for one reference year.
+
+``resolve_rules_matched_org_units`` returns the org_units_matched of every rule at once. It resolves
+the year of all their metric types with one query, loads the values of those metric types at those
+years with another, and the account's intervention org units with a third; then evaluates each
+rule's criteria in memory. The number of queries does not depend on the number of rules.
+
+A condition ``{op: [{"var": metric_type_id}, value]}`` holds for an org unit when one of its values
+of that metric type satisfies ``value op threshold``, as the EXISTS clause of the compiled matcher.
+Only numeric thresholds are evaluated in memory; a rule with any other condition (string or boolean
+threshold, unknown operator) is resolved by its ``CompiledMatcher`` instead.
+"""
+
+import operator
+
+from collections import defaultdict
+
+from plugins.snt_malaria.models.account_settings import get_intervention_org_units
+
+from .matcher import (
+    CompiledMatcher,
+    account_metric_values,
+    criteria_metric_type_ids,
+    metric_type_years_q,
+    resolve_metric_type_years,
+)
+
+
+OPERATORS = {
+    "==": operator.eq,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def _parse_conditions(matching_criteria):
+    """[(metric_type_id, compare, threshold)] of a {"and": [...]} criteria, or None when a condition
+    cannot be evaluated in memory."""
+    conditions = []
+    for condition in matching_criteria.get("and", []):
+        if len(condition) != 1:
+            return None
+        op, operands = next(iter(condition.items()))
+        if op not in OPERATORS or len(operands) != 2:
+            return None
+        variable, threshold = operands
+        if not isinstance(variable, dict) or "var" not in variable:
+            return None
+        if isinstance(threshold, bool) or not isinstance(threshold, (int, float)):
+            return None
+        conditions.append((variable["var"], OPERATORS[op], threshold))
+    return conditions or None
+
+
+def resolve_rules_matched_org_units(account, rules, reference_year=None):
+    """Return {rule.id: [matched org unit id, ...]} for rules, as ScenarioRule.resolve_matched_org_units
+    would return for each of them."""
+    conditions_by_rule_id = {}
+    fallback_rules = []
+    metric_type_ids = []
+    for rule in rules:
+        criteria = rule.matching_criteria
+        if criteria is None or criteria.get("all"):
+            continue
+        conditions = _parse_conditions(criteria)
+        if conditions is None:
+            fallback_rules.append(rule)
+            continue
+        conditions_by_rule_id[rule.id] = conditions
+        for metric_type_id in criteria_metric_type_ids(criteria):
+            if metric_type_id not in metric_type_ids:
+                metric_type_ids.append(metric_type_id)
+
+    values_by_metric_type_id = defaultdict(list)
+    if metric_type_ids:
+        metric_values = account_metric_values(account).filter(metric_type_id__in=metric_type_ids, value__isnull=False)
+        year_by_metric_type_id = resolve_metric_type_years(account, metric_type_ids, reference_year)
+        if year_by_metric_type_id:
+            metric_values = metric_values.filter(metric_type_years_q(year_by_metric_type_id))
+        for metric_type_id, org_unit_id, value in metric_values.values_list("metric_type_id", "org_unit_id", "value"):
+            values_by_metric_type_id[metric_type_id].append((org_unit_id, value))
+
+    org_unit_ids = None
+    if conditions_by_rule_id or any(rule.matching_criteria and rule.matching_criteria.get("all") for rule in rules):
+        org_unit_ids = set(get_intervention_org_units(account).values_list("id", flat=True))
+
+    fallback_ids = {rule.id for rule in fallback_rules}
+    matched_by_rule_id = {}
+    for rule in rules:
+        criteria = rule.matching_criteria
+        if criteria is None:
+            matched_by_rule_id[rule.id] = []
+        elif criteria.get("all"):
+            matched_by_rule_id[rule.id] = sorted(org_unit_ids)
+        elif rule.id in fallback_ids:
+            matched_by_rule_id[rule.id] = sorted(CompiledMatcher(account, criteria, reference_year).org_unit_ids())
+        else:
+            matched = set(org_unit_ids)
+            for metric_type_id, compare, threshold in conditions_by_rule_id[rule.id]:
+                matched &= {
+                    org_unit_id
+                    for org_unit_id, value in values_by_metric_type_id[metric_type_id]
+                    if compare(value, threshold)
+                }
+            matched_by_rule_id[rule.id] = sorted(matched)
+    return matched_by_rule_id
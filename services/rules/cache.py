@@ -0,0 +1,110 @@
+"""
+Process-wide cache of the org units matched by a rule's matching_criteria.
+
+The rule builder previews a rule's matches on every edit, then creates or updates the rule with the
+same criteria; ``cached_matched_org_units`` lets these share one evaluation. Entries are keyed by
+(account, intervention org unit type, normalized criteria, reference year, metric data version):
+
+- the intervention org unit type of the account settings restricts the matched org units;
+- the criteria is normalized to JSON with sorted keys and sorted "and" conditions, so equivalent
+  criteria share an entry;
+- the metric data version of the criteria's metric types (count and max id of their values, one
+  aggregate query) moves when values are added, deleted or replaced, in this process or another;
+- ``invalidate_matches_cache`` drops an account's entries, for changes the version cannot see
+  (values updated in place), and is called wherever the plugin writes metric values.
+
+Entries also expire after MATCHES_CACHE_TTL_SECONDS, which bounds how long an in-place update made
+by another process can go unnoticed.
+"""
+
+import json
+import threading
+import time
+
+from collections import OrderedDict, defaultdict
+
+from django.db.models import Count, Max
+
+from plugins.snt_malaria.models.account_settings import get_intervention_org_unit_type_id
+
+from .matcher import CompiledMatcher, account_metric_values, criteria_metric_type_ids
+
+
+MATCHES_CACHE_SIZE = 256
+MATCHES_CACHE_TTL_SECONDS = 300
+
+# {(account_id, generation, org_unit_type_id, criteria, reference_year, data_version): (loaded_at, org unit ids)},
+# least recently used first.
+_cache = OrderedDict()
+# {account_id: generation}, bumped by invalidate_matches_cache so stale in-flight entries never match.
+_generations = defaultdict(int)
+_cache_lock = threading.Lock()
+
+
+def normalize_criteria(matching_criteria):
+    """Canonical JSON text of a matching_criteria; the order of its keys and "and" conditions is irrelevant."""
+    if matching_criteria.get("and") is not None:
+        conditions = sorted(json.dumps(condition, sort_keys=True) for condition in matching_criteria["and"])
+        matching_criteria = {**matching_criteria, "and": [json.loads(condition) for condition in conditions]}
+    return json.dumps(matching_criteria, sort_keys=True, separators=(",", ":"))
+
+
+def metric_data_version(account, metric_type_ids):
+    """(count, max id) of the account's values of the metric types: changes when values are added or removed."""
+    if not metric_type_ids:
+        return None
+    version = (
+        account_metric_values(account)
+        .filter(metric_type_id__in=metric_type_ids)
+        .aggregate(count=Count("id"), max_id=Max("id"))
+    )
+    return version["count"], version["max_id"]
+
+
+def cached_matched_org_units(account, matching_criteria, reference_year=None):
+    """ScenarioRule.resolve_matched_org_units, served from the cache when the criteria was already evaluated
+    for the account and reference year and the metric values it reads have not changed since."""
+    if matching_criteria is None:
+        return []
+
+    metric_type_ids = [] if matching_criteria.get("all") else criteria_metric_type_ids(matching_criteria)
+    with _cache_lock:
+        generation = _generations[account.id]
+    key = (
+        account.id,
+        generation,
+        get_intervention_org_unit_type_id(account),
+        normalize_criteria(matching_criteria),
+        reference_year,
+        metric_data_version(account, metric_type_ids),
+    )
+
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry:
+            loaded_at, org_unit_ids = entry
+            if time.monotonic() - loaded_at < MATCHES_CACHE_TTL_SECONDS:
+                _cache.move_to_end(key)
+                return list(org_unit_ids)
+
+    org_unit_ids = tuple(CompiledMatcher(account, matching_criteria, reference_year).org_unit_ids())
+    with _cache_lock:
+        _cache[key] = (time.monotonic(), org_unit_ids)
+        _cache.move_to_end(key)
+        while len(_cache) > MATCHES_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return list(org_unit_ids)
+
+
+def invalidate_matches_cache(account_id):
+    """Drop the cached matches of an account, after its metric values changed."""
+    with _cache_lock:
+        _generations[account_id] += 1
+        for key in [key for key in _cache if key[0] == account_id]:
+            del _cache[key]
+
+
+def clear_matches_cache():
+    with _cache_lock:
+        _cache.clear()
+        _generations.clear()
@@ -0,0 +1,98 @@
+"""
+Compiled evaluation of a rule's matching_criteria against the metric values of an account.
+
+With a reference year, each metric type of the criteria is read at that year when the account has
+values for it, and otherwise from its timeless values (year NULL). ``CompiledMatcher`` settles that
+for every metric type of the criteria with one aggregate query, then evaluates the whole criteria
+in a single SQL statement, whose text is exposed for inspection (``sql``).
+"""
+
+from functools import cached_property
+
+from django.db.models import Q
+
+from iaso.models import MetricValue
+from iaso.utils.jsonlogic import jsonlogic_to_exists_q_clauses
+from plugins.snt_malaria.models.account_settings import get_intervention_org_units
+
+
+def criteria_metric_type_ids(matching_criteria):
+    """Metric type ids referenced by the conditions of a {"and": [...]} criteria, in order of appearance."""
+    metric_type_ids = []
+    for condition in matching_criteria.get("and", []):
+        operator = next(iter(condition))
+        metric_type_id = condition[operator][0]["var"]
+        if metric_type_id not in metric_type_ids:
+            metric_type_ids.append(metric_type_id)
+    return metric_type_ids
+
+
+def account_metric_values(account):
+    return MetricValue.objects.filter(metric_type__account=account, org_unit_id__isnull=False)
+
+
+def resolve_metric_type_years(account, metric_type_ids, reference_year):
+    """Return {metric_type_id: year its values are read at}: reference_year when the account has values
+    of that metric type for it, else None (timeless values). One query for all metric types."""
+    if reference_year is None or not metric_type_ids:
+        return {}
+    with_reference_year = set(
+        account_metric_values(account)
+        .filter(metric_type_id__in=metric_type_ids, year=reference_year)
+        .values_list("metric_type_id", flat=True)
+        .distinct()
+    )
+    return {
+        metric_type_id: reference_year if metric_type_id in with_reference_year else None
+        for metric_type_id in metric_type_ids
+    }
+
+
+def metric_type_years_q(year_by_metric_type_id):
+    """Q keeping, per metric type, only the values of its resolved year."""
+    year_q = Q()
+    for metric_type_id, year in year_by_metric_type_id.items():
+        if year is None:
+            year_q |= Q(metric_type_id=metric_type_id, year__isnull=True)
+        else:
+            year_q |= Q(metric_type_id=metric_type_id, year=year)
+    return year_q
+
+
+class CompiledMatcher:
+    """A JSONLogic matching_criteria ({"and": [...]} or {"all": true}) compiled for an account and reference year."""
+
+    def __init__(self, account, matching_criteria, reference_year=None):
+        self.account = account
+        self.matching_criteria = matching_criteria
+        self.reference_year = reference_year
+        self.matches_all = bool(matching_criteria.get("all"))
+        self.metric_type_ids = [] if self.matches_all else criteria_metric_type_ids(matching_criteria)
+
+    @cached_property
+    def year_by_metric_type_id(self):
+        """{metric_type_id: year its values are read at}: the reference year, or None for timeless values."""
+        return resolve_metric_type_years(self.account, self.metric_type_ids, self.reference_year)
+
+    @cached_property
+    def queryset(self):
+        """Distinct ids of the matched org units, as one SQL statement."""
+        org_units = get_intervention_org_units(self.account)
+        if self.matches_all:
+            return org_units.values_list("id", flat=True).distinct()
+
+        metric_values = account_metric_values(self.account)
+        if self.year_by_metric_type_id:
+            metric_values = metric_values.filter(metric_type_years_q(self.year_by_metric_type_id))
+
+        q = jsonlogic_to_exists_q_clauses(self.matching_criteria, metric_values, "metric_type_id", "org_unit_id")
+        matched_ids = metric_values.filter(q).distinct().values_list("org_unit_id", flat=True)
+        return org_units.filter(id__in=matched_ids).values_list("id", flat=True).distinct()
+
+    @property
+    def sql(self):
+        """The statement evaluating the criteria, with its parameters inlined (for inspection, not execution)."""
+        return str(self.queryset.query)
+
+    def org_unit_ids(self):
+        return list(self.queryset)
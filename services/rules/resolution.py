@@ -0,0 +1,84 @@
+"""
+Resolution of the intervention assignments of a scenario from its rules, with boolean masks.
+
+The org unit ids referenced by the rules (matched, excluded and included) are interned once in an
+``OrgUnitIndex``; each rule's target org units are then a boolean mask over those positions, and the
+priority shadowing per intervention category is a running mask per category:
+
+    targets = (matched & ~excluded) | included     (included only, for rules without criteria)
+    assigned = targets & ~covered[category]
+    covered[category] |= assigned
+
+Resolving a scenario is a few vector operations per (rule, intervention) instead of set operations
+per org unit.
+"""
+
+import numpy as np
+
+
+class OrgUnitIndex:
+    """Dense positions of a fixed set of org unit ids."""
+
+    def __init__(self, org_unit_ids):
+        self.ids = np.unique(np.asarray(org_unit_ids, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def mask(self, org_unit_ids):
+        """Boolean mask of the given ids, which must all be in the index."""
+        mask = np.zeros(len(self.ids), dtype=bool)
+        if len(org_unit_ids):
+            mask[np.searchsorted(self.ids, np.asarray(org_unit_ids, dtype=np.int64))] = True
+        return mask
+
+    def org_unit_ids(self, mask):
+        return self.ids[mask].tolist()
+
+
+def rule_target_mask(rule, index):
+    """Mask of the org units a rule targets, as ScenarioRule._compute_org_unit_ids."""
+    included = index.mask(rule.org_units_included)
+    if rule.matching_criteria is None:
+        return included
+    matched = index.mask(rule.org_units_matched)
+    if not matched.any() and not included.any():
+        return matched
+    return (matched & ~index.mask(rule.org_units_excluded)) | included
+
+
+def resolve_assignments(rules):
+    """Return {(org_unit_id, intervention_id): rule_id} of the assignments the rules produce.
+
+    rules are the scenario's rules ordered by priority, highest first, with their interventions
+    prefetched. As in ScenarioRule.get_target_assignments, an org unit gets at most one intervention
+    per category: the one of the highest priority rule, and within a rule the first intervention.
+    """
+    rules = list(rules)
+    index = OrgUnitIndex(
+        [
+            org_unit_id
+            for rule in rules
+            for org_unit_ids in (rule.org_units_matched, rule.org_units_excluded, rule.org_units_included)
+            for org_unit_id in org_unit_ids or ()
+        ]
+    )
+
+    covered_by_category_id = {}
+    assignments = {}
+    for rule in rules:
+        interventions = rule.interventions.all()
+        if not interventions:
+            continue
+        targets = rule_target_mask(rule, index)
+        if not targets.any():
+            continue
+        for intervention in interventions:
+            covered = covered_by_category_id.setdefault(
+                intervention.intervention_category_id, np.zeros(len(index), bool)
+            )
+            assigned = targets & ~covered
+            covered |= assigned
+            for org_unit_id in index.org_unit_ids(assigned):
+                assignments[(org_unit_id, intervention.id)] = rule.id
+    return assignments
@@ -0,0 +1,171 @@
+import json
+import logging
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from beanstalk_worker import task_decorator
+from iaso.models import Task
+from iaso.models.base import ERRORED, QUEUED, RUNNING
+from plugins.snt_malaria.api.scenarios.utils import (
+    create_rules_from_groups,
+    get_import_errors,
+    get_interventions,
+    get_scenario,
+    read_import_csv_in_chunks,
+)
+from plugins.snt_malaria.models import InterventionAssignment, ScenarioImport
+from plugins.snt_malaria.models.account_settings import get_intervention_org_units
+from plugins.snt_malaria.services.rules.resolution import resolve_assignments
+
+
+logger = logging.getLogger(__name__)
+
+IMPORT_SCENARIO_TASK_NAME = "import_scenario_csv"
+IMPORT_CHUNK_SIZE = 5000
+ASSIGNMENT_BATCH_SIZE = 5000
+# A running import reports progress at least once per chunk or batch. Without any for that long, its
+# worker is considered dead and the import can be resumed.
+STALE_IMPORT_AFTER = timedelta(minutes=15)
+
+
+class ScenarioImportError(Exception):
+    pass
+
+
+@task_decorator(task_name=IMPORT_SCENARIO_TASK_NAME)
+def import_scenario_csv(scenario_import_id: int, task=None):
+    """Import the scenario CSV of a ScenarioImport, the way ScenarioViewSet.import_from_csv does.
+
+    The file is read IMPORT_CHUNK_SIZE rows at a time. The scenario and its rules are created in one
+    transaction, then the assignments are written ASSIGNMENT_BATCH_SIZE at a time, each batch committed
+    on its own. Running the task again for an interrupted import resumes it from there. The scenario
+    stays locked until the import completes, and the file is deleted once it is. Every progress report
+    also bumps the import's updated_at, which tells a running import from one whose worker died.
+    """
+    scenario_import = ScenarioImport.objects.select_related("account", "created_by", "scenario").get(
+        id=scenario_import_id
+    )
+    if scenario_import.completed_at:
+        task.report_success(f"Scenario {scenario_import.scenario_id} already imported.")
+        return
+
+    _report_progress(scenario_import, task, progress_message="Import started")
+    try:
+        scenario = scenario_import.scenario or _create_scenario_and_rules(scenario_import, task)
+    except ScenarioImportError as e:
+        logger.info(f"Scenario import {scenario_import.id} rejected: {e}")
+        task.report_failure(e)
+        return
+
+    _write_assignments(scenario_import, scenario, task)
+    # Also bumps updated_at so the impact API cache (keyed on this timestamp) self-invalidates.
+    scenario.is_locked = False
+    scenario.save()
+
+    scenario_import.file.delete(save=False)
+    scenario_import.completed_at = timezone.now()
+    scenario_import.save(update_fields=["file", "completed_at", "updated_at"])
+    task.report_success(f"Scenario {scenario.id} imported.")
+
+
+def _create_scenario_and_rules(scenario_import, task):
+    account = scenario_import.account
+    user = scenario_import.created_by
+    interventions = get_interventions(account)
+
+    def report_rows_read(rows_read):
+        _report_progress(scenario_import, task, progress_message=f"Read {rows_read} rows")
+
+    with scenario_import.file.open("rb") as file:
+        columns, csv_org_unit_ids, invalid_count, groups = read_import_csv_in_chunks(
+            file, interventions, IMPORT_CHUNK_SIZE, on_chunk=report_rows_read
+        )
+
+    if "org_unit_id" not in columns:
+        raise ScenarioImportError("The CSV must contain an 'org_unit_id' column.")
+    if invalid_count:
+        raise ScenarioImportError("The 'org_unit_id' column must only contain org unit ids.")
+    available_org_unit_ids = set(get_intervention_org_units(account).values_list("id", flat=True))
+    errors = get_import_errors(columns, csv_org_unit_ids, interventions, available_org_unit_ids)
+    if errors:
+        raise ScenarioImportError(json.dumps(errors))
+    if not groups:
+        raise ScenarioImportError("No assignments to create from the provided CSV data.")
+
+    with transaction.atomic():
+        scenario = get_scenario(user, base_name="Imported Scenario")
+        # Half-imported until all its assignments are written: keep it from being edited meanwhile.
+        scenario.is_locked = True
+        scenario.save()
+        create_rules_from_groups(scenario, groups, available_org_unit_ids, user)
+        scenario_import.scenario = scenario
+        scenario_import.save(update_fields=["scenario", "updated_at"])
+    return scenario
+
+
+def _report_progress(scenario_import, task, **progress):
+    task.report_progress_and_stop_if_killed(**progress)
+    ScenarioImport.objects.filter(id=scenario_import.id).update(updated_at=timezone.now())
+
+
+def _write_assignments(scenario_import, scenario, task):
+    """Create the assignments of the scenario's rules that do not exist yet, in committed batches."""
+    user = scenario_import.created_by
+    target_rule_ids = resolve_assignments(scenario.rules.order_by("-priority").prefetch_related("interventions"))
+    existing = set(scenario.intervention_assignments.values_list("org_unit_id", "intervention_id"))
+    missing = sorted(key for key in target_rule_ids if key not in existing)
+
+    batch_count = -(-len(missing) // ASSIGNMENT_BATCH_SIZE)
+    for index, start in enumerate(range(0, len(missing), ASSIGNMENT_BATCH_SIZE), start=1):
+        batch = missing[start : start + ASSIGNMENT_BATCH_SIZE]
+        InterventionAssignment.objects.bulk_create(
+            InterventionAssignment(
+                scenario_id=scenario.id,
+                org_unit_id=org_unit_id,
+                intervention_id=intervention_id,
+                rule_id=target_rule_ids[(org_unit_id, intervention_id)],
+                created_by=user,
+            )
+            for org_unit_id, intervention_id in batch
+        )
+        _report_progress(
+            scenario_import,
+            task,
+            progress_value=index,
+            progress_message=f"Created {start + len(batch)} of {len(missing)} assignments",
+            end_value=batch_count,
+        )
+
+
+def _stale_running_tasks(scenario_import):
+    """The import's task when it is left RUNNING by a worker that stopped reporting progress."""
+    if timezone.now() - scenario_import.updated_at < STALE_IMPORT_AFTER:
+        return Task.objects.none()
+    return Task.objects.filter(id=scenario_import.task_id, status=RUNNING)
+
+
+def is_scenario_import_running(scenario_import) -> bool:
+    """Whether the import's task is queued, or running and still reporting progress."""
+    return (
+        scenario_import.task_id is not None
+        and Task.objects.filter(id=scenario_import.task_id, status__in=[QUEUED, RUNNING])
+        .exclude(id__in=_stale_running_tasks(scenario_import).values("id"))
+        .exists()
+    )
+
+
+def launch_scenario_import(scenario_import, user):
+    """Start (or resume) the import task of a ScenarioImport and return the task.
+
+    A previous task left running by a dead worker is marked as errored first.
+    """
+    _stale_running_tasks(scenario_import).update(
+        status=ERRORED, ended_at=timezone.now(), progress_message="Worker stopped reporting progress"
+    )
+    task = import_scenario_csv(scenario_import_id=scenario_import.id, user=user)
+    scenario_import.task = task
+    scenario_import.save(update_fields=["task", "updated_at"])
+    return task
@@ -0,0 +1,70 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from beanstalk_worker import task_decorator
+from iaso.models import Task
+from iaso.models.base import QUEUED, RUNNING
+from plugins.snt_malaria.models import Scenario
+from plugins.snt_malaria.services import BudgetCalculationService
+from plugins.snt_malaria.services.budget.inputs import invalidate_cached_inputs
+
+
+logger = logging.getLogger(__name__)
+
+RECOMPUTE_BUDGET_TASK_NAME = "recompute_scenario_budget"
+
+
+@task_decorator(task_name=RECOMPUTE_BUDGET_TASK_NAME)
+def recompute_scenario_budget(scenario_id: int, task=None):
+    scenario = Scenario.objects.filter(id=scenario_id).first()
+    if scenario is None:
+        task.report_success(f"Scenario {scenario_id} no longer exists. Skipping budget recompute.")
+        return
+
+    task.report_progress_and_stop_if_killed(progress_message=f"Computing budget of scenario {scenario.id}")
+    budget = BudgetCalculationService(scenario).calculate_and_save_all_years(task.launcher)
+    logger.info(f"Budget {budget.id} computed for scenario {scenario.id}")
+    task.report_success(f"Budget {budget.id} computed for scenario {scenario.id}")
+
+
+def _recompute_tasks(scenario_id, statuses):
+    return Task.objects.filter(
+        name=RECOMPUTE_BUDGET_TASK_NAME, status__in=statuses, params__kwargs__scenario_id=scenario_id
+    )
+
+
+def is_budget_recompute_pending(scenario) -> bool:
+    """Whether a budget recompute of the scenario is queued or running."""
+    return _recompute_tasks(scenario.id, [QUEUED, RUNNING]).exists()
+
+
+def _enqueue_budget_recompute(scenario_id, user):
+    # A queued task reads the scenario when it starts, so it already covers this edit. A running one may
+    # have read the scenario before it, hence a new task is queued behind it.
+    with transaction.atomic():
+        # Locking the scenario row makes the check and the enqueue one step: two concurrent edits would
+        # otherwise both see no queued task and queue one each.
+        if not Scenario.objects.select_for_update().filter(id=scenario_id).values_list("id", flat=True):
+            return None
+        if _recompute_tasks(scenario_id, [QUEUED]).exists():
+            return None
+        return recompute_scenario_budget(scenario_id=scenario_id, user=user)
+
+
+def request_budget_recompute(scenario, user):
+    """Recompute the budget of a scenario after its inputs changed.
+
+    With settings.ASYNC_BUDGET_RECOMPUTE, the recompute runs in a background task enqueued once the current
+    transaction commits, and a burst of edits on the same scenario is coalesced into a single task. The
+    latest computed budget stays readable meanwhile (see is_budget_recompute_pending). Otherwise the budget
+    is recomputed right away.
+    """
+    invalidate_cached_inputs(scenario.id)
+    if not settings.ASYNC_BUDGET_RECOMPUTE:
+        BudgetCalculationService(scenario).calculate_and_save_all_years(user)
+        return
+
+    scenario_id = scenario.id
+    transaction.on_commit(lambda: _enqueue_budget_recompute(scenario_id, user))
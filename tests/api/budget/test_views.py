@@ -1,8 +1,16 @@
+import csv
+import io
+
+from importlib.util import find_spec
+from unittest import skipUnless
+
 from rest_framework import status
 
-from iaso.models import MetricType, MetricValue
+from iaso.models import MetricType, MetricValue, OrgUnit, OrgUnitType, Task
 from plugins.snt_malaria.models import (
+    AccountSettings,
     Budget,
+    BudgetLine,
     Donor,
     Grant,
     InterventionAssignment,
@@ -12,6 +20,7 @@ from plugins.snt_malaria.models.budget_settings import BudgetSettings
 from plugins.snt_malaria.models.cost_breakdown import InterventionCostBreakdownLine
 from plugins.snt_malaria.models.cost_unit_type import CostUnitType
 from plugins.snt_malaria.permissions import SNT_SCENARIO_BASIC_WRITE_PERMISSION, SNT_SCENARIO_FULL_WRITE_PERMISSION
+from plugins.snt_malaria.tasks.recompute_budget import RECOMPUTE_BUDGET_TASK_NAME
 from plugins.snt_malaria.tests.common_base import SNTMalariaAPITestCase
 
 
@@ -564,3 +573,352 @@ class BudgetAPITestCase(SNTMalariaAPITestCase):
 
         response = self.client.get(f"{BASE_URL}by_grant/", {"scenario_id": 99999})
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def _create_budget_with_lines(self):
+        InterventionAssignment.objects.create(
+            scenario=self.scenario,
+            org_unit=self.district1,
+            intervention=self.intervention_chemo_smc,
+            created_by=self.user_with_full_perm,
+        )
+        self.client.force_authenticate(user=self.user_with_full_perm)
+        response = self.client.post(BASE_URL, {"scenario": self.scenario.id}, format="json")
+        return self.assertJSONResponse(response, status.HTTP_201_CREATED)
+
+    def test_lines_aggregated_by_org_unit_for_one_year(self):
+        budget = self._create_budget_with_lines()
+        self.assertTrue(BudgetLine.objects.filter(budget_id=budget["id"]).exists())
+
+        response = self.client.get(
+            f"{BASE_URL}lines/",
+            {"scenario_id": self.scenario.id, "year": 2025, "group_by": "org_unit_id"},
+        )
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual(result["budget_id"], budget["id"])
+        self.assertEqual(result["total_cost"], budget["results"][0]["total_cost"])
+        by_org_unit = {row["org_unit_id"]: row["total_cost"] for row in result["results"]}
+        self.assertAlmostEqual(by_org_unit[self.district1.id], 275000.0)
+        self.assertAlmostEqual(by_org_unit[self.district2.id], 412500.0)
+
+    def test_lines_filtered_by_org_unit_and_intervention(self):
+        budget = self._create_budget_with_lines()
+
+        response = self.client.get(
+            f"{BASE_URL}lines/",
+            {
+                "scenario_id": self.scenario.id,
+                "org_unit_id": self.district1.id,
+                "intervention_id": self.intervention_chemo_smc.id,
+                "category": "Procurement",
+                "group_by": "year",
+            },
+        )
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual([row["year"] for row in result["results"]], [2025, 2026, 2027, 2028])
+        expected = [
+            org_unit["total_cost"]
+            for year_result in budget["results"]
+            for org_unit in year_result["org_units_costs"]
+            if org_unit["org_unit_id"] == self.district1.id
+        ]
+        for row, total_cost in zip(result["results"], expected):
+            self.assertAlmostEqual(row["total_cost"], total_cost, places=4)
+
+    def test_lines_without_stored_lines_recomputes_rows(self):
+        self.client.force_authenticate(user=self.user_with_full_perm)
+
+        response = self.client.get(
+            f"{BASE_URL}lines/",
+            {"scenario_id": self.scenario.id, "org_unit_id": self.district2.id, "group_by": "year"},
+        )
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual([row["year"] for row in result["results"]], [2025, 2026, 2027, 2028])
+        self.assertAlmostEqual(result["results"][0]["total_cost"], 412500.0)
+        self.assertAlmostEqual(result["total_cost"], sum(row["total_cost"] for row in result["results"]))
+
+    def test_lines_invalid_group_by(self):
+        self._create_budget_with_lines()
+
+        response = self.client.get(f"{BASE_URL}lines/", {"scenario_id": self.scenario.id, "group_by": "name"})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_lines_missing_scenario(self):
+        self.client.force_authenticate(user=self.user_with_full_perm)
+
+        response = self.client.get(f"{BASE_URL}lines/")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_latest_pending_recompute(self):
+        Task.objects.create(
+            name=RECOMPUTE_BUDGET_TASK_NAME,
+            status="QUEUED",
+            account=self.account,
+            launcher=self.user_with_full_perm,
+            params={"args": [], "kwargs": {"scenario_id": self.scenario.id}},
+        )
+
+        self.client.force_authenticate(user=self.user_with_full_perm)
+        response = self.client.get(f"{BASE_URL}get_latest/", {"scenario_id": self.scenario.id})
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual(result["id"], self.budget_1.id)
+        self.assertEqual(result["status"], "pending")
+
+        Task.objects.update(status="SUCCESS")
+        response = self.client.get(f"{BASE_URL}get_latest/", {"scenario_id": self.scenario.id})
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual(result["status"], "ready")
+
+    def _read_csv_export(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        return list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+
+    def test_export_csv(self):
+        budget = self._create_budget_with_lines()
+
+        response = self.client.get(f"{BASE_URL}export/", {"scenario_id": self.scenario.id, "year": 2025})
+
+        rows = self._read_csv_export(response)
+        self.assertEqual(len(rows), BudgetLine.objects.filter(budget_id=budget["id"], year=2025).count())
+        self.assertEqual({row["year"] for row in rows}, {"2025"})
+        by_org_unit = {int(row["org_unit_id"]): row for row in rows}
+        self.assertEqual(by_org_unit[self.district1.id]["intervention_code"], "smc")
+        self.assertEqual(by_org_unit[self.district1.id]["cost_line_name"], "smc cost line")
+        self.assertAlmostEqual(float(by_org_unit[self.district1.id]["cost"]), 275000.0)
+        self.assertAlmostEqual(sum(float(row["cost"]) for row in rows), budget["results"][0]["total_cost"])
+
+    def test_export_csv_without_stored_lines_recomputes_rows(self):
+        self.client.force_authenticate(user=self.user_with_full_perm)
+
+        response = self.client.get(
+            f"{BASE_URL}export/", {"scenario_id": self.scenario.id, "org_unit_id": self.district2.id}
+        )
+
+        rows = self._read_csv_export(response)
+        self.assertEqual([row["year"] for row in rows], ["2025", "2026", "2027", "2028"])
+        self.assertEqual({row["org_unit_id"] for row in rows}, {str(self.district2.id)})
+
+    def test_export_invalid_file_format(self):
+        self.client.force_authenticate(user=self.user_with_full_perm)
+
+        response = self.client.get(f"{BASE_URL}export/", {"scenario_id": self.scenario.id, "file_format": "xlsx"})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @skipUnless(find_spec("pyarrow"), "pyarrow is not installed")
+    def test_export_parquet(self):
+        import pyarrow.parquet as pq
+
+        budget = self._create_budget_with_lines()
+
+        response = self.client.get(f"{BASE_URL}export/", {"scenario_id": self.scenario.id, "file_format": "parquet"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        table = pq.read_table(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(table.num_rows, BudgetLine.objects.filter(budget_id=budget["id"]).count())
+        self.assertAlmostEqual(sum(table.column("cost").to_pylist()), sum(r["total_cost"] for r in budget["results"]))
+
+    def test_compare(self):
+        other_scenario = Scenario.objects.create(
+            account=self.account,
+            created_by=self.user_with_full_perm,
+            name="Other Scenario",
+            start_year=2025,
+            end_year=2028,
+        )
+        # SMC on both districts in the other scenario, only on district2 in the baseline.
+        for district in (self.district1, self.district2):
+            InterventionAssignment.objects.create(
+                scenario=other_scenario,
+                org_unit=district,
+                intervention=self.intervention_chemo_smc,
+                created_by=self.user_with_full_perm,
+            )
+
+        self.client.force_authenticate(user=self.user_with_basic_perm)
+        response = self.client.get(f"{BASE_URL}compare/", {"scenario_ids": f"{self.scenario.id},{other_scenario.id}"})
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual(result["baseline_scenario_id"], self.scenario.id)
+        baseline, other = result["scenarios"]
+        self.assertEqual(baseline["scenario_id"], self.scenario.id)
+        self.assertEqual(baseline["delta"], 0)
+        self.assertEqual(other["name"], "Other Scenario")
+        self.assertAlmostEqual(other["total_cost"] - baseline["total_cost"], other["delta"])
+
+        # district1 only costs in the other scenario: 100,000 * 1.1 * 2.5 = 275,000 in 2025.
+        other_org_units = {item["org_unit_id"]: item for item in other["org_units"]}
+        self.assertAlmostEqual(
+            other_org_units[self.district1.id]["delta"], other_org_units[self.district1.id]["total_cost"]
+        )
+        self.assertAlmostEqual(other_org_units[self.district2.id]["delta"], 0)
+        self.assertAlmostEqual(other["years"][0]["delta"], 275000.0)
+        smc = next(item for item in other["interventions"] if item["intervention_id"] == self.intervention_chemo_smc.id)
+        self.assertEqual(smc["code"], "smc")
+        self.assertAlmostEqual(smc["delta"], other["delta"])
+
+    def test_compare_invalid_scenario_ids(self):
+        other_account_scenario = self.create_snt_scenario(
+            account=self.create_snt_account(name="Other Account")[0], created_by=self.user_with_full_perm
+        )
+        self.client.force_authenticate(user=self.user_with_full_perm)
+
+        for scenario_ids in ["", str(self.scenario.id), "a,b", f"{self.scenario.id},{other_account_scenario.id}"]:
+            response = self.client.get(f"{BASE_URL}compare/", {"scenario_ids": scenario_ids})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, scenario_ids)
+
+    def test_sensitivity(self):
+        self.client.force_authenticate(user=self.user_with_basic_perm)
+        response = self.client.post(
+            f"{BASE_URL}sensitivity/",
+            {
+                "scenario_id": self.scenario.id,
+                "draws": 500,
+                "seed": 7,
+                "inflation_rate": {"distribution": "uniform", "low": 0.03, "high": 0.08},
+                "unit_cost": {"default": {"distribution": "uniform", "low": 0.8, "high": 1.2}},
+            },
+            format="json",
+        )
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual(result["draws"], 500)
+        self.assertEqual([year["year"] for year in result["years"]], [2025, 2026, 2027, 2028])
+        # SMC on district2 only: 150,000 * 1.1 * 2.5 = 412,500 in 2025, before inflation.
+        first_year = result["years"][0]["total_cost"]
+        self.assertAlmostEqual(first_year["base"], 412500.0)
+        self.assertLess(412500.0 * 0.8, first_year["percentiles"]["5"])
+        self.assertLess(first_year["percentiles"]["5"], first_year["percentiles"]["50"])
+        self.assertLess(first_year["percentiles"]["50"], first_year["percentiles"]["95"])
+        self.assertLess(first_year["percentiles"]["95"], 412500.0 * 1.2)
+        (smc,) = result["interventions"]
+        self.assertEqual(smc["intervention_id"], self.intervention_chemo_smc.id)
+        self.assertAlmostEqual(smc["total_cost"]["base"], result["total_cost"]["base"])
+
+    def test_sensitivity_fixed_distributions(self):
+        self.client.force_authenticate(user=self.user_with_full_perm)
+        smc_cost_line = self.cost_lines[0]
+        response = self.client.post(
+            f"{BASE_URL}sensitivity/",
+            {
+                "scenario_id": self.scenario.id,
+                "draws": 10,
+                "percentiles": [50],
+                "inflation_rate": {"distribution": "fixed", "value": 0},
+                "buffer": {"distribution": "fixed", "value": 1},
+                "unit_cost": {"cost_lines": {str(smc_cost_line.id): {"distribution": "fixed", "value": 2}}},
+            },
+            format="json",
+        )
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        # 150,000 * 2.5 * 2 every year, without buffer nor inflation.
+        for year in result["years"]:
+            self.assertAlmostEqual(year["total_cost"]["mean"], 750000.0)
+            self.assertEqual(list(year["total_cost"]["percentiles"]), ["50"])
+
+    def test_sensitivity_invalid_distributions(self):
+        self.client.force_authenticate(user=self.user_with_full_perm)
+
+        for body in [
+            {"inflation_rate": {"distribution": "uniform", "low": 0.08}},
+            {"inflation_rate": {"distribution": "uniform", "low": 0.08, "high": 0.03}},
+            {"buffer": {"distribution": "unknown", "value": 1}},
+            {"unit_cost": {"cost_lines": {"a": {"distribution": "fixed", "value": 1}}}},
+            {"draws": 0},
+        ]:
+            response = self.client.post(
+                f"{BASE_URL}sensitivity/", {"scenario_id": self.scenario.id, **body}, format="json"
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+    def test_sensitivity_requires_write_permission(self):
+        self.client.force_authenticate(user=self.user_no_perms)
+        response = self.client.post(f"{BASE_URL}sensitivity/", {"scenario_id": self.scenario.id}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_preview(self):
+        self.client.force_authenticate(user=self.user_with_basic_perm)
+        budget_count = Budget.objects.count()
+        response = self.client.post(
+            f"{BASE_URL}preview/",
+            {
+                "scenario_id": self.scenario.id,
+                "cost_lines": [{"id": self.cost_lines[0].id, "unit_cost": "5.00"}],
+                "add_assignments": [
+                    {"intervention_id": self.intervention_chemo_smc.id, "org_unit_ids": [self.district1.id]}
+                ],
+                "inflation_rate": "0",
+            },
+            format="json",
+        )
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual(result["scenario_id"], self.scenario.id)
+        self.assertEqual([year["year"] for year in result["results"]], [2025, 2026, 2027, 2028])
+        # SMC on both districts: (100,000 + 150,000) * 1.1 * 5, every year without inflation.
+        for year in result["results"]:
+            self.assertAlmostEqual(year["total_cost"], 1375000.0)
+        self.assertAlmostEqual(result["total_cost"], 4 * 1375000.0)
+        self.assertEqual(Budget.objects.count(), budget_count)
+        self.assertFalse(
+            InterventionAssignment.objects.filter(
+                scenario=self.scenario, org_unit=self.district1, intervention=self.intervention_chemo_smc
+            ).exists()
+        )
+
+    def test_preview_invalid_overrides(self):
+        other_account = self.create_snt_account(name="Other Account")[0]
+        other_intervention = self.create_snt_intervention(
+            intervention_category=self.create_snt_intervention_category(account=other_account)
+        )
+        self.client.force_authenticate(user=self.user_with_full_perm)
+
+        for body in [
+            {"cost_lines": [{"id": 0, "unit_cost": "1.00"}]},
+            {"cost_lines": [{"id": self.cost_lines[0].id, "unit_cost": "-1.00"}]},
+            {"yearly_values": [{"cost_line_id": 0, "year": 2025, "value": "1.00"}]},
+            {"add_assignments": [{"intervention_id": other_intervention.id, "org_unit_ids": [self.district1.id]}]},
+            {"remove_assignments": [{"intervention_id": self.intervention_chemo_smc.id, "org_unit_ids": []}]},
+        ]:
+            response = self.client.post(f"{BASE_URL}preview/", {"scenario_id": self.scenario.id, **body}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+    def test_preview_requires_write_permission(self):
+        self.client.force_authenticate(user=self.user_no_perms)
+        response = self.client.post(f"{BASE_URL}preview/", {"scenario_id": self.scenario.id}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_rollups(self):
+        region_type = OrgUnitType.objects.create(name="Region")
+        region = OrgUnit.objects.create(org_unit_type=region_type, name="Region")
+        OrgUnit.objects.filter(id__in=[self.district1.id, self.district2.id]).update(parent=region)
+        AccountSettings.objects.update_or_create(account=self.account, defaults={"focus_org_unit_type": region_type})
+        self.client.force_authenticate(user=self.user_with_full_perm)
+        self.client.post(BASE_URL, {"scenario": self.scenario.id}, format="json")
+
+        response = self.client.get(f"{BASE_URL}rollups/", {"scenario_id": self.scenario.id, "year": 2025})
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        (year,) = result["years"]
+        self.assertEqual(year["year"], 2025)
+        (rollup,) = year["org_unit_rollups"]
+        self.assertEqual(rollup["org_unit_id"], region.id)
+        # SMC on district2 only: 150,000 * 1.1 * 2.5.
+        self.assertAlmostEqual(rollup["total_cost"], 412500.0)
+        self.assertNotIn("org_units_costs", year)
+
+    def test_rollups_without_rollups_stored(self):
+        self.client.force_authenticate(user=self.user_with_full_perm)
+
+        response = self.client.get(f"{BASE_URL}rollups/", {"scenario_id": self.scenario.id})
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual(result["budget_id"], self.budget_1.id)
+        self.assertEqual(result["years"], [])
@@ -2,7 +2,7 @@ from decimal import Decimal
 
 from rest_framework import status
 
-from plugins.snt_malaria.models import Donor, Grant
+from plugins.snt_malaria.models import Budget, BudgetGrantTotal, Donor, Grant
 from plugins.snt_malaria.permissions import SNT_SETTINGS_READ_PERMISSION, SNT_SETTINGS_WRITE_PERMISSION
 from plugins.snt_malaria.tests.common_base import SNTMalariaAPITestCase
 
@@ -234,3 +234,67 @@ class GrantAPITestCase(SNTMalariaAPITestCase):
         self.client.force_authenticate(self.user_write)
         response = self.client.delete(f"{self.BASE_URL}{self.other_grant.id}/")
         self.assertJSONResponse(response, status.HTTP_404_NOT_FOUND)
+
+    # Utilization
+
+    def _create_budget(self, scenario, costs_by_grant):
+        budget = Budget.objects.create(scenario=scenario, name="Budget", results=[])
+        BudgetGrantTotal.objects.bulk_create(
+            BudgetGrantTotal(budget=budget, scenario=scenario, grant=grant, year=year, cost=cost)
+            for grant, year, cost in costs_by_grant
+        )
+        return budget
+
+    def test_utilization_with_read_perm(self):
+        scenario = self.create_snt_scenario(self.account, self.user, name="Scenario A")
+        other_scenario = self.create_snt_scenario(self.account, self.user, name="Scenario B")
+        self._create_budget(scenario, [(self.grant_nfm, 2025, Decimal("900000"))])
+        latest_budget = self._create_budget(
+            scenario,
+            [
+                (self.grant_nfm, 2025, Decimal("150000")),
+                (self.grant_nfm, 2026, Decimal("100000")),
+                (None, 2025, Decimal("5000")),
+            ],
+        )
+        other_budget = self._create_budget(other_scenario, [(self.grant_nfm, 2025, Decimal("1200000"))])
+        other_account_scenario = self.create_snt_scenario(self.other_account, self.other_user)
+        self._create_budget(other_account_scenario, [(self.other_grant, 2025, Decimal("1"))])
+
+        self.client.force_authenticate(self.user_read)
+        response = self.client.get(f"{self.BASE_URL}utilization/")
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual([item["name"] for item in result], ["NFM4", "PMI 2026"])
+        nfm, pmi = result
+        self.assertEqual(nfm["amount"], 1000000.0)
+        self.assertEqual(
+            [
+                (item["scenario_name"], item["budget_id"], item["total_cost"], item["remaining"], item["utilization"])
+                for item in nfm["scenarios"]
+            ],
+            [
+                ("Scenario A", latest_budget.id, 250000.0, 750000.0, 0.25),
+                ("Scenario B", other_budget.id, 1200000.0, -200000.0, 1.2),
+            ],
+        )
+        self.assertEqual(pmi["scenarios"], [])
+
+    def test_utilization_without_amount(self):
+        scenario = self.create_snt_scenario(self.account, self.user)
+        self._create_budget(scenario, [(self.grant_pmi, 2025, Decimal("1000"))])
+
+        self.client.force_authenticate(self.user_write)
+        response = self.client.get(f"{self.BASE_URL}utilization/")
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        (pmi,) = [item for item in result if item["grant_id"] == self.grant_pmi.id]
+        (scenario_item,) = pmi["scenarios"]
+        self.assertEqual(scenario_item["total_cost"], 1000.0)
+        self.assertIsNone(scenario_item["utilization"])
+        self.assertIsNone(scenario_item["remaining"])
+
+    def test_utilization_no_perms_forbidden(self):
+        self.client.force_authenticate(self.user_no_perms)
+        response = self.client.get(f"{self.BASE_URL}utilization/")
+        self.assertJSONResponse(response, status.HTTP_403_FORBIDDEN)
@@ -3,6 +3,7 @@ from django.contrib.gis.geos import MultiPolygon, Point, Polygon
 from iaso.models import MetricType, MetricValue, OrgUnit
 from plugins.snt_malaria.models import ScenarioRule
 from plugins.snt_malaria.permissions import SNT_SCENARIO_BASIC_WRITE_PERMISSION, SNT_SCENARIO_FULL_WRITE_PERMISSION
+from plugins.snt_malaria.services.rules.cache import clear_matches_cache
 from plugins.snt_malaria.tests.common_base import SNTMalariaAPITestCase
 
 
@@ -11,6 +12,7 @@ class ScenarioRulesTestBase(SNTMalariaAPITestCase):
 
     def setUp(self):
         super().setUp()
+        clear_matches_cache()
         self.account, self.source, self.version, self.project = self.create_account_datasource_version_project(
             "source", "Test Account", "project"
         )
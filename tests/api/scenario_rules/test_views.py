@@ -1,7 +1,12 @@
+from unittest import mock
+
 from rest_framework import status
 
+from iaso.models import MetricValue
 from iaso.utils.colors import DEFAULT_COLOR
 from plugins.snt_malaria.models import AccountSettings, Budget, InterventionAssignment, Scenario, ScenarioRule
+from plugins.snt_malaria.services.rules.cache import invalidate_matches_cache
+from plugins.snt_malaria.services.rules.matcher import CompiledMatcher
 from plugins.snt_malaria.tests.api.scenario_rules.common_base import ScenarioRulesTestBase
 
 
@@ -846,3 +851,71 @@ class ScenarioRuleAPITestCase(ScenarioRulesTestBase):
             [self.district_1.id, self.district_2.id, self.district_3.id],
         )
         self.assertNotIn(region.id, stale_match_all_rule.org_units_matched)
+
+    def _preview(self, matching_criteria):
+        response = self.client.post(f"{self.BASE_URL}preview/", {"matching_criteria": matching_criteria})
+        return sorted(self.assertJSONResponse(response, status.HTTP_200_OK))
+
+    def test_preview_and_create_share_cached_matches(self):
+        population = {">=": [{"var": self.metric_type_population.id}, 13000000]}
+        under_5 = {">=": [{"var": self.metric_type_pop_under_5.id}, 0]}
+        self.client.force_authenticate(user=self.user_with_full_perm)
+
+        with mock.patch(
+            "plugins.snt_malaria.services.rules.cache.CompiledMatcher", wraps=CompiledMatcher
+        ) as compiled_matcher:
+            first = self._preview({"and": [population, under_5]})
+            # Same conditions in another order: same normalized criteria.
+            second = self._preview({"and": [under_5, population]})
+            response = self.client.post(
+                self.BASE_URL,
+                {
+                    "name": "Cached rule",
+                    "scenario": self.scenario.id,
+                    "matching_criteria": {"and": [population, under_5]},
+                    "interventions": [self.intervention_chemo_iptp.id],
+                },
+            )
+            self.assertJSONResponse(response, status.HTTP_201_CREATED)
+
+        self.assertEqual(compiled_matcher.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(sorted(ScenarioRule.objects.get(name="Cached rule").org_units_matched), first)
+
+    def test_preview_cache_follows_metric_values(self):
+        criteria = {"and": [{">=": [{"var": self.metric_type_population.id}, 13000000]}]}
+        self.client.force_authenticate(user=self.user_with_full_perm)
+        self.assertEqual(self._preview(criteria), sorted([self.district_2.id, self.district_3.id]))
+
+        # A new value moves the metric data version.
+        MetricValue.objects.create(
+            metric_type=self.metric_type_population, org_unit=self.district_1, value=14000000, year=2025
+        )
+        self.assertIn(self.district_1.id, self._preview(criteria))
+
+        # An in-place update does not, the explicit invalidation does.
+        MetricValue.objects.filter(org_unit=self.district_1, metric_type=self.metric_type_population).update(value=1)
+        self.assertIn(self.district_1.id, self._preview(criteria))
+        invalidate_matches_cache(self.account.id)
+        self.assertNotIn(self.district_1.id, self._preview(criteria))
+
+    def test_preview_cache_follows_intervention_org_unit_type(self):
+        from django.contrib.gis.geos import Point
+
+        from iaso.models import OrgUnit, OrgUnitType
+
+        region = OrgUnit.objects.create(
+            org_unit_type=OrgUnitType.objects.create(name="REGION"),
+            name="Region 1",
+            version=self.version,
+            validation_status=OrgUnit.VALIDATION_VALID,
+            location=Point(x=4, y=50, z=100),
+        )
+        self.client.force_authenticate(user=self.user_with_full_perm)
+        self.assertIn(region.id, self._preview({"all": True}))
+
+        # Restricting the intervention level changes the cache key: no stale match-all result.
+        AccountSettings.objects.create(account=self.account, intervention_org_unit_type=self.out_district)
+        self.assertEqual(
+            self._preview({"all": True}), sorted([self.district_1.id, self.district_2.id, self.district_3.id])
+        )
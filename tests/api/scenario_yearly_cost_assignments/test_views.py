@@ -1,3 +1,6 @@
+from unittest import mock
+
+from django.test import override_settings
 from rest_framework import status
 
 from iaso.models.metric import MetricType
@@ -245,6 +248,20 @@ class ScenarioYearlyCostAssignmentAPITestCase(SNTMalariaAPITestCase):
         # population driver: API receives percentage (20.00), stored as fraction (0.20)
         self.assertEqual(str(assignment.value), "0.29")
 
+    @mock.patch(
+        "plugins.snt_malaria.api.scenario_yearly_cost_assignment.views.BudgetCalculationService.recalculate_cost_line_year"
+    )
+    def test_updating_single_assignment_verifies_sampled_budget_patches(self, mock_recalculate):
+        assignment = self._create_scenario_yearly_cost(self.scenario, self.population_line_1, value="5.00")
+        mock_recalculate.reset_mock()
+
+        for rate, verify in [(1, True), (0, False)]:
+            with override_settings(BUDGET_PATCH_VERIFY_RATE=rate):
+                response = self._patch_assignment_value(self.user_with_full_perm, assignment, "29.00")
+
+            self.assertJSONResponse(response, status.HTTP_200_OK)
+            self.assertEqual(mock_recalculate.call_args.kwargs["verify"], verify)
+
     def test_updating_single_assignment_allows_basic_access_when_user_created_the_scenario(self):
         assignment = self._create_scenario_yearly_cost(self.other_user_scenario, self.population_line_1, value="5.00")
 
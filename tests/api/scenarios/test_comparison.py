@@ -0,0 +1,41 @@
+import threading
+import time
+
+from plugins.snt_malaria.api.scenarios.comparison import run_jobs
+from plugins.snt_malaria.tests.common_base import SNTMalariaTestCase
+
+
+class RunJobsTestCase(SNTMalariaTestCase):
+    auto_create_account = False
+
+    def test_run_jobs_in_bounded_pool_keeps_order(self):
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def job(index):
+            def run():
+                with lock:
+                    running.append(index)
+                    max_running.append(len(running))
+                time.sleep(0.01)
+                with lock:
+                    running.remove(index)
+                return index
+
+            return run
+
+        self.assertEqual(run_jobs([job(index) for index in range(8)], max_workers=3), list(range(8)))
+        self.assertLessEqual(max(max_running), 3)
+
+    def test_run_jobs_inline_with_one_worker(self):
+        thread_ids = run_jobs([threading.get_ident, threading.get_ident], max_workers=1)
+
+        self.assertEqual(thread_ids, [threading.get_ident()] * 2)
+
+    def test_run_jobs_raises_job_error(self):
+        def fail():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            run_jobs([lambda: 1, fail], max_workers=2)
@@ -185,6 +185,28 @@ class BuildInterventionGroupsTestCase(SNTMalariaTestCase):
         self.assertCountEqual(group_a["org_unit_ids"], [1, 3])
         self.assertEqual(group_b["org_unit_ids"], [2])
 
+    def test_groups_merge_repeated_org_units_in_row_order(self):
+        col_a = get_intervention_column("A", "a")
+        col_b = get_intervention_column("B", "b")
+        df = self._make_df(
+            [
+                {"org_unit_id": 3, col_a: 0, col_b: 0},
+                {"org_unit_id": 2, col_a: 0, col_b: 1},
+                {"org_unit_id": 1, col_a: 1, col_b: 0},
+                {"org_unit_id": 3, col_a: 1, col_b: 0},
+                {"org_unit_id": 1, col_a: 0, col_b: 1},
+            ]
+        )
+        groups = _build_intervention_groups(df, self._interventions_qs())
+        self.assertEqual(
+            groups,
+            [
+                {"intervention_ids": frozenset([self.iv_b.id]), "org_unit_ids": [2]},
+                {"intervention_ids": frozenset([self.iv_a.id, self.iv_b.id]), "org_unit_ids": [1]},
+                {"intervention_ids": frozenset([self.iv_a.id]), "org_unit_ids": [3]},
+            ],
+        )
+
     def test_no_assignments_returns_empty(self):
         col_a = get_intervention_column("A", "a")
         col_b = get_intervention_column("B", "b")
@@ -1,15 +1,29 @@
+import csv
+import io
+
+from decimal import Decimal
+from unittest import mock
+
 from django.contrib.gis.geos import MultiPolygon, Point, Polygon
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
 from rest_framework import status
 
-from iaso.models import Account, MetricType, MetricValue, OrgUnit, OrgUnitType
+from iaso.models import Account, MetricType, MetricValue, OrgUnit, OrgUnitType, Task
 from plugins.snt_malaria.models import (
     AccountSettings,
+    Budget,
+    BudgetGrantTotal,
+    BudgetLine,
     InterventionAssignment,
     Scenario,
+    ScenarioImport,
     ScenarioRule,
 )
 from plugins.snt_malaria.permissions import SNT_SCENARIO_BASIC_WRITE_PERMISSION, SNT_SCENARIO_FULL_WRITE_PERMISSION
+from plugins.snt_malaria.providers.impact.base import ImpactMetricWithConfidenceInterval
+from plugins.snt_malaria.services.budget.dataclasses import BudgetComparisonYear, BudgetScenarioComparison
+from plugins.snt_malaria.services.impact import ScenarioImpactMetrics, YearImpactMetrics
 from plugins.snt_malaria.tests.common_base import SNTMalariaAPITestCase
 
 
@@ -721,6 +735,79 @@ class ScenarioAPITestCase(SNTMalariaAPITestCase):
         self.assertEqual(new_duplicated_assignments.count(), initial_assignments.count())
         self.assertEqual(new_duplicated_assignments.count(), duplicated_assignments.count())
 
+    def _create_budget(self):
+        budget = Budget.objects.create(
+            scenario=self.scenario,
+            name=f"Budget for {self.scenario.name}",
+            results=[{"year": 2025, "total_cost": 10.0}],
+            input_fingerprint="fingerprint",
+            created_by=self.user_with_full_perm,
+        )
+        BudgetLine.objects.create(
+            budget=budget,
+            scenario=self.scenario,
+            year=2025,
+            org_unit=self.district1,
+            intervention=self.intervention_chemo_iptp,
+            category="Procurement",
+            quantity=1,
+            cost=10,
+        )
+        BudgetGrantTotal.objects.create(budget=budget, scenario=self.scenario, year=2025, cost=10)
+        return budget
+
+    def test_scenario_duplicate_same_years_copies_latest_budget(self):
+        self.scenario.refresh_assignments(self.user_with_full_perm)
+        budget = self._create_budget()
+
+        payload = {"name": f"Copy of {self.scenario.name}", "start_year": 2025, "end_year": 2026}
+        self.client.force_authenticate(self.user_with_full_perm)
+        with mock.patch("plugins.snt_malaria.api.scenarios.views.request_budget_recompute") as request_recompute:
+            response = self.client.post(f"{self.BASE_URL}{self.scenario.id}/duplicate/", payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        request_recompute.assert_not_called()
+
+        duplicated_scenario = Scenario.objects.latest("id")
+        duplicated_budget = Budget.objects.get(scenario=duplicated_scenario)
+        self.assertNotEqual(duplicated_budget.id, budget.id)
+        self.assertEqual(duplicated_budget.name, f"Budget for {duplicated_scenario.name}")
+        self.assertEqual(duplicated_budget.results, budget.results)
+        self.assertEqual(duplicated_budget.input_fingerprint, budget.input_fingerprint)
+        line_fields = ["year", "org_unit_id", "intervention_id", "category", "quantity", "cost"]
+        self.assertEqual(
+            list(duplicated_budget.lines.values_list(*line_fields)), list(budget.lines.values_list(*line_fields))
+        )
+        self.assertEqual(
+            list(duplicated_budget.grant_totals.values_list("scenario_id", "year")), [(duplicated_scenario.id, 2025)]
+        )
+
+        # Copied assignments point to the copies of their rules.
+        duplicated_assignments = duplicated_scenario.intervention_assignments.select_related("rule")
+        self.assertEqual(duplicated_assignments.count(), self.scenario.intervention_assignments.count())
+        self.assertEqual(
+            {assignment.rule.scenario_id for assignment in duplicated_assignments}, {duplicated_scenario.id}
+        )
+        self.assertEqual(
+            sorted(duplicated_assignments.values_list("org_unit_id", "intervention_id", "rule__priority")),
+            sorted(
+                self.scenario.intervention_assignments.values_list("org_unit_id", "intervention_id", "rule__priority")
+            ),
+        )
+
+    def test_scenario_duplicate_other_years_recomputes_budget(self):
+        self.scenario.refresh_assignments(self.user_with_full_perm)
+        self._create_budget()
+
+        payload = {"name": f"Copy of {self.scenario.name}", "start_year": 2025, "end_year": 2027}
+        self.client.force_authenticate(self.user_with_full_perm)
+        with mock.patch("plugins.snt_malaria.api.scenarios.views.request_budget_recompute") as request_recompute:
+            response = self.client.post(f"{self.BASE_URL}{self.scenario.id}/duplicate/", payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        duplicated_scenario = Scenario.objects.latest("id")
+        request_recompute.assert_called_once_with(duplicated_scenario, self.user_with_full_perm)
+        self.assertFalse(Budget.objects.filter(scenario=duplicated_scenario).exists())
+
     def test_scenario_export_to_csv(self):
         """
         This endpoint is available to all authenticated users, regardless of permissions.
@@ -728,7 +815,7 @@ class ScenarioAPITestCase(SNTMalariaAPITestCase):
         self.client.force_authenticate(self.user_with_full_perm)
         response = self.client.get(f"{self.BASE_URL}export_to_csv/?id={self.scenario.id}")
 
-        csv_list = self.assertCsvFileResponse(response, return_as_lists=True)
+        csv_list = self.assertCsvFileResponse(response, streaming=True, return_as_lists=True)
         self.assertEqual(len(csv_list), 4)  # Headers + 3 org units
         csv_headers = csv_list[0]
         csv_district_1 = csv_list[1]
@@ -744,7 +831,7 @@ class ScenarioAPITestCase(SNTMalariaAPITestCase):
 
         self.client.force_authenticate(self.user_with_basic_perm)
         response = self.client.get(f"{self.BASE_URL}export_to_csv/?id={self.scenario.id}")
-        csv_list = self.assertCsvFileResponse(response, return_as_lists=True)
+        csv_list = self.assertCsvFileResponse(response, streaming=True, return_as_lists=True)
         self.assertEqual(len(csv_list), 4)  # Headers + 3 org units
         csv_headers = csv_list[0]
         csv_district_1 = csv_list[1]
@@ -760,7 +847,7 @@ class ScenarioAPITestCase(SNTMalariaAPITestCase):
 
         self.client.force_authenticate(self.user_no_perms)
         response = self.client.get(f"{self.BASE_URL}export_to_csv/?id={self.scenario.id}")
-        csv_list = self.assertCsvFileResponse(response, return_as_lists=True)
+        csv_list = self.assertCsvFileResponse(response, streaming=True, return_as_lists=True)
         self.assertEqual(len(csv_list), 4)  # Headers + 3 org units
         csv_headers = csv_list[0]
         csv_district_1 = csv_list[1]
@@ -774,6 +861,19 @@ class ScenarioAPITestCase(SNTMalariaAPITestCase):
         self.assertSequenceEqual(csv_district_2, [str(self.district2.id), self.district2.name, "0", "0", "1"])
         self.assertSequenceEqual(csv_district_3, [str(self.district3.id), self.district3.name, "0", "1", "0"])
 
+    def test_scenario_export_to_csv_streams_rows_in_batches(self):
+        self.client.force_authenticate(self.user_with_full_perm)
+        with mock.patch("plugins.snt_malaria.api.scenarios.utils.EXPORT_BATCH_SIZE", 2):
+            response = self.client.get(f"{self.BASE_URL}export_to_csv/?id={self.scenario.id}")
+            chunks = [chunk.decode() for chunk in response.streaming_content]
+
+        # Header and the first 2 org units, then the last one.
+        self.assertEqual([len(list(csv.reader(io.StringIO(chunk)))) for chunk in chunks], [3, 1])
+        rows = list(csv.reader(io.StringIO("".join(chunks))))
+        self.assertEqual(rows[0], ["org_unit_id", "org_unit_name", "IPTp - iptp", "RTS,S - rts_s", "SMC - smc"])
+        self.assertEqual(rows[1], [str(self.district1.id), self.district1.name, "1", "0", "0"])
+        self.assertEqual(rows[3], [str(self.district3.id), self.district3.name, "0", "1", "0"])
+
     def test_scenario_export_to_csv_unauthenticated(self):
         response = self.client.get(f"{self.BASE_URL}export_to_csv/?id={self.scenario.id}")
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -782,7 +882,7 @@ class ScenarioAPITestCase(SNTMalariaAPITestCase):
         self.client.force_authenticate(self.user_no_perms)
         response = self.client.get(f"{self.BASE_URL}export_to_csv/")
 
-        csv_list = self.assertCsvFileResponse(response, return_as_lists=True)
+        csv_list = self.assertCsvFileResponse(response, streaming=True, return_as_lists=True)
         self.assertEqual(len(csv_list), 4)  # Headers + 3 org units
         csv_headers = csv_list[0]
         csv_district_1 = csv_list[1]
@@ -839,6 +939,21 @@ class ScenarioAPITestCase(SNTMalariaAPITestCase):
         self.assertIn("file", response.data)
         self.assertEqual(str(response.data["file"][0]), "The CSV must contain an 'org_unit_id' column.")
 
+    def test_scenario_import_csv_invalid_org_unit_id(self):
+        csv_content = (
+            'org_unit_id,org_unit_name,IPTp - iptp,"RTS,S - rts_s",SMC - smc\n'
+            f"{self.district1.id},District 1,1,0,0\n"
+            "district-2,District 2,0,1,0\n"
+            ",District 3,0,0,1\n"
+        )
+        invalid_file = SimpleUploadedFile("test.csv", csv_content.encode(), content_type="text/csv")
+
+        self.client.force_authenticate(self.user_with_full_perm)
+        response = self.client.post(f"{self.BASE_URL}import_from_csv/", {"file": invalid_file}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(str(response.data["file"][0]), "The 'org_unit_id' column must only contain org unit ids.")
+        self.assertEqual(Scenario.objects.count(), 1)
+
     def test_scenario_import_csv_missing_header(self):
         csv_content = (
             'org_unit_id,org_unit_name,IPTp - iptp,"RTS,S - rts_s"\n'
@@ -1298,6 +1413,152 @@ class ScenarioAPITestCase(SNTMalariaAPITestCase):
             self.assertEqual(rule.org_units_excluded, [])
             self.assertGreater(len(rule.org_units_included), 0)
 
+    def test_scenario_import_csv_async_queues_task(self):
+        valid_file = SimpleUploadedFile("test.csv", self._generate_csv_content_for_import(), content_type="text/csv")
+
+        self.client.force_authenticate(self.user_with_full_perm)
+        response = self.client.post(f"{self.BASE_URL}import_from_csv_async/", {"file": valid_file}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        scenario_import = ScenarioImport.objects.get(id=response.data["import_id"])
+        self.assertEqual(scenario_import.account, self.account)
+        self.assertIsNone(scenario_import.scenario)
+        self.assertEqual(response.data["task"]["id"], scenario_import.task_id)
+        self.assertEqual(response.data["task"]["status"], "QUEUED")
+        # The rows are only read by the task.
+        self.assertFalse(Scenario.objects.exclude(id=self.scenario.id).exists())
+
+    def test_scenario_import_csv_async_missing_org_unit_id_column(self):
+        invalid_file = SimpleUploadedFile("test.csv", b"name,SMC - smc\nDistrict 1,1\n", content_type="text/csv")
+
+        self.client.force_authenticate(self.user_with_full_perm)
+        response = self.client.post(
+            f"{self.BASE_URL}import_from_csv_async/", {"file": invalid_file}, format="multipart"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ScenarioImport.objects.exists())
+
+    def test_scenario_import_csv_async_resume(self):
+        valid_file = SimpleUploadedFile("test.csv", self._generate_csv_content_for_import(), content_type="text/csv")
+        self.client.force_authenticate(self.user_with_full_perm)
+        response = self.client.post(f"{self.BASE_URL}import_from_csv_async/", {"file": valid_file}, format="multipart")
+        import_id = response.data["import_id"]
+        resume_url = f"{self.BASE_URL}import_from_csv_async/{import_id}/resume/"
+
+        response = self.client.post(resume_url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        Task.objects.filter(id=ScenarioImport.objects.get(id=import_id).task_id).update(status="KILLED")
+        response = self.client.post(resume_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["task"]["status"], "QUEUED")
+        self.assertEqual(ScenarioImport.objects.get(id=import_id).task_id, response.data["task"]["id"])
+
+        _, other_user = self.create_snt_account(permissions=[SNT_SCENARIO_FULL_WRITE_PERMISSION])
+        self.client.force_authenticate(other_user)
+        response = self.client.post(resume_url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(SCENARIO_COMPARE_MAX_WORKERS=1)
+    def test_scenario_compare_budgets(self):
+        other_scenario = self.create_snt_scenario(self.account, self.user_with_full_perm, name="Other Scenario")
+
+        self.client.force_authenticate(self.user_with_basic_perm)
+        response = self.client.get(
+            f"{self.BASE_URL}compare/", {"scenario_ids": f"{self.scenario.id},{other_scenario.id}"}
+        )
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual(result["baseline_scenario_id"], self.scenario.id)
+        self.assertIsNone(result["age_group"])
+        baseline, other = result["scenarios"]
+        self.assertEqual(baseline["scenario_id"], self.scenario.id)
+        self.assertEqual(baseline["cost_delta"], 0)
+        self.assertEqual(other["name"], "Other Scenario")
+        self.assertAlmostEqual(other["total_cost"] - baseline["total_cost"], other["cost_delta"])
+        # Without an age group, impact is left out.
+        self.assertIsNone(other["number_cases"])
+        self.assertIsNone(other["cases_averted"])
+        self.assertIsNone(other["cost_per_case_averted"])
+
+    @override_settings(SCENARIO_COMPARE_MAX_WORKERS=1)
+    @mock.patch("plugins.snt_malaria.api.impact.views.ImpactService.get_scenario_impact")
+    @mock.patch("plugins.snt_malaria.api.scenarios.comparison.compare_scenario_budgets")
+    @mock.patch("plugins.snt_malaria.api.scenarios.comparison.get_provider_for_account")
+    def test_scenario_compare_with_impact(self, mock_get_provider, mock_compare_budgets, mock_get_scenario_impact):
+        other_scenario = self.create_snt_scenario(
+            self.account, self.user_with_full_perm, name="Other Scenario", start_year=2025, end_year=2028
+        )
+
+        def budget_comparison(scenario, cost_by_year):
+            return BudgetScenarioComparison(
+                scenario_id=scenario.id,
+                name=scenario.name,
+                total_cost=sum(cost_by_year.values()),
+                years=[BudgetComparisonYear(year=year, total_cost=cost) for year, cost in cost_by_year.items()],
+            )
+
+        mock_compare_budgets.return_value = [
+            budget_comparison(self.scenario, {2025: Decimal("100"), 2026: Decimal("100")}),
+            budget_comparison(
+                other_scenario,
+                {2025: Decimal("150"), 2026: Decimal("150"), 2027: Decimal("500"), 2028: Decimal("500")},
+            ),
+        ]
+        cases_by_scenario_id = {self.scenario.id: 1000.0, other_scenario.id: 800.0}
+
+        def get_scenario_impact(scenario, age_group, year_from, year_to):
+            cases = ImpactMetricWithConfidenceInterval(value=cases_by_scenario_id[scenario.id])
+            return ScenarioImpactMetrics(
+                scenario_id=scenario.id,
+                number_cases=cases,
+                by_year=[YearImpactMetrics(year=year_from, number_cases=cases)],
+            )
+
+        mock_get_provider.return_value = mock.MagicMock()
+        mock_get_scenario_impact.side_effect = get_scenario_impact
+
+        self.client.force_authenticate(self.user_with_basic_perm)
+        response = self.client.get(
+            f"{self.BASE_URL}compare/",
+            {"scenario_ids": f"{self.scenario.id},{other_scenario.id}", "age_group": "0-5"},
+        )
+
+        result = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual(result["age_group"], "0-5")
+        baseline, other = result["scenarios"]
+        self.assertEqual(baseline["number_cases"]["value"], 1000.0)
+        self.assertEqual(baseline["cases_averted"], 0)
+        self.assertIsNone(baseline["cost_per_case_averted"])
+        self.assertEqual(other["number_cases"]["value"], 800.0)
+        self.assertEqual(other["cases_averted"], 200.0)
+        # Costs cover the same 2025-2026 window as the impact: (150 + 150) - (100 + 100) over 200 cases averted,
+        # leaving out the other scenario's 2027-2028 costs.
+        self.assertEqual(baseline["total_cost"], 200.0)
+        self.assertEqual(other["total_cost"], 300.0)
+        self.assertEqual(other["cost_delta"], 100.0)
+        self.assertAlmostEqual(other["cost_per_case_averted"], 0.5)
+        self.assertEqual([year["year"] for year in other["years"]], [2025, 2026, 2027, 2028])
+        # Impact of every scenario defaults to the years of the baseline, 2025-2026.
+        self.assertEqual(
+            [(call.kwargs["year_from"], call.kwargs["year_to"]) for call in mock_get_scenario_impact.call_args_list],
+            [(2025, 2026), (2025, 2026)],
+        )
+        self.assertEqual(other["years"][0]["year"], 2025)
+        self.assertEqual(other["years"][0]["number_cases"]["value"], 800.0)
+
+    def test_scenario_compare_invalid_query(self):
+        other_scenario = self.create_snt_scenario(self.account, self.user_with_full_perm)
+
+        self.client.force_authenticate(self.user_with_basic_perm)
+        for params in [
+            {"scenario_ids": str(self.scenario.id)},
+            {"scenario_ids": f"{self.scenario.id},999999"},
+            {"scenario_ids": f"{self.scenario.id},{other_scenario.id}", "year_from": 2027, "year_to": 2025},
+        ]:
+            response = self.client.get(f"{self.BASE_URL}compare/", params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
     def _generate_csv_content_for_import(self) -> bytes:
         csv_content = (
             'org_unit_id,org_unit_name,IPTp - iptp,"RTS,S - rts_s",SMC - smc\n'
@@ -1385,7 +1646,7 @@ class CsvExportInterventionTypeScopeTestCase(SNTMalariaAPITestCase):
     def test_export_without_settings_includes_all_levels(self):
         self.client.force_authenticate(self.user)
         response = self.client.get(f"{self.BASE_URL}export_to_csv/")
-        csv_list = self.assertCsvFileResponse(response, return_as_lists=True)
+        csv_list = self.assertCsvFileResponse(response, streaming=True, return_as_lists=True)
         org_unit_ids = {row[0] for row in csv_list[1:]}
         self.assertEqual(org_unit_ids, {str(self.region.id), str(self.district1.id), str(self.district2.id)})
 
@@ -1393,7 +1654,7 @@ class CsvExportInterventionTypeScopeTestCase(SNTMalariaAPITestCase):
         AccountSettings.objects.create(account=self.account, intervention_org_unit_type=self.district_type)
         self.client.force_authenticate(self.user)
         response = self.client.get(f"{self.BASE_URL}export_to_csv/")
-        csv_list = self.assertCsvFileResponse(response, return_as_lists=True)
+        csv_list = self.assertCsvFileResponse(response, streaming=True, return_as_lists=True)
         org_unit_ids = {row[0] for row in csv_list[1:]}
         self.assertEqual(org_unit_ids, {str(self.district1.id), str(self.district2.id)})
         self.assertNotIn(str(self.region.id), org_unit_ids)
@@ -0,0 +1,44 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+
+from plugins.snt_malaria.models import Budget, BudgetGrantTotal
+from plugins.snt_malaria.tests.common_base import SNTMalariaTestCase
+
+
+class BackfillBudgetGrantTotalsCommandTestCase(SNTMalariaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.scenario = self.create_snt_scenario(self.account, self.user, start_year=2025, end_year=2026)
+        # Stored before budget lines and grant totals existed.
+        self.legacy_budget = Budget.objects.create(scenario=self.scenario, name="Legacy budget", results=[])
+        self.other_scenario = self.create_snt_scenario(self.account, self.user)
+        self.other_budget = Budget.objects.create(scenario=self.other_scenario, name="Budget", results=[])
+        BudgetGrantTotal.objects.create(
+            budget=self.other_budget, scenario=self.other_scenario, year=2025, cost=Decimal("10")
+        )
+
+    def _call(self, **options):
+        stdout = StringIO()
+        call_command("backfill_budget_grant_totals", **options, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_recomputes_latest_budgets_without_grant_totals(self):
+        output = self._call()
+
+        latest_budget = Budget.objects.filter(scenario=self.scenario).order_by("-created_at").first()
+        self.assertNotEqual(latest_budget.id, self.legacy_budget.id)
+        self.assertEqual(len(latest_budget.input_fingerprint), 64)
+        self.assertIn(f"recomputed as {latest_budget.id}", output)
+        # Budgets with stored totals are left alone.
+        self.assertEqual(list(Budget.objects.filter(scenario=self.other_scenario)), [self.other_budget])
+
+        # Once recomputed, nothing is left to backfill.
+        self.assertEqual(self._call(), "")
+
+    def test_dry_run_only_lists_budgets(self):
+        output = self._call(dry_run=True)
+
+        self.assertIn(f"Budget {self.legacy_budget.id} of scenario {self.scenario.id} has no grant totals", output)
+        self.assertEqual(list(Budget.objects.filter(scenario=self.scenario)), [self.legacy_budget])
@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+
+from plugins.snt_malaria.models import Budget, Scenario
+from plugins.snt_malaria.tests.common_base import SNTMalariaTestCase
+
+
+SMALL_FIXTURE = {"org_units": 4, "interventions": 2, "cost_lines": 2, "years": 2, "population_layers": 1, "repeat": 1}
+SMALL_PROFILE = "ou4_iv2_cl2_y2_pop1_decimal"
+
+
+class BenchmarkBudgetCommandTestCase(SNTMalariaTestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.baseline_path = os.path.join(temp_dir.name, "baseline.json")
+
+    def _call(self, **options):
+        stdout = StringIO()
+        call_command("benchmark_budget", **SMALL_FIXTURE, **options, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_saves_and_compares_baseline(self):
+        output = self._call(baseline=self.baseline_path, save_baseline=True)
+
+        self.assertIn(f"Baseline {SMALL_PROFILE} saved", output)
+        with open(self.baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)[SMALL_PROFILE]
+        self.assertEqual(
+            set(baseline), {"calculate_all_years", "calculate_grant_costs", "calculate_and_save_all_years"}
+        )
+        for measures in baseline.values():
+            self.assertEqual(set(measures), {"wall_time_s", "queries", "peak_memory_bytes"})
+            self.assertGreater(measures["queries"], 0)
+        # The synthetic data is rolled back.
+        self.assertFalse(Scenario.objects.filter(name__startswith="Benchmark scenario").exists())
+        self.assertFalse(Budget.objects.exists())
+
+        # Timings vary between runs: only the query counts are compared strictly.
+        output = self._call(baseline=self.baseline_path, tolerance=1000)
+
+        self.assertIn(f"No regression against baseline {SMALL_PROFILE}", output)
+
+    def test_reports_query_count_regressions(self):
+        self._call(baseline=self.baseline_path, save_baseline=True)
+        with open(self.baseline_path) as baseline_file:
+            baselines = json.load(baseline_file)
+        baselines[SMALL_PROFILE]["calculate_all_years"]["queries"] = 0
+        with open(self.baseline_path, "w") as baseline_file:
+            json.dump(baselines, baseline_file)
+
+        with self.assertRaisesMessage(CommandError, "calculate_all_years:"):
+            self._call(baseline=self.baseline_path, tolerance=1000)
+
+    def test_rejects_missing_baseline(self):
+        with self.assertRaisesMessage(CommandError, "--save-baseline requires --baseline"):
+            self._call(save_baseline=True)
+        with self.assertRaisesMessage(CommandError, f"No baseline for {SMALL_PROFILE}"):
+            self._call(baseline=self.baseline_path)
@@ -2,6 +2,8 @@ from django.db import IntegrityError
 
 from iaso.models import OrgUnit
 from plugins.snt_malaria.models import (
+    Donor,
+    Grant,
     InterventionAssignment,
     Scenario,
     ScenarioRule,
@@ -111,6 +113,66 @@ class ScenarioModelTestCase(SNTMalariaTestCase):
             InterventionAssignment.objects.filter(rule=self.scenario_rule_1, org_unit=self.org_unit_2).exists()
         )
 
+    def test_refresh_assignments_returns_changes(self):
+        changes = self.scenario.refresh_assignments(self.user)
+
+        self.assertEqual(
+            changes.created,
+            sorted(
+                [
+                    (self.org_unit_1.id, self.intervention_1.id),
+                    (self.org_unit_2.id, self.intervention_2.id),
+                    (self.org_unit_3.id, self.intervention_2.id),
+                ]
+            ),
+        )
+        self.assertEqual(changes.deleted, [])
+        self.assertEqual(changes.updated, [])
+        self.assertEqual(changes.org_unit_ids, {self.org_unit_1.id, self.org_unit_2.id, self.org_unit_3.id})
+
+    def test_refresh_assignments_without_rule_changes_keeps_assignments(self):
+        self.scenario.refresh_assignments(self.user)
+        assignment_ids = set(self.scenario.intervention_assignments.values_list("id", flat=True))
+
+        changes = self.scenario.refresh_assignments(self.user)
+
+        self.assertFalse(changes)
+        self.assertEqual(set(self.scenario.intervention_assignments.values_list("id", flat=True)), assignment_ids)
+
+    def test_refresh_assignments_applies_only_the_difference(self):
+        self.scenario.refresh_assignments(self.user)
+        kept = InterventionAssignment.objects.get(org_unit=self.org_unit_3, intervention=self.intervention_2)
+        # Rule 1 now has the highest priority: it takes org unit 2 over from rule 2.
+        ScenarioRule.objects.filter(id=self.scenario_rule_2.id).update(priority=3)
+        ScenarioRule.objects.filter(id=self.scenario_rule_1.id).update(priority=4)
+
+        changes = self.scenario.refresh_assignments(self.user)
+
+        self.assertEqual(changes.created, [(self.org_unit_2.id, self.intervention_1.id)])
+        self.assertEqual(changes.deleted, [(self.org_unit_2.id, self.intervention_2.id)])
+        self.assertEqual(changes.updated, [])
+        self.assertTrue(InterventionAssignment.objects.filter(id=kept.id, rule=self.scenario_rule_2).exists())
+        self.assertEqual(self.scenario.intervention_assignments.count(), 3)
+
+    def test_refresh_assignments_updates_rule_and_clears_grant_of_kept_assignments(self):
+        self.scenario.refresh_assignments(self.user)
+        donor = Donor.objects.create(account=self.account, name="Donor")
+        grant = Grant.objects.create(account=self.account, donor=donor, name="Grant")
+        assignment = InterventionAssignment.objects.get(org_unit=self.org_unit_1, intervention=self.intervention_1)
+        assignment.grant = grant
+        assignment.save()
+        # Rule 2 now also produces the assignment of org unit 1, with the same intervention.
+        self.scenario_rule_2.interventions.set([self.intervention_1])
+        self.scenario_rule_2.org_units_included = [self.org_unit_1.id]
+        self.scenario_rule_2.save()
+
+        changes = self.scenario.refresh_assignments(self.user)
+
+        self.assertIn((self.org_unit_1.id, self.intervention_1.id), changes.updated)
+        assignment.refresh_from_db()
+        self.assertEqual(assignment.rule, self.scenario_rule_2)
+        self.assertIsNone(assignment.grant)
+
     def test_reuse_soft_deleted_scenario_names(self):
         self.scenario.delete()
         new_scenario = Scenario.objects.create(
@@ -1,6 +1,7 @@
 from django.contrib.gis.geos import Point
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
 
 from iaso.models import Account, DataSource, MetricType, MetricValue, OrgUnit, OrgUnitType, SourceVersion
 from iaso.utils.colors import DEFAULT_COLOR
@@ -8,6 +9,8 @@ from plugins.snt_malaria.models import (
     AccountSettings,
     ScenarioRule,
 )
+from plugins.snt_malaria.services.rules.batch import resolve_rules_matched_org_units
+from plugins.snt_malaria.services.rules.matcher import CompiledMatcher
 from plugins.snt_malaria.tests.common_base import SNTMalariaTestCase
 
 
@@ -693,6 +696,97 @@ class ResolveMatchedOrgUnitsReferenceYearTestCase(SNTMalariaTestCase):
         # No org unit satisfies both conditions, so the intersection is empty.
         self.assertEqual(result, [])
 
+    def test_year_availability_is_resolved_in_one_query_for_all_metric_types(self):
+        other_metric_types = [
+            MetricType.objects.create(account=self.account, name=f"Metric {index}", code=f"M{index}", units="ratio")
+            for index in range(3)
+        ]
+        criteria = {
+            "and": [{">=": [{"var": metric_type.id}, 0]} for metric_type in [self.metric_type, *other_metric_types]]
+        }
+
+        with CaptureQueriesContext(connection) as one_condition:
+            ScenarioRule.resolve_matched_org_units(self.account, self.criteria, reference_year=2025)
+        with CaptureQueriesContext(connection) as four_conditions:
+            ScenarioRule.resolve_matched_org_units(self.account, criteria, reference_year=2025)
+
+        self.assertEqual(len(four_conditions), len(one_condition))
+
+    def test_compiled_matcher_exposes_years_and_sql(self):
+        other_metric_type = MetricType.objects.create(account=self.account, name="ITN", code="ITN", units="ratio")
+        criteria = {
+            "and": [
+                {">=": [{"var": self.metric_type.id}, 50]},
+                {">=": [{"var": other_metric_type.id}, 3]},
+                {"<": [{"var": self.metric_type.id}, 1000]},
+            ]
+        }
+
+        matcher = CompiledMatcher(self.account, criteria, reference_year=2025)
+
+        self.assertEqual(matcher.metric_type_ids, [self.metric_type.id, other_metric_type.id])
+        self.assertEqual(matcher.year_by_metric_type_id, {self.metric_type.id: 2025, other_metric_type.id: None})
+        self.assertIn("EXISTS", matcher.sql.upper())
+        self.assertIn("2025", matcher.sql)
+        self.assertEqual(matcher.org_unit_ids(), [])
+
+    def _create_rules(self, criteria_list):
+        scenario = self.create_snt_scenario(self.account, self.user)
+        return [
+            ScenarioRule.objects.create(
+                scenario=scenario,
+                name=f"Rule {priority}",
+                priority=priority,
+                matching_criteria=criteria,
+                created_by=self.user,
+            )
+            for priority, criteria in enumerate(criteria_list, start=1)
+        ]
+
+    def test_batch_resolution_matches_per_rule_resolution(self):
+        other_metric_type = MetricType.objects.create(account=self.account, name="ITN", code="ITN", units="ratio")
+        MetricValue.objects.create(metric_type=other_metric_type, org_unit=self.org_unit_1, value=2, year=2025)
+        MetricValue.objects.create(metric_type=other_metric_type, org_unit=self.org_unit_2, value=5, year=None)
+        rules = self._create_rules(
+            [
+                self.criteria,
+                {"and": [{"<": [{"var": self.metric_type.id}, 90]}, {">": [{"var": other_metric_type.id}, 1]}]},
+                {"and": [{"==": [{"var": other_metric_type.id}, 5]}]},
+                {"and": [{"==": [{"var": other_metric_type.id}, "5"]}]},
+                {"all": True},
+                None,
+            ]
+        )
+
+        for reference_year in (2025, 2030, None):
+            with self.subTest(reference_year=reference_year):
+                expected = {
+                    rule.id: sorted(
+                        ScenarioRule.resolve_matched_org_units(
+                            self.account, rule.matching_criteria, reference_year=reference_year
+                        )
+                    )
+                    for rule in rules
+                }
+                self.assertEqual(
+                    resolve_rules_matched_org_units(self.account, rules, reference_year=reference_year), expected
+                )
+
+    def test_batch_resolution_query_count_does_not_depend_on_rule_count(self):
+        one_rule = self._create_rules([self.criteria])
+        many_rules = self._create_rules(
+            [{"and": [{">=": [{"var": self.metric_type.id}, threshold]}]} for threshold in (0, 50, 90, 150)]
+            + [{"all": True}, None]
+        )
+
+        with CaptureQueriesContext(connection) as one:
+            resolve_rules_matched_org_units(self.account, one_rule, reference_year=2025)
+        with CaptureQueriesContext(connection) as many:
+            result = resolve_rules_matched_org_units(self.account, many_rules, reference_year=2025)
+
+        self.assertEqual(len(many), len(one))
+        self.assertEqual([result[rule.id] for rule in many_rules[:4]], [[self.org_unit_1.id]] * 3 + [[]])
+
     def test_match_all_ignores_reference_year(self):
         """matching_criteria={"all": True} returns before any reference_year filtering is applied."""
         result = ScenarioRule.resolve_matched_org_units(self.account, {"all": True}, reference_year=2030)
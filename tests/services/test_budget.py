@@ -1,20 +1,36 @@
+import json
+
 from decimal import Decimal
+from unittest.mock import patch
 
-from iaso.models import MetricType, MetricValue
+from iaso.models import MetricType, MetricValue, OrgUnit
 from plugins.snt_malaria.models import (
+    AccountSettings,
+    Budget,
     BudgetSettings,
+    Donor,
+    Grant,
     InterventionAssignment,
     InterventionCostBreakdownLine,
     ScenarioYearlyCostAssignment,
 )
 from plugins.snt_malaria.models.cost_unit_type import CostUnitType
 from plugins.snt_malaria.services import BudgetCalculationService
+from plugins.snt_malaria.services.budget.grants import grant_utilization
+from plugins.snt_malaria.services.budget.inputs import clear_inputs_cache
+from plugins.snt_malaria.services.budget.population import clear_population_cache, load_population
+from plugins.snt_malaria.services.budget.preview import preview_budget
+from plugins.snt_malaria.services.budget.rollups import clear_rollup_indexes
+from plugins.snt_malaria.services.budget.sensitivity import BudgetSensitivityAnalysis
 from plugins.snt_malaria.tests.common_base import SNTMalariaTestCase
 
 
 class BudgetCalculationServiceTestCase(SNTMalariaTestCase):
     def setUp(self):
         super().setUp()
+        clear_population_cache()
+        clear_rollup_indexes()
+        clear_inputs_cache()
 
         self.scenario = self.create_snt_scenario(self.account, self.user, start_year=2025, end_year=2026)
         defaults = self.create_snt_default_interventions_setup(
@@ -443,3 +459,558 @@ class BudgetCalculationServiceTestCase(SNTMalariaTestCase):
         self.assertEqual(len(result.interventions), 0)
         self.assertEqual(len(result.org_units_costs), 0)
         self.assertEqual(len(result.category_costs), 0)
+
+    def assertBudgetDumpAlmostEqual(self, actual, expected, path="result"):
+        """Compare two model_dump(mode="json") structures, allowing float rounding differences."""
+        if isinstance(expected, dict):
+            self.assertEqual(set(actual), set(expected), path)
+            for key, value in expected.items():
+                self.assertBudgetDumpAlmostEqual(actual[key], value, f"{path}.{key}")
+        elif isinstance(expected, list):
+            self.assertEqual(len(actual), len(expected), path)
+            for index, (actual_item, expected_item) in enumerate(zip(actual, expected)):
+                self.assertBudgetDumpAlmostEqual(actual_item, expected_item, f"{path}[{index}]")
+        elif isinstance(expected, float):
+            self.assertAlmostEqual(actual, expected, places=5, msg=path)
+        else:
+            self.assertEqual(actual, expected, path)
+
+    def test_vectorized_engine_matches_decimal_engine(self):
+        fixed_line = InterventionCostBreakdownLine.objects.create(
+            intervention=self.intervention_smc,
+            name="SMC fixed cost",
+            category=InterventionCostBreakdownLine.InterventionCostBreakdownLineCategory.OPERATIONAL,
+            unit_type=self.unit_type,
+            population_layer=None,
+            unit_cost=Decimal("100.00"),
+            created_by=self.user,
+        )
+        ScenarioYearlyCostAssignment.objects.create(
+            scenario=self.scenario, cost_line=fixed_line, year=2026, value=Decimal("3")
+        )
+        self.population_line.conversion_factor = Decimal("3")
+        self.population_line.invert_conversion_factor = True
+        self.population_line.save(update_fields=["conversion_factor", "invert_conversion_factor"])
+
+        decimal_results = BudgetCalculationService(self.scenario).calculate_all_years()
+        vectorized_results = BudgetCalculationService(
+            self.scenario, engine=BudgetCalculationService.ENGINE_VECTORIZED
+        ).calculate_all_years()
+
+        self.assertEqual(len(vectorized_results), 2)
+        for vectorized_result, decimal_result in zip(vectorized_results, decimal_results):
+            self.assertBudgetDumpAlmostEqual(
+                vectorized_result.model_dump(mode="json"), decimal_result.model_dump(mode="json")
+            )
+
+    def test_vectorized_engine_totals_are_sums_of_their_parts(self):
+        service = BudgetCalculationService(self.scenario, engine=BudgetCalculationService.ENGINE_VECTORIZED)
+
+        result = service.calculate_year(2025)
+
+        self.assertEqual(result.total_cost, Decimal("3960"))
+        self.assertEqual(result.total_cost, sum(item.total_cost for item in result.interventions))
+        for org_unit in result.org_units_costs:
+            self.assertEqual(org_unit.total_cost, sum(item.total_cost for item in org_unit.interventions))
+
+    def test_vectorized_engine_without_assignments(self):
+        InterventionAssignment.objects.all().delete()
+        service = BudgetCalculationService(self.scenario, engine=BudgetCalculationService.ENGINE_VECTORIZED)
+
+        result = service.calculate_year(2025)
+
+        self.assertEqual(result.total_cost, 0)
+        self.assertEqual(result.interventions, [])
+        self.assertEqual(result.org_units_costs, [])
+        self.assertEqual(result.category_costs, [])
+
+    def test_json_results_match_model_dump(self):
+        fixed_line = InterventionCostBreakdownLine.objects.create(
+            intervention=self.intervention_smc,
+            name="SMC fixed cost",
+            category=InterventionCostBreakdownLine.InterventionCostBreakdownLineCategory.OPERATIONAL,
+            unit_type=self.unit_type,
+            population_layer=None,
+            unit_cost=Decimal("100.00"),
+            created_by=self.user,
+        )
+        ScenarioYearlyCostAssignment.objects.create(
+            scenario=self.scenario, cost_line=fixed_line, year=2026, value=Decimal("3")
+        )
+
+        for engine in BudgetCalculationService.ENGINES:
+            with self.subTest(engine=engine):
+                service = BudgetCalculationService(self.scenario, engine=engine)
+
+                json_results = service.calculate_all_years_json()
+
+                expected = [result.model_dump(mode="json") for result in service.calculate_all_years()]
+                self.assertEqual(json.dumps(json_results), json.dumps(expected))
+
+    def test_unknown_engine_raises(self):
+        with self.assertRaises(ValueError):
+            BudgetCalculationService(self.scenario, engine="unknown")
+
+    def test_line_rows_are_computed_once_per_service(self):
+        service = BudgetCalculationService(self.scenario)
+
+        with patch.object(service, "_compute_line_rows", wraps=service._compute_line_rows) as compute_line_rows:
+            service.calculate_all_years()
+            grant_costs = service.calculate_grant_costs()
+
+        compute_line_rows.assert_called_once()
+        self.assertEqual(sum(item.total_cost for item in grant_costs), 3960 + 4532)
+
+    def test_get_line_rows_filters_by_year(self):
+        service = BudgetCalculationService(self.scenario)
+
+        rows_2025 = service.get_line_rows(2025)
+
+        self.assertEqual(len(rows_2025), 2)
+        self.assertTrue(all(row.year == 2025 for row in rows_2025))
+        self.assertEqual(len(service.get_line_rows()), 4)
+        self.assertEqual(service.get_line_rows(2030), [])
+
+    def test_vectorized_engine_grant_costs_match_decimal_engine(self):
+        decimal_costs = BudgetCalculationService(self.scenario).calculate_grant_costs()
+        vectorized_costs = BudgetCalculationService(
+            self.scenario, engine=BudgetCalculationService.ENGINE_VECTORIZED
+        ).calculate_grant_costs()
+
+        self.assertBudgetDumpAlmostEqual(
+            [item.model_dump(mode="json") for item in vectorized_costs],
+            [item.model_dump(mode="json") for item in decimal_costs],
+        )
+
+    def test_recalculate_cost_line_year_patches_latest_budget(self):
+        budget = BudgetCalculationService(self.scenario).calculate_and_save_all_years(self.user)
+        yearly_cost = ScenarioYearlyCostAssignment.objects.get(
+            scenario=self.scenario, cost_line=self.population_line, year=2025
+        )
+        yearly_cost.value = Decimal("2.00")
+        yearly_cost.save()
+
+        patched = BudgetCalculationService.recalculate_cost_line_year(
+            self.scenario, self.population_line.id, 2025, self.user
+        )
+
+        self.assertEqual(patched.id, budget.id)
+        self.assertEqual(Budget.objects.filter(scenario=self.scenario).count(), 1)
+        full_results = [
+            result.model_dump(mode="json") for result in BudgetCalculationService(self.scenario).calculate_all_years()
+        ]
+        patched.refresh_from_db()
+        self.assertBudgetDumpAlmostEqual(patched.results, full_results)
+        # 2025: (1000 + 2000) * 2.0 * 0.5 * 1.1 = 3300 qty → 3300 * 2 = 6600
+        self.assertAlmostEqual(patched.results[0]["total_cost"], 6600.0)
+
+    def test_recalculate_cost_line_year_updates_category_ids(self):
+        # A fixed procurement cost of SMC: its row comes with the first SMC assignment, before the population rows.
+        fixed_line = InterventionCostBreakdownLine.objects.create(
+            intervention=self.intervention_smc,
+            name="SMC fixed procurement",
+            category=InterventionCostBreakdownLine.InterventionCostBreakdownLineCategory.PROCUREMENT,
+            unit_type=self.unit_type,
+            population_layer=None,
+            unit_cost=Decimal("100.00"),
+            created_by=self.user,
+        )
+        ScenarioYearlyCostAssignment.objects.create(
+            scenario=self.scenario, cost_line=fixed_line, year=2025, value=Decimal("1")
+        )
+        budget = BudgetCalculationService(self.scenario).calculate_and_save_all_years(self.user)
+        self.assertEqual(budget.results[0]["category_costs"][0]["id"], self.population_line.id)
+        ScenarioYearlyCostAssignment.objects.filter(
+            scenario=self.scenario, cost_line=self.population_line, year=2025
+        ).update(value=Decimal("0"))
+
+        patched = BudgetCalculationService.recalculate_cost_line_year(
+            self.scenario, self.population_line.id, 2025, self.user
+        )
+
+        # Without population rows, the fixed cost line is the last procurement row of 2025.
+        self.assertEqual(patched.results[0]["category_costs"][0]["id"], fixed_line.id)
+        full_results = [
+            result.model_dump(mode="json") for result in BudgetCalculationService(self.scenario).calculate_all_years()
+        ]
+        self.assertBudgetDumpAlmostEqual(patched.results, full_results)
+
+    def test_recalculate_cost_line_year_creates_budget_when_none_exists(self):
+        budget = BudgetCalculationService.recalculate_cost_line_year(
+            self.scenario, self.population_line.id, 2025, self.user
+        )
+
+        self.assertEqual(Budget.objects.filter(scenario=self.scenario).count(), 1)
+        self.assertEqual([result["year"] for result in budget.results], [2025, 2026])
+
+    def test_recalculate_cost_line_year_recomputes_budget_without_lines(self):
+        # A budget stored before budget lines existed.
+        legacy_budget = BudgetCalculationService(self.scenario).calculate_and_save_all_years(self.user)
+        legacy_budget.lines.all().delete()
+        Budget.objects.filter(id=legacy_budget.id).update(input_fingerprint="")
+
+        budget = BudgetCalculationService.recalculate_cost_line_year(
+            self.scenario, self.population_line.id, 2025, self.user
+        )
+
+        self.assertNotEqual(budget.id, legacy_budget.id)
+        self.assertEqual(sorted(set(budget.lines.values_list("year", flat=True))), [2025, 2026])
+        self.assertAlmostEqual(
+            float(sum(budget.lines.values_list("cost", flat=True))),
+            sum(result["total_cost"] for result in budget.results),
+            places=4,
+        )
+
+    def test_recalculate_cost_line_year_falls_back_to_full_recompute_on_mismatch(self):
+        budget = BudgetCalculationService(self.scenario).calculate_and_save_all_years(self.user)
+
+        with patch(
+            "plugins.snt_malaria.services.budget.budget_calculation.results_match", return_value=False
+        ) as results_match:
+            BudgetCalculationService.recalculate_cost_line_year(
+                self.scenario, self.population_line.id, 2025, self.user, verify=True
+            )
+
+        results_match.assert_called_once()
+        budget.refresh_from_db()
+        full_results = [
+            result.model_dump(mode="json") for result in BudgetCalculationService(self.scenario).calculate_all_years()
+        ]
+        self.assertBudgetDumpAlmostEqual(budget.results, full_results)
+
+    def test_calculate_and_save_reuses_latest_budget_when_inputs_are_unchanged(self):
+        budget = BudgetCalculationService(self.scenario).calculate_and_save_all_years(self.user)
+
+        with patch.object(BudgetCalculationService, "calculate_all_years") as calculate_all_years:
+            reused = BudgetCalculationService(self.scenario).calculate_and_save_all_years(self.user)
+
+        calculate_all_years.assert_not_called()
+        self.assertEqual(reused.id, budget.id)
+        self.assertEqual(Budget.objects.filter(scenario=self.scenario).count(), 1)
+        self.assertEqual(len(budget.input_fingerprint), 64)
+
+    def test_input_fingerprint_changes_with_inputs(self):
+        fingerprint = BudgetCalculationService(self.scenario).input_fingerprint()
+
+        ScenarioYearlyCostAssignment.objects.filter(scenario=self.scenario).update(value=Decimal("1.30"))
+        yearly_value_fingerprint = BudgetCalculationService(self.scenario).input_fingerprint()
+        self.assertNotEqual(yearly_value_fingerprint, fingerprint)
+
+        MetricValue.objects.filter(org_unit=self.district_1, year=2026).update(value=Decimal("1600"))
+        population_fingerprint = BudgetCalculationService(self.scenario).input_fingerprint()
+        self.assertNotEqual(population_fingerprint, yearly_value_fingerprint)
+
+        BudgetSettings.objects.filter(account=self.account).update(buffer=Decimal("1.2"))
+        self.assertNotEqual(BudgetCalculationService(self.scenario).input_fingerprint(), population_fingerprint)
+
+    def test_calculate_and_save_recomputes_when_inputs_change(self):
+        budget = BudgetCalculationService(self.scenario).calculate_and_save_all_years(self.user)
+
+        self.population_line.unit_cost = Decimal("3.00")
+        self.population_line.save()
+        recomputed = BudgetCalculationService(self.scenario).calculate_and_save_all_years(self.user)
+
+        self.assertNotEqual(recomputed.id, budget.id)
+        self.assertNotEqual(recomputed.input_fingerprint, budget.input_fingerprint)
+
+    def test_for_scenarios_loads_shared_inputs_once(self):
+        other_scenario = self.create_snt_scenario(self.account, self.user, start_year=2026, end_year=2027)
+        self.create_snt_assignment(other_scenario, self.district_2, self.intervention_smc, created_by=self.user)
+        third_scenario = self.create_snt_scenario(self.account, self.user, start_year=2025, end_year=2025)
+        scenarios = [self.scenario, other_scenario, third_scenario]
+
+        # Assignments, cost lines, population (data version and rows), yearly values and settings.
+        with self.assertNumQueries(6):
+            services = BudgetCalculationService.for_scenarios(scenarios)
+
+        for scenario, service in zip(scenarios, services):
+            expected = BudgetCalculationService(scenario)
+            self.assertIs(service.population, services[0].population)
+            self.assertEqual(service.yearly_value_by_key, expected.yearly_value_by_key)
+            self.assertEqual(service.input_fingerprint(), expected.input_fingerprint())
+            self.assertEqual(
+                [result.model_dump(mode="json") for result in service.calculate_all_years()],
+                [result.model_dump(mode="json") for result in expected.calculate_all_years()],
+            )
+
+    def test_population_lookup_matches_metric_values(self):
+        population = load_population([self.metric_under_5.id], 2025, 2026)
+
+        self.assertEqual(population.get(self.district_1.id, 2025, self.metric_under_5.id), Decimal("1000.0"))
+        self.assertEqual(population.get(self.district_2.id, 2026, self.metric_under_5.id), Decimal("2500.0"))
+        self.assertIsNone(population.get(self.district_1.id, 2027, self.metric_under_5.id))
+        self.assertIsNone(population.get(self.district_1.id, 2025, self.metric_population.id))
+        dense = population.dense([self.metric_under_5.id], [self.district_2.id, self.district_1.id], 2024, 2025)
+        self.assertEqual(dense.tolist(), [[[0.0, 2000.0], [0.0, 1000.0]]])
+
+    def test_population_lookup_is_shared_until_metric_values_change(self):
+        first = BudgetCalculationService(self.scenario)
+        # Only the data version of the population rows is queried, not the rows themselves.
+        with self.assertNumQueries(5):
+            second = BudgetCalculationService(self.scenario)
+        self.assertIs(second.population, first.population)
+
+        MetricValue.objects.filter(metric_type=self.metric_under_5, org_unit=self.district_1, year=2025).update(
+            value=1100
+        )
+        third = BudgetCalculationService(self.scenario)
+
+        self.assertIsNot(third.population, first.population)
+        self.assertEqual(third.calculate_year(2025).total_cost, Decimal("4092"))
+        self.assertNotEqual(third.input_fingerprint(), first.input_fingerprint())
+
+    def test_population_lookup_reloads_when_values_move_between_years_or_layers(self):
+        metric_type_ids = [self.metric_under_5.id, self.metric_population.id]
+        first = load_population(metric_type_ids, 2025, 2026)
+
+        # Swapping the values of two years keeps the count, ids, total and per org unit totals.
+        district_1_values = MetricValue.objects.filter(metric_type=self.metric_under_5, org_unit=self.district_1)
+        district_1_values.filter(year=2025).update(value=1500)
+        district_1_values.filter(year=2026).update(value=1000)
+        second = load_population(metric_type_ids, 2025, 2026)
+
+        self.assertIsNot(second, first)
+        self.assertEqual(second.get(self.district_1.id, 2025, self.metric_under_5.id), Decimal("1500.0"))
+
+        MetricValue.objects.filter(metric_type=self.metric_under_5, org_unit=self.district_2, year=2026).update(
+            metric_type=self.metric_population
+        )
+        third = load_population(metric_type_ids, 2025, 2026)
+
+        self.assertIsNot(third, second)
+        self.assertEqual(third.get(self.district_2.id, 2026, self.metric_population.id), Decimal("2500.0"))
+        self.assertIsNone(third.get(self.district_2.id, 2026, self.metric_under_5.id))
+
+    def test_sensitivity_base_matches_budget(self):
+        service = BudgetCalculationService(self.scenario, engine=BudgetCalculationService.ENGINE_VECTORIZED)
+
+        result = BudgetSensitivityAnalysis(service).run(draws=50, seed=1)
+
+        # Without distributions every draw is the current budget.
+        for year_result, budget_year in zip(result.years, service.calculate_all_years()):
+            self.assertAlmostEqual(year_result.total_cost.base, float(budget_year.total_cost), places=4)
+            self.assertAlmostEqual(year_result.total_cost.mean, float(budget_year.total_cost), places=4)
+
+    def test_sensitivity_scales_inverted_conversion_factor(self):
+        self.population_line.conversion_factor = Decimal("2")
+        self.population_line.invert_conversion_factor = True
+        self.population_line.save(update_fields=["conversion_factor", "invert_conversion_factor"])
+        service = BudgetCalculationService(self.scenario, engine=BudgetCalculationService.ENGINE_VECTORIZED)
+
+        result = BudgetSensitivityAnalysis(service).run(
+            draws=5, conversion_factor={"default": {"distribution": "fixed", "value": 2}}
+        )
+
+        # The conversion factor doubles to 4, so the inverted ratio halves: 3960 / 2 in 2025.
+        self.assertAlmostEqual(result.years[0].total_cost.mean, 1980.0, places=4)
+
+    def _set_up_region(self):
+        region_type = self.create_snt_org_unit_type(name="REGION")
+        region = self.create_snt_org_unit(org_unit_type=region_type, name="Region")
+        OrgUnit.objects.filter(id__in=[self.district_1.id, self.district_2.id]).update(parent=region)
+        AccountSettings.objects.update_or_create(account=self.account, defaults={"focus_org_unit_type": region_type})
+        return region
+
+    def test_org_unit_rollups_at_focus_level(self):
+        region = self._set_up_region()
+
+        for engine in BudgetCalculationService.ENGINES:
+            with self.subTest(engine=engine):
+                result = BudgetCalculationService(self.scenario, engine=engine).calculate_year(2025)
+
+                (rollup,) = result.org_unit_rollups
+                self.assertEqual(rollup.org_unit_id, region.id)
+                self.assertEqual(rollup.total_cost, Decimal("3960"))
+                (intervention,) = rollup.interventions
+                self.assertEqual(intervention.id, self.intervention_smc.id)
+                self.assertEqual(intervention.cost_breakdown[0].population, Decimal("3000"))
+
+    def test_org_unit_rollups_without_focus_org_unit_type(self):
+        result = BudgetCalculationService(self.scenario).calculate_year(2025)
+
+        self.assertEqual(result.org_unit_rollups, [])
+
+    def test_org_unit_rollups_leave_out_org_units_outside_focus_level(self):
+        region = self._set_up_region()
+        OrgUnit.objects.filter(id=self.district_2.id).update(parent=None)
+
+        result = BudgetCalculationService(self.scenario).calculate_year(2025)
+
+        (rollup,) = result.org_unit_rollups
+        self.assertEqual(rollup.org_unit_id, region.id)
+        self.assertEqual(rollup.total_cost, Decimal("1320"))
+
+    def test_input_fingerprint_changes_with_focus_org_unit_type(self):
+        fingerprint = BudgetCalculationService(self.scenario).input_fingerprint()
+
+        self._set_up_region()
+
+        self.assertNotEqual(BudgetCalculationService(self.scenario).input_fingerprint(), fingerprint)
+
+    def test_preview_without_overrides_matches_budget(self):
+        expected = BudgetCalculationService(
+            self.scenario, engine=BudgetCalculationService.ENGINE_VECTORIZED
+        ).calculate_all_years_json()
+
+        self.assertEqual(preview_budget(self.scenario), expected)
+
+    def test_preview_reuses_cached_inputs(self):
+        preview_budget(self.scenario)
+
+        # Only the inputs version (6 aggregate queries) and the focus org unit type of the rollups are read.
+        with self.assertNumQueries(7):
+            results = preview_budget(
+                self.scenario, cost_lines=[{"id": self.population_line.id, "unit_cost": Decimal("4.00")}]
+            )
+
+        self.assertAlmostEqual(results[0]["total_cost"], 7920.0, places=4)
+
+    def test_preview_applies_cost_line_and_yearly_value_overrides(self):
+        results = preview_budget(
+            self.scenario,
+            cost_lines=[{"id": self.population_line.id, "unit_cost": Decimal("4.00")}],
+            yearly_values=[{"cost_line_id": self.population_line.id, "year": 2026, "value": Decimal("2.00")}],
+        )
+
+        # 2026: 4000 * 0.5 * 1.1 * 4 * 2 * 1.03 inflation.
+        self.assertAlmostEqual(results[0]["total_cost"], 7920.0, places=4)
+        self.assertAlmostEqual(results[1]["total_cost"], 18128.0, places=4)
+        # Nothing is stored and the cached inputs are left untouched.
+        self.assertFalse(Budget.objects.filter(scenario=self.scenario).exists())
+        self.assertAlmostEqual(preview_budget(self.scenario)[0]["total_cost"], 3960.0, places=4)
+        self.population_line.refresh_from_db()
+        self.assertEqual(self.population_line.unit_cost, Decimal("2.00"))
+
+    def test_preview_adds_and_removes_assignments(self):
+        intervention = self.create_snt_intervention(
+            intervention_category=self.intervention_smc.intervention_category, code="new"
+        )
+        InterventionCostBreakdownLine.objects.create(
+            intervention=intervention,
+            name="New intervention procurement",
+            category=InterventionCostBreakdownLine.InterventionCostBreakdownLineCategory.PROCUREMENT,
+            unit_type=self.unit_type,
+            population_layer=self.metric_under_5,
+            is_proportional=True,
+            unit_cost=Decimal("1.00"),
+            created_by=self.user,
+        )
+
+        results = preview_budget(
+            self.scenario,
+            add_assignments=[{"intervention": intervention, "org_unit_ids": [self.district_2.id]}],
+            remove_assignments=[{"intervention": self.intervention_smc, "org_unit_ids": [self.district_2.id]}],
+        )
+
+        # SMC in district 1: 1320; new intervention in district 2: 2000 * 1.1 * 1.
+        self.assertEqual(results[0]["total_cost"], 3520.0)
+        self.assertEqual(
+            {
+                intervention_item["code"]: intervention_item["total_cost"]
+                for intervention_item in results[0]["interventions"]
+            },
+            {"smc": 1320.0, "new": 2200.0},
+        )
+        self.assertEqual(InterventionAssignment.objects.filter(intervention=intervention).count(), 0)
+
+    def test_preview_reloads_inputs_when_inputs_change(self):
+        preview_budget(self.scenario)
+        InterventionCostBreakdownLine.objects.filter(id=self.population_line.id).update(unit_cost=Decimal("4.00"))
+
+        # 2025: 1000 * 0.5 * 1.1 * 4 * 1.2 + 2000 * 0.5 * 1.1 * 4 * 1.2.
+        self.assertAlmostEqual(preview_budget(self.scenario)[0]["total_cost"], 7920.0, places=4)
+
+        BudgetSettings.objects.filter(account=self.account).update(buffer=Decimal("1.0"))
+
+        self.assertAlmostEqual(preview_budget(self.scenario)[0]["total_cost"], 7200.0, places=4)
+
+        InterventionAssignment.objects.filter(scenario=self.scenario, org_unit=self.district_2).delete()
+
+        self.assertAlmostEqual(preview_budget(self.scenario)[0]["total_cost"], 2400.0, places=4)
+
+        MetricValue.objects.filter(metric_type=self.metric_under_5, org_unit=self.district_1, year=2025).update(
+            value=2000
+        )
+
+        self.assertAlmostEqual(preview_budget(self.scenario)[0]["total_cost"], 4800.0, places=4)
+
+    def _set_up_grant(self):
+        donor = Donor.objects.create(account=self.account, name="Global Fund")
+        grant = Grant.objects.create(account=self.account, donor=donor, name="NFM4", amount=Decimal("10000.00"))
+        self.intervention_smc.grant = grant
+        self.intervention_smc.save(update_fields=["grant"])
+        return grant
+
+    def test_saved_budget_stores_grant_totals(self):
+        grant = self._set_up_grant()
+        service = BudgetCalculationService(self.scenario)
+
+        budget = service.calculate_and_save_all_years(self.user)
+
+        expected = {
+            (item.grant_id, year_cost.year): year_cost.total_cost
+            for item in service.calculate_grant_costs()
+            for year_cost in item.yearly_costs
+        }
+        stored = {(total.grant_id, total.year): total.cost for total in budget.grant_totals.all()}
+        self.assertEqual(stored, expected)
+        # 2025: 3960; 2026: 4000 * 0.5 * 1.1 * 2 * 1.03 = 4532.
+        self.assertEqual(stored, {(grant.id, 2025): Decimal("3960"), (grant.id, 2026): Decimal("4532")})
+
+    def test_recalculate_cost_line_year_updates_grant_totals(self):
+        grant = self._set_up_grant()
+        BudgetCalculationService(self.scenario).calculate_and_save_all_years(self.user)
+        ScenarioYearlyCostAssignment.objects.filter(
+            scenario=self.scenario, cost_line=self.population_line, year=2025
+        ).update(value=Decimal("2.00"))
+
+        budget = BudgetCalculationService.recalculate_cost_line_year(
+            self.scenario, self.population_line.id, 2025, self.user
+        )
+
+        self.assertEqual(budget.grant_totals.get(grant=grant, year=2025).cost, Decimal("6600"))
+        self.assertEqual(budget.grant_totals.get(grant=grant, year=2026).cost, Decimal("4532"))
+
+    def test_grant_utilization_of_latest_budgets(self):
+        grant = self._set_up_grant()
+        BudgetCalculationService(self.scenario).calculate_and_save_all_years(self.user)
+        ScenarioYearlyCostAssignment.objects.filter(
+            scenario=self.scenario, cost_line=self.population_line, year=2025
+        ).update(value=Decimal("2.00"))
+        latest_budget = BudgetCalculationService(self.scenario).calculate_and_save_all_years(self.user)
+        other_scenario = self.create_snt_scenario(self.account, self.user, start_year=2025, end_year=2025)
+        self.create_snt_assignment(other_scenario, self.district_1, self.intervention_smc, created_by=self.user)
+        other_budget = BudgetCalculationService(other_scenario).calculate_and_save_all_years(self.user)
+
+        with self.assertNumQueries(1):
+            (item,) = grant_utilization(self.account)
+
+        self.assertEqual(item.grant_id, grant.id)
+        self.assertEqual(item.amount, Decimal("10000.00"))
+        by_scenario_id = {scenario.scenario_id: scenario for scenario in item.scenarios}
+        self.assertEqual(set(by_scenario_id), {self.scenario.id, other_scenario.id})
+        # Only the latest budget of the scenario counts: 6600 + 4532.
+        self.assertEqual(by_scenario_id[self.scenario.id].budget_id, latest_budget.id)
+        self.assertEqual(by_scenario_id[self.scenario.id].total_cost, Decimal("11132"))
+        self.assertEqual(by_scenario_id[self.scenario.id].remaining, Decimal("-1132"))
+        self.assertAlmostEqual(by_scenario_id[self.scenario.id].utilization, 1.1132)
+        # District 1 only, without a yearly value: 1000 * 0.5 * 1.1 * 2.
+        self.assertEqual(by_scenario_id[other_scenario.id].budget_id, other_budget.id)
+        self.assertEqual(by_scenario_id[other_scenario.id].total_cost, Decimal("1100"))
+
+    def test_grant_utilization_lists_budgets_without_totals(self):
+        grant = self._set_up_grant()
+        legacy_budget = BudgetCalculationService(self.scenario).calculate_and_save_all_years(self.user)
+        # Budgets stored before budget lines existed have neither lines, grant totals nor fingerprint.
+        legacy_budget.lines.all().delete()
+        legacy_budget.grant_totals.all().delete()
+        Budget.objects.filter(id=legacy_budget.id).update(input_fingerprint="")
+
+        with self.assertNumQueries(1):
+            (item,) = grant_utilization(self.account)
+
+        self.assertEqual(item.grant_id, grant.id)
+        self.assertEqual(item.scenarios, [])
+        self.assertEqual(item.scenario_ids_without_totals, [self.scenario.id])
+        # Reading utilization does not recompute anything.
+        self.assertEqual(list(Budget.objects.filter(scenario=self.scenario)), [legacy_budget])
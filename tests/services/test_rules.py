@@ -0,0 +1,84 @@
+from iaso.models import OrgUnit
+from plugins.snt_malaria.models import ScenarioRule
+from plugins.snt_malaria.services.rules.resolution import OrgUnitIndex, resolve_assignments
+from plugins.snt_malaria.tests.common_base import SNTMalariaTestCase
+
+
+class RuleResolutionTestCase(SNTMalariaTestCase):
+    auto_create_account = False
+
+    def setUp(self):
+        super().setUp()
+        self.account, self.user = self.create_snt_account(name="account")
+        self.scenario = self.create_snt_scenario(self.account, self.user)
+        self.org_units = [OrgUnit.objects.create(name=f"Org Unit {index}") for index in range(5)]
+        self.category_chemo = self.create_snt_intervention_category(account=self.account, name="Chemoprevention")
+        self.category_vaccination = self.create_snt_intervention_category(account=self.account, name="Vaccination")
+        self.smc = self.create_snt_intervention(intervention_category=self.category_chemo, name="SMC")
+        self.iptp = self.create_snt_intervention(intervention_category=self.category_chemo, name="IPTp")
+        self.rts = self.create_snt_intervention(intervention_category=self.category_vaccination, name="RTS")
+
+    def _create_rule(self, priority, interventions, matched=(), excluded=(), included=(), matching_criteria=True):
+        rule = ScenarioRule.objects.create(
+            scenario=self.scenario,
+            name=f"Rule {priority}",
+            priority=priority,
+            matching_criteria={"all": True} if matching_criteria else None,
+            org_units_matched=[self.org_units[index].id for index in matched],
+            org_units_excluded=[self.org_units[index].id for index in excluded],
+            org_units_included=[self.org_units[index].id for index in included],
+            created_by=self.user,
+        )
+        rule.interventions.set(interventions)
+        return rule
+
+    def _resolve(self):
+        return resolve_assignments(self.scenario.rules.order_by("-priority").prefetch_related("interventions"))
+
+    def test_org_unit_index(self):
+        index = OrgUnitIndex([30, 10, 20, 10])
+
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.mask([20, 30]).tolist(), [False, True, True])
+        self.assertEqual(index.org_unit_ids(index.mask([10])), [10])
+        self.assertEqual(index.mask([]).tolist(), [False, False, False])
+
+    def test_resolve_assignments_applies_exclusions_inclusions_and_shadowing(self):
+        low = self._create_rule(1, [self.smc, self.rts], matched=[0, 1, 2, 3])
+        high = self._create_rule(2, [self.iptp], matched=[1, 2], excluded=[2], included=[4])
+        inclusion_only = self._create_rule(3, [self.rts], matched=[0], included=[3], matching_criteria=False)
+
+        ids = [org_unit.id for org_unit in self.org_units]
+        self.assertEqual(
+            self._resolve(),
+            {
+                # Rule 3 only includes org unit 3: its criteria-less matches are ignored.
+                (ids[3], self.rts.id): inclusion_only.id,
+                (ids[1], self.iptp.id): high.id,
+                (ids[4], self.iptp.id): high.id,
+                # IPTp shadows SMC (same category) on org unit 1, rule 3 shadows RTS on org unit 3.
+                (ids[0], self.smc.id): low.id,
+                (ids[2], self.smc.id): low.id,
+                (ids[3], self.smc.id): low.id,
+                (ids[0], self.rts.id): low.id,
+                (ids[1], self.rts.id): low.id,
+                (ids[2], self.rts.id): low.id,
+            },
+        )
+
+    def test_resolve_assignments_matches_rule_target_assignments(self):
+        self._create_rule(1, [self.smc, self.iptp], matched=[0, 1, 2], excluded=[1])
+        self._create_rule(2, [self.iptp, self.rts], matched=[2, 3], included=[0])
+        self._create_rule(3, [self.smc], included=[4], matching_criteria=False)
+        self._create_rule(4, [], matched=[0, 1, 2, 3, 4])
+
+        expected = {}
+        previous_assignments = {}
+        for rule in self.scenario.rules.order_by("-priority"):
+            for key in rule.get_target_assignments(previous_assignments):
+                expected[key] = rule.id
+
+        self.assertEqual(self._resolve(), expected)
+
+    def test_resolve_assignments_without_rules(self):
+        self.assertEqual(resolve_assignments([]), {})
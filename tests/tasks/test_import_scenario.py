@@ -0,0 +1,158 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
+
+from iaso.models import OrgUnit, Task
+from iaso.permissions.core_permissions import CORE_DATA_TASKS_PERMISSION
+from iaso.tests.tasks.task_api_test_case import TaskAPITestCase
+from plugins.snt_malaria.models import Scenario, ScenarioImport
+from plugins.snt_malaria.tasks.import_scenario import (
+    IMPORT_SCENARIO_TASK_NAME,
+    STALE_IMPORT_AFTER,
+    is_scenario_import_running,
+    launch_scenario_import,
+)
+from plugins.snt_malaria.tests.common_base import SNTMalariaTestMixin
+
+
+class ImportScenarioTaskTestCase(SNTMalariaTestMixin, TaskAPITestCase):
+    auto_create_account = False
+
+    def setUp(self):
+        super().setUp()
+        self.account, self.user, _, self.version, _ = self.create_snt_account_with_project(
+            permissions=[CORE_DATA_TASKS_PERMISSION]
+        )
+        category = self.create_snt_intervention_category(account=self.account, created_by=self.user, name="Chemo")
+        self.iptp = self.create_snt_intervention(
+            intervention_category=category, created_by=self.user, name="IPTp", code="iptp"
+        )
+        self.smc = self.create_snt_intervention(
+            intervention_category=category, created_by=self.user, name="SMC", code="smc"
+        )
+        district = self.create_snt_org_unit_type(name="DISTRICT")
+        geom = MultiPolygon(Polygon([[-1.3, 2.5], [-1.7, 2.8], [-1.1, 4.1], [-1.3, 2.5]]))
+        self.districts = [
+            self.create_snt_org_unit(
+                org_unit_type=district,
+                validation_status=OrgUnit.VALIDATION_VALID,
+                version=self.version,
+                geom=geom,
+            )
+            for _ in range(3)
+        ]
+        self.client.force_authenticate(self.user)
+
+    def _create_import(self, rows):
+        csv_content = "org_unit_id,org_unit_name,IPTp - iptp,SMC - smc\n" + "".join(
+            f"{org_unit_id},District,{iptp},{smc}\n" for org_unit_id, iptp, smc in rows
+        )
+        return ScenarioImport.objects.create(
+            account=self.account,
+            file=SimpleUploadedFile("scenario.csv", csv_content.encode(), content_type="text/csv"),
+            created_by=self.user,
+        )
+
+    def _valid_rows(self):
+        return [(district.id, 1, 0) for district in self.districts[:2]] + [(self.districts[2].id, 0, 1)]
+
+    def _assert_imported(self, scenario):
+        self.assertEqual(
+            set(scenario.intervention_assignments.values_list("org_unit_id", "intervention_id")),
+            {
+                (self.districts[0].id, self.iptp.id),
+                (self.districts[1].id, self.iptp.id),
+                (self.districts[2].id, self.smc.id),
+            },
+        )
+        self.assertEqual(scenario.rules.count(), 2)
+
+    def test_task_imports_scenario_in_batches(self):
+        scenario_import = self._create_import(self._valid_rows())
+        task = launch_scenario_import(scenario_import, self.user)
+        self.assertEqual(task.name, IMPORT_SCENARIO_TASK_NAME)
+        self.assertTrue(is_scenario_import_running(scenario_import))
+
+        with (
+            mock.patch("plugins.snt_malaria.tasks.import_scenario.IMPORT_CHUNK_SIZE", 2),
+            mock.patch("plugins.snt_malaria.tasks.import_scenario.ASSIGNMENT_BATCH_SIZE", 2),
+        ):
+            self.runAndValidateTask(task, "SUCCESS")
+
+        scenario_import.refresh_from_db()
+        self.assertIsNotNone(scenario_import.completed_at)
+        self.assertFalse(is_scenario_import_running(scenario_import))
+        self._assert_imported(scenario_import.scenario)
+        self.assertEqual(scenario_import.scenario.created_by, self.user)
+        self.assertFalse(scenario_import.scenario.is_locked)
+        # The uploaded file is deleted once imported.
+        self.assertFalse(scenario_import.file)
+
+    def test_scenario_is_locked_until_import_completes(self):
+        scenario_import = self._create_import(self._valid_rows())
+        locked_while_writing = []
+
+        def write_assignments(scenario_import, scenario, task):
+            locked_while_writing.append(Scenario.objects.get(id=scenario.id).is_locked)
+
+        with mock.patch("plugins.snt_malaria.tasks.import_scenario._write_assignments", side_effect=write_assignments):
+            self.runAndValidateTask(launch_scenario_import(scenario_import, self.user), "SUCCESS")
+
+        self.assertEqual(locked_while_writing, [True])
+        scenario_import.refresh_from_db()
+        self.assertFalse(scenario_import.scenario.is_locked)
+
+    def test_resumed_task_writes_only_missing_assignments(self):
+        scenario_import = self._create_import(self._valid_rows())
+        self.runAndValidateTask(launch_scenario_import(scenario_import, self.user), "SUCCESS")
+
+        # Simulate a task interrupted after its first assignment batch.
+        scenario_import.refresh_from_db()
+        scenario = scenario_import.scenario
+        scenario.intervention_assignments.exclude(org_unit=self.districts[0]).delete()
+        ScenarioImport.objects.filter(id=scenario_import.id).update(completed_at=None)
+        rule_ids = set(scenario.rules.values_list("id", flat=True))
+
+        self.runAndValidateTask(launch_scenario_import(scenario_import, self.user), "SUCCESS")
+
+        scenario_import.refresh_from_db()
+        self.assertIsNotNone(scenario_import.completed_at)
+        self.assertEqual(scenario_import.scenario_id, scenario.id)
+        self.assertEqual(Scenario.objects.filter(account=self.account).count(), 1)
+        self.assertEqual(set(scenario.rules.values_list("id", flat=True)), rule_ids)
+        self._assert_imported(scenario)
+
+    def test_stale_running_import_can_be_relaunched(self):
+        scenario_import = self._create_import(self._valid_rows())
+        stale_task = launch_scenario_import(scenario_import, self.user)
+        Task.objects.filter(id=stale_task.id).update(status="RUNNING")
+        scenario_import.refresh_from_db()
+        self.assertTrue(is_scenario_import_running(scenario_import))
+
+        # The worker died: no progress was reported for longer than STALE_IMPORT_AFTER.
+        ScenarioImport.objects.filter(id=scenario_import.id).update(
+            updated_at=timezone.now() - STALE_IMPORT_AFTER - timedelta(minutes=1)
+        )
+        scenario_import.refresh_from_db()
+        self.assertFalse(is_scenario_import_running(scenario_import))
+
+        self.runAndValidateTask(launch_scenario_import(scenario_import, self.user), "SUCCESS")
+
+        self.assertEqual(Task.objects.get(id=stale_task.id).status, "ERRORED")
+        scenario_import.refresh_from_db()
+        self.assertIsNotNone(scenario_import.completed_at)
+        self.assertFalse(scenario_import.scenario.is_locked)
+
+    def test_task_fails_on_unknown_org_units(self):
+        scenario_import = self._create_import(self._valid_rows() + [(999999, 1, 0)])
+
+        self.runAndValidateTask(launch_scenario_import(scenario_import, self.user), "ERRORED")
+
+        scenario_import.refresh_from_db()
+        self.assertIsNone(scenario_import.scenario)
+        self.assertIsNone(scenario_import.completed_at)
+        self.assertIn("not_found_org_units", Task.objects.get(id=scenario_import.task_id).result["message"])
+        self.assertFalse(Scenario.objects.filter(account=self.account).exists())
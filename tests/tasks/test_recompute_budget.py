@@ -0,0 +1,70 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from iaso.models import Task
+from iaso.permissions.core_permissions import CORE_DATA_TASKS_PERMISSION
+from iaso.tests.tasks.task_api_test_case import TaskAPITestCase
+from plugins.snt_malaria.models import Budget
+from plugins.snt_malaria.tasks.recompute_budget import (
+    RECOMPUTE_BUDGET_TASK_NAME,
+    is_budget_recompute_pending,
+    request_budget_recompute,
+)
+from plugins.snt_malaria.tests.common_base import SNTMalariaTestMixin
+
+
+class RecomputeBudgetTaskTestCase(SNTMalariaTestMixin, TaskAPITestCase):
+    auto_create_account = False
+
+    def setUp(self):
+        super().setUp()
+        self.account, self.user = self.create_snt_account(name="Main Account", permissions=[CORE_DATA_TASKS_PERMISSION])
+        self.scenario = self.create_snt_scenario(self.account, self.user, start_year=2025, end_year=2026)
+        self.create_snt_default_interventions_setup(scenario=self.scenario, account=self.account, created_by=self.user)
+
+    @override_settings(ASYNC_BUDGET_RECOMPUTE=False)
+    def test_recompute_runs_synchronously_by_default(self):
+        request_budget_recompute(self.scenario, self.user)
+
+        self.assertEqual(Budget.objects.filter(scenario=self.scenario).count(), 1)
+        self.assertEqual(Task.objects.count(), 0)
+
+    @override_settings(ASYNC_BUDGET_RECOMPUTE=True)
+    def test_burst_of_requests_is_coalesced_into_one_task(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            request_budget_recompute(self.scenario, self.user)
+            request_budget_recompute(self.scenario, self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            request_budget_recompute(self.scenario, self.user)
+
+        task = Task.objects.get(name=RECOMPUTE_BUDGET_TASK_NAME)
+        self.assertEqual(task.status, "QUEUED")
+        self.assertEqual(task.params["kwargs"]["scenario_id"], self.scenario.id)
+        self.assertTrue(is_budget_recompute_pending(self.scenario))
+        self.assertFalse(Budget.objects.filter(scenario=self.scenario).exists())
+
+    @override_settings(ASYNC_BUDGET_RECOMPUTE=True)
+    def test_enqueue_checks_queued_tasks_under_scenario_lock(self):
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            request_budget_recompute(self.scenario, self.user)
+
+        statements = [query["sql"] for query in queries.captured_queries]
+        lock_index = next(index for index, sql in enumerate(statements) if "FOR UPDATE" in sql)
+        self.assertIn('"snt_malaria_scenario"', statements[lock_index])
+        # The queued-task check comes after the lock.
+        self.assertTrue(any('"iaso_task"' in sql for sql in statements[lock_index + 1 :]))
+
+    @override_settings(ASYNC_BUDGET_RECOMPUTE=True)
+    def test_task_computes_budget(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            request_budget_recompute(self.scenario, self.user)
+        task = Task.objects.get(name=RECOMPUTE_BUDGET_TASK_NAME)
+
+        self.client.force_authenticate(self.user)
+        self.runAndValidateTask(task, "SUCCESS")
+
+        budget = Budget.objects.get(scenario=self.scenario)
+        self.assertEqual([result["year"] for result in budget.results], [2025, 2026])
+        self.assertEqual(budget.created_by, self.user)
+        self.assertFalse(is_budget_recompute_pending(self.scenario))